@@ -3,7 +3,6 @@
 
 from typing import Sequence
 
-from absl import app
 from absl import logging
 
 import download_helper
@@ -26,5 +25,5 @@ def main(argv: Sequence[str]) -> None:
 
 
 if __name__ == "__main__":
-    app.run(main)
+    download_helper.run(main)
 
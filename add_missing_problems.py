@@ -3,7 +3,6 @@
 
 from typing import Sequence
 
-from absl import app
 from absl import logging
 
 import download_helper
@@ -39,5 +38,5 @@ def main(argv: Sequence[str]) -> None:
             download_helper.save_run_data(run_data)
 
 if __name__ == "__main__":
-    app.run(main)
+    download_helper.run(main)
 
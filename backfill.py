@@ -0,0 +1,207 @@
+"""This module runs a worker of a backfill shared by several processes.
+
+Any number of workers can be started for the same stage. Each worker
+claims a slice of the pending emails or links with a lease, processes it
+with the same code as download_links.py or download_solutions.py, and
+merges its changes into the data file under a file lock. The leases are
+extended while the worker runs, so the slices of a crashed worker are
+claimed again by the other workers once its leases expire.
+
+A slice that could not be processed is released right away, and is
+left to the other workers or to a later run.
+"""
+
+from typing import Dict
+from typing import Sequence
+
+from absl import flags
+from absl import logging
+
+import download_helper
+import download_links
+import download_solutions
+import gmail_service
+import html_service
+import leases
+import tracing
+
+
+_STAGE = flags.DEFINE_enum(
+    'stage', 'links',
+    ['links', 'solutions'],
+    'The stage whose pending items are processed')
+_LEASE_FILE = flags.DEFINE_string(
+    'lease_file', 'data/leases.sqlite',
+    'The path of the database where the leases of the workers are kept')
+_LEASE_DURATION = flags.DEFINE_integer(
+    'lease_duration', 300,
+    'Seconds after which the slice of a worker that stopped is claimed again')
+_LEASE_SIZE = flags.DEFINE_integer(
+    'lease_size', 20,
+    'Number of items claimed at once by a worker')
+
+
+def merge_links(run_data: Dict[str, object], slice_data: Dict[str, object]) -> None:
+    """Merges the emails, links and problems of a slice into the run data.
+
+    Args:
+        run_data: The latest state of the runtime data
+        slice_data: The state of the slice after it was processed
+    """
+
+    new_emails = {email_id: subject
+        for email_id, subject in slice_data['emails'].items() if subject}
+    run_data['emails'] = download_links.collect_all_emails(
+        new_emails, run_data.get('emails', {}))
+    run_data['links'] = download_links.collect_all_links(
+        slice_data.get('links', {}).keys(), run_data.get('links', {}))
+
+    problems = run_data.get('problems', {})
+    for problem_id, difficulty in slice_data.get('problems', {}).items():
+        problems.setdefault(problem_id, difficulty)
+    run_data['problems'] = problems
+
+
+def merge_solutions(run_data: Dict[str, object], slice_data: Dict[str, object]) -> None:
+    """Merges the downloaded solutions of a slice into the run data.
+
+    Args:
+        run_data: The latest state of the runtime data
+        slice_data: The state of the slice after it was processed
+    """
+
+    links = run_data.get('links', {})
+    for link, file_path in slice_data['links'].items():
+        if file_path:
+            links[link] = file_path
+    run_data['links'] = links
+
+
+def backfill_links(
+    store: leases.LeaseStore,
+    gmail_services: Dict[str, gmail_service.GmailService],
+    lease_size: int) -> int:
+    """Processes slices of the pending emails until none is left.
+
+    Args:
+        store: The leases shared by the workers
+        gmail_services: The gmail service of each account
+        lease_size: Number of emails claimed at once
+
+    Returns:
+        The number of emails processed by this worker
+    """
+
+    run_data = download_helper.get_run_data()
+    pending = [email_id for email_id, subject in run_data.get('emails', {}).items() if not subject]
+    logging.info('Found %d pending emails', len(pending))
+
+    # an email that failed is not claimed again by the same worker
+    attempted = set()
+    processed = 0
+    while True:
+        claimed = store.claim(
+            'emails', [email_id for email_id in pending if email_id not in attempted], lease_size)
+        if not claimed:
+            break
+
+        attempted.update(claimed)
+        slice_data = {
+            'emails': {email_id: None for email_id in claimed},
+            'email_accounts': run_data.get('email_accounts', {}),
+        }
+
+        done = []
+        try:
+            with tracing.span('backfill.links', emails=len(claimed)):
+                download_links.update_links(slice_data, gmail_services, len(claimed))
+                download_helper.update_run_data(lambda latest: merge_links(latest, slice_data))
+
+            done = [email_id for email_id in claimed if slice_data['emails'].get(email_id)]
+            store.complete('emails', done)
+            processed += len(done)
+        finally:
+            store.release('emails', [email_id for email_id in claimed if email_id not in done])
+
+    return processed
+
+
+def backfill_solutions(
+    store: leases.LeaseStore,
+    html_svc: html_service.Html_Service,
+    lease_size: int) -> int:
+    """Processes slices of the pending links until none is left.
+
+    Args:
+        store: The leases shared by the workers
+        html_svc: The html service used to fetch the solutions
+        lease_size: Number of links claimed at once
+
+    Returns:
+        The number of links processed by this worker
+    """
+
+    run_data = download_helper.get_run_data()
+    pending = [link for link, file_path in run_data.get('links', {}).items() if not file_path]
+    logging.info('Found %d pending links', len(pending))
+
+    # a link that failed is not claimed again by the same worker
+    attempted = set()
+    processed = 0
+    while True:
+        claimed = store.claim(
+            'links', [link for link in pending if link not in attempted], lease_size)
+        if not claimed:
+            break
+
+        attempted.update(claimed)
+        slice_data = {
+            'links': {link: None for link in claimed},
+            'problems': run_data.get('problems', {}),
+            'solution_paths': run_data.get('solution_paths', {}),
+        }
+
+        done = []
+        try:
+            with tracing.span('backfill.solutions', links=len(claimed)):
+                download_solutions.update_solutions(slice_data, html_svc, len(claimed))
+                # the difficulties found by the workers of the links stage
+                # are picked up for the next slice
+                run_data = download_helper.update_run_data(
+                    lambda latest: merge_solutions(latest, slice_data))
+
+            done = [link for link in claimed if slice_data['links'].get(link)]
+            store.complete('links', done)
+            processed += len(done)
+        finally:
+            store.release('links', [link for link in claimed if link not in done])
+
+    return processed
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    store = leases.LeaseStore(_LEASE_FILE.value, _LEASE_DURATION.value)
+    logging.info('Starting worker %s for the %s stage', store.get_owner(), _STAGE.value)
+
+    with store.keep_alive():
+        if _STAGE.value == 'links':
+            processed = backfill_links(
+                store,
+                download_helper.init_and_get_gmail_services(),
+                _LEASE_SIZE.value)
+        else:
+            processed = backfill_solutions(
+                store,
+                download_helper.init_and_get_html_service(),
+                _LEASE_SIZE.value)
+
+    logging.info('Processed %d items', processed)
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
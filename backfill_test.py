@@ -0,0 +1,59 @@
+"""Tests the workers of the backfill.
+"""
+
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+from absl.testing import flagsaver
+
+import os
+import pickle
+
+import backfill
+import dcp_service
+import download_helper
+import leases
+
+
+_SUBJECT = 'Daily Coding Problem: Welcome to the premium plan'
+
+
+class BackfillLinksTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        if not flags.FLAGS.is_parsed():
+            flags.FLAGS.mark_as_parsed()
+
+        temp_dir = self.create_tempdir().full_path
+        self._data_file = os.path.join(temp_dir, 'data.pickle')
+        self._store = leases.LeaseStore(os.path.join(temp_dir, 'leases.sqlite'))
+        self.enter_context(flagsaver.flagsaver(
+            data_file=self._data_file, token_file='account', fetch_workers=1))
+
+
+    def test_completes_emails_without_links(self):
+        # neither email is about a problem, hence none yields a link or a problem
+        with open(self._data_file, 'wb') as file:
+            pickle.dump({
+                'emails': {'a1': None, 'b2': None},
+                'links': {},
+            }, file)
+
+        def get_subject_and_links(dcp_svc, emails, *args):
+            return {email_id: _SUBJECT for email_id in emails}, set()
+
+        with mock.patch.object(
+            dcp_service.DCP_Service, 'get_subject_and_links', get_subject_and_links):
+            processed = backfill.backfill_links(self._store, {'account': None}, 10)
+
+        self.assertEqual(processed, 2)
+        self.assertEqual(
+            download_helper.get_run_data()['emails'], {'a1': _SUBJECT, 'b2': _SUBJECT})
+        # another worker finds nothing left to claim
+        self.assertEmpty(leases.LeaseStore(self._store._db_file).claim('emails', ['a1', 'b2'], 10))
+
+
+if __name__ == '__main__':
+    absltest.main()
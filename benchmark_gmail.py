@@ -0,0 +1,145 @@
+"""This module benchmarks the gmail backends against a local stand-in.
+
+The stand-in of chaos.py serves synthetic messages without any fault.
+Each backend runs in a fresh process, so that the import of its modules
+is measured, and reports:
+
+* the import time of the modules of the backend
+* the startup time, from the start of the process to the response of
+  the first search, hence including the loading of the discovery document
+* the searches per second, one after the other
+* the message fetches per second, with each number of workers
+
+The quota of the account is lifted so that only the clients are
+measured. The stand-in speaks HTTP/1.1 without TLS, hence the rest
+backend reuses its connections but doesn't multiplex them over HTTP/2.
+"""
+
+from typing import Dict
+from typing import Sequence
+
+from absl import flags
+from absl import logging
+
+import json
+import os
+import subprocess
+import sys
+
+import chaos
+import download_helper
+
+
+_BENCHMARK_CALLS = flags.DEFINE_integer(
+    'benchmark_calls', 200,
+    'Number of searches and of message fetches measured for every backend')
+_BENCHMARK_WORKERS = flags.DEFINE_list(
+    'benchmark_workers', ['1', '8'],
+    'Numbers of messages fetched at the same time')
+
+_BACKENDS = ('discovery', 'rest')
+
+# runs a backend against the stand-in and reports its measures, the
+# gmail requests of the discovery backend are redirected to the stand-in
+_CLIENT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+backend, root, calls = sys.argv[1], sys.argv[2], int(sys.argv[3])
+workers = [int(count) for count in sys.argv[4].split(',')]
+
+import ratelimiter
+if backend == 'rest':
+    import gmail_rest
+else:
+    import gmail_service, httplib2, threading
+imported = time.perf_counter()
+
+limiter = ratelimiter.RateLimiter(max_calls=10 ** 9, period=1)
+if backend == 'rest':
+    gmail_svc = gmail_rest.RestGmailService(
+        None, limiter=limiter, base_url=root + 'gmail/v1/users/me/')
+else:
+    class RedirectHttp():
+        def __init__(self):
+            self._local = threading.local()
+        def request(self, uri, *args, **kwargs):
+            if not hasattr(self._local, 'http'):
+                self._local.http = httplib2.Http()
+            uri = uri.replace('https://gmail.googleapis.com/', root, 1)
+            return self._local.http.request(uri, *args, **kwargs)
+    gmail_svc = gmail_service.GmailService(None, http=RedirectHttp(), limiter=limiter)
+gmail_svc.load_gmail_resource()
+message_ids, _ = gmail_svc.search_messages('subject:(Daily Coding Problem)', None, calls)
+started = time.perf_counter()
+
+for _ in range(calls):
+    gmail_svc.search_messages('subject:(Daily Coding Problem)', None, 1)
+searched = time.perf_counter()
+
+fetches = {}
+for count in workers:
+    fetch_start = time.perf_counter()
+    assert len(list(gmail_svc.get_messages(message_ids, count))) == len(message_ids)
+    fetches[count] = len(message_ids) / (time.perf_counter() - fetch_start)
+
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'startup_ms': (started - start) * 1000,
+    'searches': calls / (searched - started),
+    'fetches': fetches,
+}))
+'''
+
+
+def measure_backend(backend: str, root: str, calls: int, workers: Sequence[int]) -> Dict[str, object]:
+    """Runs a backend against the stand-in in a fresh process and returns its measures.
+
+    Args:
+        backend: The name of the backend
+        root: The root url of the stand-in
+        calls: The number of searches and of message fetches
+        workers: The numbers of messages fetched at the same time
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-c', _CLIENT_SCRIPT, backend, root, str(calls),
+            ','.join(map(str, workers))],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True)
+
+    return json.loads(result.stdout)
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    calls = _BENCHMARK_CALLS.value
+    workers = [int(count) for count in _BENCHMARK_WORKERS.value]
+    messages, _ = chaos.generate_documents(calls)
+    stand_in = chaos.start_gmail_stand_in(messages, chaos.FaultInjector({}, 0))
+    root = f'http://127.0.0.1:{stand_in.server_address[1]}/'
+
+    try:
+        results = {}
+        for backend in _BACKENDS:
+            logging.info('Benchmarking the %s backend', backend)
+            results[backend] = measure_backend(backend, root, calls, workers)
+    finally:
+        stand_in.shutdown()
+        stand_in.server_close()
+
+    fetch_headers = ' '.join(f'{f"fetch/s x{count}":>12}' for count in workers)
+    print(f'{"backend":<10} {"import ms":>10} {"startup ms":>11} {"search/s":>9} {fetch_headers}')
+    for backend, result in results.items():
+        fetches = ' '.join(f'{result["fetches"][str(count)]:>12.0f}' for count in workers)
+        print(f'{backend:<10} {result["import_ms"]:>10.0f} {result["startup_ms"]:>11.0f} '
+            f'{result["searches"]:>9.0f} {fetches}')
+
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
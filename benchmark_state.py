@@ -0,0 +1,138 @@
+"""This module benchmarks the compact state against the run data pickle.
+
+Synthetic run data is generated for every size, with as many emails,
+links and problems as the size, and saved both as the run data pickle
+and as the compact state pickle. Each pickle is loaded in a fresh
+process, so that the memory of one load doesn't hide the other, and the
+size of the file, the load time and the resident memory added by the
+load are reported. The memory is read from procfs, hence on Linux only.
+"""
+
+from typing import Dict
+from typing import Sequence
+
+from absl import flags
+from absl import logging
+
+import json
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+
+import download_helper
+import state_model
+
+
+_SIZES = flags.DEFINE_list(
+    'sizes', ['10000', '100000'],
+    'Number of emails, links and problems of each benchmarked run data')
+
+_DIFFICULTIES = ['Easy', 'Medium', 'Hard']
+_SUBJECT_FORMATS = [
+    'Daily Coding Problem: Problem #{} [{}]',
+    'Fwd: Daily Coding Problem: Problem #{} [{}]',
+    'Daily Coding Problem: Problem #{}',
+]
+_SUBJECT_WEIGHTS = [18, 1, 1]
+
+# loads a pickle and reports the load time and the resident memory it added,
+# read from procfs since the peak memory of the process includes its imports
+_LOAD_SCRIPT = '''
+import json, os, pickle, sys, time
+import state_model
+def get_rss_kb():
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+before = get_rss_kb()
+start = time.perf_counter()
+with open(sys.argv[1], 'rb') as file:
+    data = pickle.load(file)
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'rss_kb': get_rss_kb() - before}))
+'''
+
+
+def generate_run_data(size: int) -> Dict[str, object]:
+    """Returns synthetic run data with as many emails, links and problems as the size.
+
+    Three quarters of the emails are processed and of the links downloaded.
+    A tenth of the subjects are not in the standard format, e.g. forwarded,
+    as found in real mailboxes.
+
+    Args:
+        size: The number of items of each kind
+    """
+
+    rng = random.Random(size)
+    solutions_dir = download_helper.get_solutions_dir()
+
+    problems = {}
+    emails = {}
+    links = {}
+    for problem_id in range(1, size + 1):
+        difficulty = _DIFFICULTIES[rng.randrange(len(_DIFFICULTIES))]
+        problems[problem_id] = difficulty
+
+        email_id = f'{rng.getrandbits(60) | 1 << 60:x}'
+        processed = rng.random() < 0.75
+        subject_format = rng.choices(_SUBJECT_FORMATS, _SUBJECT_WEIGHTS)[0]
+        emails[email_id] = subject_format.format(problem_id, difficulty) if processed else None
+
+        token = f'{rng.getrandbits(128):032x}'
+        link = f'https://www.dailycodingproblem.com/solution/{problem_id}?token={token}'
+        downloaded = rng.random() < 0.75
+        links[link] = (os.path.join(solutions_dir, difficulty, f'problem_{problem_id:03d}.md')
+            if downloaded else None)
+
+    return {
+        'problems': problems,
+        'emails': emails,
+        'links': links,
+        'last_email_fetch_at': 1600000000,
+    }
+
+
+def measure_load(file_path: str) -> Dict[str, float]:
+    """Loads a pickle in a fresh process and returns its load time and memory.
+
+    Args:
+        file_path: The path of the pickle
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-c', _LOAD_SCRIPT, file_path],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True)
+
+    return json.loads(result.stdout)
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    print(f'{"items":>8} {"format":<8} {"file KB":>9} {"load ms":>9} {"RSS MB":>8}')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in map(int, _SIZES.value):
+            logging.info('Benchmarking %d items', size)
+            run_data = generate_run_data(size)
+            state = state_model.CompactState.from_run_data(
+                run_data, download_helper.get_solutions_dir())
+            assert state.to_run_data() == run_data, 'The compact state lost data'
+
+            for name, data in (('dict', run_data), ('compact', state)):
+                file_path = os.path.join(temp_dir, f'{name}_{size}.pickle')
+                with open(file_path, 'wb') as file:
+                    pickle.dump(data, file)
+
+                load = measure_load(file_path)
+                print(f'{size:>8} {name:<8} {os.path.getsize(file_path) / 1024:>9.0f} '
+                    f'{load["seconds"] * 1000:>9.1f} {load["rss_kb"] / 1024:>8.1f}')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
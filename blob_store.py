@@ -0,0 +1,149 @@
+"""This module stores the solution files in a content addressed blob store.
+
+The content of every file is stored once as a blob named after its hash,
+and every solution path is a hardlink to its blob. Identical solutions
+hence share the same storage, and a snapshot of the solutions folder made
+with hardlinks, e.g. `cp -al` or `rsync --link-dest`, only copies the
+content that is new.
+
+The blobs are read only, so that a solution cannot be changed in place
+by mistake and change every other solution that shares its content.
+The solution files being hardlinks, they are read only as well. A file
+that should be edited is first detached, i.e. replaced by a writable
+copy of its own. When the filesystem doesn't support hardlinks the
+content is copied.
+
+Methods:
+    __init__ : to create the store in the specified folder
+    put : to store a content and return its hash
+    link : to make a path point to a stored content
+    adopt : to move an existing file into the store
+    detach : to replace a linked path with a writable copy
+"""
+
+from absl import logging
+
+import hashlib
+import os
+import shutil
+import stat
+import uuid
+
+
+class Error(Exception):
+    """The base exception class for this module.
+    """
+
+
+class BlobNotFoundError(Error):
+    """No blob is stored for the hash.
+    """
+
+
+class BlobStore():
+    """Stores contents once and links paths to them.
+
+    Attributes:
+        _root: The folder in which the blobs are stored
+    """
+
+    def __init__(self, root: str) -> None:
+        self._root = root
+
+
+    def get_blob_path(self, digest: str) -> str:
+        """Returns the path of the blob of a hash.
+
+        Args:
+            digest: The hash of the content
+        """
+
+        return os.path.join(self._root, digest[:2], digest)
+
+
+    def put(self, content: bytes) -> str:
+        """Stores the content unless it is already stored.
+
+        Args:
+            content: The content to be stored
+
+        Returns:
+            The hash of the content
+        """
+
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self.get_blob_path(digest)
+
+        if os.path.exists(blob_path):
+            logging.info('Content %s is already stored', digest[:12])
+            return digest
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        temp_path = f'{blob_path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(content)
+        os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(temp_path, blob_path)
+
+        logging.info('Stored content %s', digest[:12])
+        return digest
+
+
+    def link(self, digest: str, file_path: str) -> None:
+        """Makes the path point to the stored content.
+
+        Any existing file at the path is replaced atomically.
+
+        Args:
+            digest: The hash of the content
+            file_path: The path that should have the content
+
+        Raises:
+            BlobNotFoundError: No content is stored for the hash
+        """
+
+        blob_path = self.get_blob_path(digest)
+        if not os.path.exists(blob_path):
+            raise BlobNotFoundError(f'No content stored for {digest}')
+
+        if os.path.exists(file_path) and os.path.samefile(blob_path, file_path):
+            return
+
+        temp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.link(blob_path, temp_path)
+        except OSError:
+            logging.warning('Unable to hardlink %s, copying the content', file_path)
+            shutil.copyfile(blob_path, temp_path)
+        os.replace(temp_path, file_path)
+
+
+    def adopt(self, file_path: str) -> str:
+        """Moves the content of an existing file into the store.
+
+        Args:
+            file_path: The path of the file
+
+        Returns:
+            The hash of the content
+        """
+
+        with open(file_path, 'rb') as file:
+            digest = self.put(file.read())
+
+        self.link(digest, file_path)
+        return digest
+
+
+    def detach(self, file_path: str) -> None:
+        """Replaces the path with a writable copy of its content.
+
+        The blob and the other paths linked to it are left unchanged.
+
+        Args:
+            file_path: The path of the file
+        """
+
+        temp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+        shutil.copyfile(file_path, temp_path)
+        os.replace(temp_path, file_path)
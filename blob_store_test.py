@@ -0,0 +1,95 @@
+"""Tests the content addressed store of the solution files.
+"""
+
+from absl import flags
+from absl.testing import absltest
+
+import os
+import stat
+
+import blob_store
+
+
+def _is_writable(file_path: str) -> bool:
+    return bool(os.stat(file_path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+class BlobStoreTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        if not flags.FLAGS.is_parsed():
+            flags.FLAGS.mark_as_parsed()
+        self._dir = self.create_tempdir().full_path
+        self._store = blob_store.BlobStore(os.path.join(self._dir, '.blobs'))
+
+
+    def _read(self, name: str) -> bytes:
+        with open(os.path.join(self._dir, name), 'rb') as file:
+            return file.read()
+
+
+    def test_put_stores_read_only_blob(self):
+        digest = self._store.put(b'## Problem #1')
+
+        blob_path = self._store.get_blob_path(digest)
+        with open(blob_path, 'rb') as file:
+            self.assertEqual(file.read(), b'## Problem #1')
+        self.assertFalse(_is_writable(blob_path))
+
+
+    def test_same_content_is_stored_once(self):
+        first = self._store.put(b'same')
+        second = self._store.put(b'same')
+        self.assertEqual(first, second)
+
+        self._store.link(first, os.path.join(self._dir, 'a.md'))
+        self._store.link(second, os.path.join(self._dir, 'b.md'))
+
+        self.assertTrue(os.path.samefile(
+            os.path.join(self._dir, 'a.md'), os.path.join(self._dir, 'b.md')))
+        self.assertEqual(os.stat(self._store.get_blob_path(first)).st_nlink, 3)
+
+
+    def test_link_replaces_content(self):
+        file_path = os.path.join(self._dir, 'a.md')
+        self._store.link(self._store.put(b'old'), file_path)
+        self._store.link(self._store.put(b'new'), file_path)
+
+        self.assertEqual(self._read('a.md'), b'new')
+        self.assertFalse(_is_writable(file_path))
+
+
+    def test_link_of_unknown_content(self):
+        with self.assertRaises(blob_store.BlobNotFoundError):
+            self._store.link('0' * 64, os.path.join(self._dir, 'a.md'))
+
+
+    def test_adopt_moves_file_into_store(self):
+        file_path = os.path.join(self._dir, 'a.md')
+        with open(file_path, 'wb') as file:
+            file.write(b'saved before')
+
+        digest = self._store.adopt(file_path)
+
+        self.assertTrue(os.path.samefile(file_path, self._store.get_blob_path(digest)))
+
+
+    def test_detach_leaves_blob_unchanged(self):
+        digest = self._store.put(b'shared')
+        self._store.link(digest, os.path.join(self._dir, 'a.md'))
+        self._store.link(digest, os.path.join(self._dir, 'b.md'))
+
+        file_path = os.path.join(self._dir, 'a.md')
+        self._store.detach(file_path)
+        self.assertTrue(_is_writable(file_path))
+        with open(file_path, 'wb') as file:
+            file.write(b'edited')
+
+        self.assertEqual(self._read('b.md'), b'shared')
+        with open(self._store.get_blob_path(digest), 'rb') as file:
+            self.assertEqual(file.read(), b'shared')
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,361 @@
+"""This module will build a static HTML site from the downloaded solutions.
+
+Every solution file is rendered into its own HTML page and every
+difficulty folder gets an index page linking to its problems. The
+problems whose difficulty is not known yet are listed under an explicit
+label instead of as a difficulty of their own.
+
+The build is incremental. A manifest stores the size, modification time
+and content hash of every rendered solution, so only the solutions that
+were added or changed since the last build are rendered again.
+"""
+
+from typing import Dict
+from typing import Sequence
+from typing import Tuple
+
+from absl import flags
+from absl import logging
+
+from concurrent import futures
+import hashlib
+import html
+import os
+import pickle
+import re
+
+import markdown
+
+import download_helper
+
+
+_SITE_DIR = flags.DEFINE_string(
+    'site_dir', 'site',
+    'The folder where the HTML site is built')
+_SITE_MANIFEST_FILE = flags.DEFINE_string(
+    'site_manifest_file', 'data/site_manifest.pickle',
+    'The path where the state of the last site build is saved')
+_WORKERS = flags.DEFINE_integer(
+    'workers', None,
+    'Number of processes used to render the pages, defaults to the CPU count')
+_REBUILD = flags.DEFINE_boolean(
+    'rebuild', False,
+    'Render all the pages even if they did not change')
+
+_PROBLEM_FILE_PATTERN = re.compile(r'^problem_(\d+)\.md$')
+
+# the folder download_solutions saves problems in until their difficulty is known
+_DIFFICULTY_LABELS = {'Unknown': 'Difficulty not known yet'}
+
+_PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+</head>
+<body>
+{body}
+</body>
+</html>
+'''
+
+
+def scan_solutions(solutions_dir: str) -> Dict[str, Tuple[str, int, int, int]]:
+    """Returns all the solution files in the solutions folder.
+
+    Args:
+        solutions_dir: The folder with one sub folder per difficulty
+
+    Returns:
+        A dictionary of file path and a tuple of difficulty, problem id,
+        modification time and size of the file
+    """
+
+    logging.info('Scanning solutions in %s', solutions_dir)
+
+    solutions = {}
+    for difficulty_entry in os.scandir(solutions_dir):
+        if not difficulty_entry.is_dir() or difficulty_entry.name.startswith('.'):
+            continue
+
+        for entry in os.scandir(difficulty_entry.path):
+            match = _PROBLEM_FILE_PATTERN.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+
+            stat = entry.stat()
+            solutions[entry.path] = (
+                difficulty_entry.name,
+                int(match.group(1)),
+                stat.st_mtime_ns,
+                stat.st_size)
+
+    logging.info('Found %d solutions', len(solutions))
+    return solutions
+
+
+def get_content_hash(file_path: str) -> str:
+    """Returns the hash of the content of a file.
+
+    Args:
+        file_path: The path of the file
+    """
+
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def get_page_path(site_dir: str, difficulty: str, problem_id: int) -> str:
+    """Returns the path of the HTML page of a problem.
+
+    Args:
+        site_dir: The folder where the site is built
+        difficulty: The difficulty of the problem
+        problem_id: The problem number
+    """
+
+    return os.path.join(site_dir, difficulty, f'problem_{problem_id:03d}.html')
+
+
+def render_page(file_path: str, page_path: str, problem_id: int) -> str:
+    """Renders a markdown solution into an HTML page.
+
+    This runs in a worker process and hence only uses its arguments.
+
+    Args:
+        file_path: The path of the markdown solution
+        page_path: The path where the HTML page is written
+        problem_id: The problem number
+
+    Returns:
+        The path of the HTML page
+    """
+
+    with open(file_path, 'r') as file:
+        content = file.read()
+
+    body = markdown.markdown(content, extensions=['fenced_code'])
+    page = _PAGE_TEMPLATE.format(title=f'Problem #{problem_id}', body=body)
+
+    with open(page_path, 'w') as file:
+        file.write(page)
+
+    return page_path
+
+
+def render_pages(pages: Sequence[Tuple[str, str, int]], workers: int) -> None:
+    """Renders the solutions into HTML pages on a process pool.
+
+    Args:
+        pages: A list of solution path, page path and problem id
+        workers: The number of worker processes
+    """
+
+    logging.info('Rendering %d pages', len(pages))
+
+    # starting the pool costs more than rendering a few pages
+    if len(pages) <= 1:
+        for file_path, page_path, problem_id in pages:
+            render_page(file_path, page_path, problem_id)
+        return
+
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = [executor.submit(render_page, *page) for page in pages]
+        for task in futures.as_completed(tasks):
+            logging.debug('Rendered %s', task.result())
+
+
+def get_difficulty_label(difficulty: str) -> str:
+    """Returns the label of a difficulty folder shown on the index pages.
+
+    Args:
+        difficulty: The name of the difficulty folder
+    """
+
+    return _DIFFICULTY_LABELS.get(difficulty, difficulty)
+
+
+def remove_index_page(site_dir: str, difficulty: str) -> None:
+    """Removes the index page of a difficulty that no longer has problems.
+
+    The folder of the difficulty is removed as well once it is empty.
+
+    Args:
+        site_dir: The folder where the site is built
+        difficulty: The difficulty of the problems
+    """
+
+    difficulty_dir = os.path.join(site_dir, difficulty)
+    index_path = os.path.join(difficulty_dir, 'index.html')
+    if os.path.exists(index_path):
+        logging.info('Removing index page %s', index_path)
+        os.remove(index_path)
+
+    if os.path.isdir(difficulty_dir) and not os.listdir(difficulty_dir):
+        os.rmdir(difficulty_dir)
+
+
+def write_index_page(site_dir: str, difficulty: str, problem_ids: Sequence[int]) -> None:
+    """Writes the index page of a difficulty.
+
+    Args:
+        site_dir: The folder where the site is built
+        difficulty: The difficulty of the problems
+        problem_ids: The sorted list of problem numbers
+    """
+
+    logging.info('Writing index of %d %s problems', len(problem_ids), difficulty)
+
+    label = html.escape(get_difficulty_label(difficulty))
+    items = [f'<li><a href="problem_{problem_id:03d}.html">Problem #{problem_id}</a></li>'
+        for problem_id in problem_ids]
+    body = f'<h1>{label}</h1>\n<ul>\n' + '\n'.join(items) + '\n</ul>'
+    page = _PAGE_TEMPLATE.format(title=label, body=body)
+
+    with open(os.path.join(site_dir, difficulty, 'index.html'), 'w') as file:
+        file.write(page)
+
+
+def write_root_index_page(site_dir: str, indexes: Dict[str, Sequence[int]]) -> None:
+    """Writes the index page linking to every difficulty.
+
+    Args:
+        site_dir: The folder where the site is built
+        indexes: A dictionary of difficulty and the problem numbers
+    """
+
+    logging.info('Writing root index page')
+
+    items = [f'<li><a href="{html.escape(difficulty)}/index.html">'
+        f'{html.escape(get_difficulty_label(difficulty))}</a> ({len(indexes[difficulty])})</li>'
+        for difficulty in sorted(indexes)]
+    body = '<h1>Daily Coding Problem</h1>\n<ul>\n' + '\n'.join(items) + '\n</ul>'
+    page = _PAGE_TEMPLATE.format(title='Daily Coding Problem', body=body)
+
+    with open(os.path.join(site_dir, 'index.html'), 'w') as file:
+        file.write(page)
+
+
+def get_manifest() -> Dict[str, object]:
+    """Loads the state of the last site build.
+    """
+
+    manifest = {}
+    if os.path.exists(_SITE_MANIFEST_FILE.value):
+        with open(_SITE_MANIFEST_FILE.value, 'rb') as file:
+            manifest = pickle.load(file)
+    else:
+        logging.warning('No site manifest found, building the full site')
+
+    return manifest
+
+
+def save_manifest(manifest: Dict[str, object]) -> None:
+    """Saves the state of the site build.
+
+    Args:
+        manifest: The state of the site build
+    """
+
+    logging.info('Writing site manifest: %s', _SITE_MANIFEST_FILE.value)
+    with open(_SITE_MANIFEST_FILE.value, 'wb') as file:
+        pickle.dump(manifest, file)
+
+
+def build_site(
+    solutions: Dict[str, Tuple[str, int, int, int]],
+    manifest: Dict[str, object],
+    site_dir: str,
+    workers: int,
+    rebuild: bool) -> Dict[str, object]:
+    """Renders all the new and changed solutions and the index pages.
+
+    A solution with the same size and modification time as in the last
+    build is not read at all. Otherwise it is only rendered if the hash
+    of its content changed.
+
+    Args:
+        solutions: The scanned solution files
+        manifest: The state of the last build
+        site_dir: The folder where the site is built
+        workers: The number of worker processes
+        rebuild: Whether to render all the pages
+
+    Returns:
+        The state of this build
+    """
+
+    old_files = manifest.get('files', {})
+    old_indexes = manifest.get('indexes', {})
+
+    files = {}
+    indexes = {}
+    pages = []
+    for file_path, (difficulty, problem_id, mtime, size) in solutions.items():
+        indexes.setdefault(difficulty, []).append(problem_id)
+        old_file = old_files.get(file_path)
+        page_path = get_page_path(site_dir, difficulty, problem_id)
+        is_rendered = not rebuild and old_file and os.path.exists(page_path)
+
+        if is_rendered and old_file[:2] == (mtime, size):
+            files[file_path] = old_file
+            continue
+
+        content_hash = get_content_hash(file_path)
+        files[file_path] = (mtime, size, content_hash)
+
+        if is_rendered and old_file[2] == content_hash:
+            continue
+
+        pages.append((file_path, page_path, problem_id))
+
+    for difficulty in indexes:
+        indexes[difficulty] = sorted(indexes[difficulty])
+        os.makedirs(os.path.join(site_dir, difficulty), exist_ok=True)
+
+    render_pages(pages, workers)
+
+    # remove the pages of solutions that no longer exist
+    for file_path in old_files.keys() - files.keys():
+        difficulty = os.path.basename(os.path.dirname(file_path))
+        problem_id = int(_PROBLEM_FILE_PATTERN.match(os.path.basename(file_path)).group(1))
+        page_path = get_page_path(site_dir, difficulty, problem_id)
+        if os.path.exists(page_path):
+            logging.info('Removing page %s', page_path)
+            os.remove(page_path)
+
+    for difficulty, problem_ids in indexes.items():
+        if rebuild or old_indexes.get(difficulty) != problem_ids:
+            write_index_page(site_dir, difficulty, problem_ids)
+
+    # remove the index pages of difficulties that no longer have problems
+    for difficulty in old_indexes.keys() - indexes.keys():
+        remove_index_page(site_dir, difficulty)
+
+    if rebuild or indexes != old_indexes:
+        write_root_index_page(site_dir, indexes)
+
+    logging.info('Rendered %d / %d pages', len(pages), len(solutions))
+    return {'files': files, 'indexes': indexes}
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    solutions = scan_solutions(download_helper.get_solutions_dir())
+    manifest = get_manifest()
+    manifest = build_site(
+        solutions,
+        manifest,
+        _SITE_DIR.value,
+        _WORKERS.value,
+        _REBUILD.value)
+    save_manifest(manifest)
+
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
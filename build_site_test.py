@@ -0,0 +1,63 @@
+"""Tests the index pages of the static site.
+"""
+
+from absl import flags
+from absl.testing import absltest
+
+import os
+
+import build_site
+
+
+class BuildSiteTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        if not flags.FLAGS.is_parsed():
+            flags.FLAGS.mark_as_parsed()
+        self._solutions_dir = self.create_tempdir().full_path
+        self._site_dir = self.create_tempdir().full_path
+
+
+    def _write_solution(self, difficulty: str, problem_id: int) -> None:
+        os.makedirs(os.path.join(self._solutions_dir, difficulty), exist_ok=True)
+        file_path = os.path.join(self._solutions_dir, difficulty, f'problem_{problem_id:03d}.md')
+        with open(file_path, 'w') as file:
+            file.write(f'## Problem #{problem_id}')
+
+
+    def _build(self, manifest):
+        solutions = build_site.scan_solutions(self._solutions_dir)
+        return build_site.build_site(solutions, manifest, self._site_dir, 1, False)
+
+
+    def _read(self, *path: str) -> str:
+        with open(os.path.join(self._site_dir, *path), 'r') as file:
+            return file.read()
+
+
+    def test_unknown_difficulty_is_labelled(self):
+        self._write_solution('Easy', 1)
+        self._write_solution('Unknown', 2)
+
+        self._build({})
+
+        self.assertIn('<h1>Difficulty not known yet</h1>', self._read('Unknown', 'index.html'))
+        self.assertIn('Difficulty not known yet</a> (1)', self._read('index.html'))
+
+
+    def test_removes_index_of_empty_difficulty(self):
+        self._write_solution('Easy', 1)
+        self._write_solution('Unknown', 2)
+        manifest = self._build({})
+
+        os.remove(os.path.join(self._solutions_dir, 'Unknown', 'problem_002.md'))
+        manifest = self._build(manifest)
+
+        self.assertFalse(os.path.exists(os.path.join(self._site_dir, 'Unknown')))
+        self.assertNotIn('Unknown/index.html', self._read('index.html'))
+        self.assertEqual(manifest['indexes'], {'Easy': [1]})
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,473 @@
+"""This module measures the downloader on a degraded network.
+
+Local stand-ins of gmail and of the solution API are started on
+loopback ports, and every request they receive may be hit by a fault
+drawn at the rates of a fault profile:
+
+* latency: the response is delayed by --chaos_latency seconds
+* reset: the connection is reset without a response
+* partial: the body is cut in half after a full Content-Length
+* throttle: a 429 is returned
+* malformed: a 200 is returned with a truncated JSON body
+
+For every profile, emails of synthetic problems are processed by the
+links and solutions stages with the same retriers, circuit breaker
+settings and gmail backend as a real run, into a temporary solutions
+folder. The report shows the throughput of every profile, its retry
+amplification as the requests received by each stand-in per item, and
+the items that were lost, i.e. left for a later run.
+"""
+
+from typing import Callable
+from typing import Dict
+from typing import Sequence
+from typing import Tuple
+
+from absl import flags
+from absl import logging
+
+from http import server
+from urllib import parse
+import base64
+import httplib2
+import json
+import os
+import random
+import re
+import requests
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from requests import adapters
+
+import download_helper
+import download_links
+import download_solutions
+import gmail_service
+import html_service
+import metrics
+
+
+FAULTS = ('latency', 'reset', 'partial', 'throttle', 'malformed')
+
+PROFILES = {
+    'clean': {},
+    'slow': {'latency': 0.3},
+    'resets': {'reset': 0.2},
+    'truncated': {'partial': 0.2},
+    'throttled': {'throttle': 0.3},
+    'malformed': {'malformed': 0.2},
+    'degraded': {'latency': 0.1, 'reset': 0.05, 'partial': 0.05, 'throttle': 0.1, 'malformed': 0.05},
+}
+
+_CHAOS_PROFILES = flags.DEFINE_list(
+    'chaos_profiles', list(PROFILES),
+    'The fault profiles to measure, in order')
+_CHAOS_FAULTS = flags.DEFINE_string(
+    'chaos_faults', None,
+    'Rates of a custom profile, e.g. "reset=0.1,throttle=0.2", measured as the custom profile')
+_CHAOS_ITEMS = flags.DEFINE_integer(
+    'chaos_items', 20,
+    'Number of emails, and hence of solutions, processed for every profile')
+_CHAOS_LATENCY = flags.DEFINE_float(
+    'chaos_latency', 2.0,
+    'Seconds by which the latency fault delays a response')
+_CHAOS_SEED = flags.DEFINE_integer(
+    'chaos_seed', 0,
+    'Seed of the faults, so that the profiles can be compared across runs')
+
+_GMAIL_ROOT = 'https://gmail.googleapis.com/'
+_API_ROOT = f'https://{html_service.Html_Service.API_HOST}/'
+_MESSAGES_PATH = '/gmail/v1/users/me/messages'
+_MESSAGE_PATH_PATTERN = re.compile(r'^/gmail/v1/users/me/messages/([0-9a-f]+)$')
+
+
+class Error(Exception):
+    """The base exception class for this module.
+    """
+
+
+class BadProfileError(Error):
+    """The rates of a fault profile cannot be parsed.
+    """
+
+
+def parse_profile(text: str) -> Dict[str, float]:
+    """Returns the rates of a profile written as fault=rate pairs.
+
+    Args:
+        text: The comma separated pairs, e.g. "reset=0.1,throttle=0.2"
+
+    Raises:
+        BadProfileError: A fault is unknown or the rates don't add up to at most 1
+    """
+
+    rates = {}
+    for pair in filter(None, text.split(',')):
+        fault, _, rate = pair.partition('=')
+        if fault.strip() not in FAULTS:
+            raise BadProfileError(f'Unknown fault {fault}, use one of {", ".join(FAULTS)}')
+        try:
+            rates[fault.strip()] = float(rate)
+        except ValueError:
+            raise BadProfileError(f'Bad rate {rate} of fault {fault}')
+
+    if sum(rates.values()) > 1:
+        raise BadProfileError(f'The rates of {text} add up to more than 1')
+
+    return rates
+
+
+class FaultInjector():
+    """Draws the fault of every request of a stand-in and counts them.
+
+    Attributes:
+        _rates: The rate of each fault
+        _rng: The seeded source of the faults
+        _lock: Guards the source and the counters
+        requests: The number of requests received
+        faults: The number of each fault injected
+    """
+
+    def __init__(self, rates: Dict[str, float], seed: int) -> None:
+        self._rates = rates
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.faults = dict.fromkeys(FAULTS, 0)
+
+
+    def draw(self) -> str:
+        """Counts a request and returns its fault, None for a healthy response.
+        """
+
+        with self._lock:
+            self.requests += 1
+            draw = self._rng.random()
+            for fault, rate in self._rates.items():
+                if draw < rate:
+                    self.faults[fault] += 1
+                    return fault
+                draw -= rate
+
+        return None
+
+
+def _lookup_message(documents: Dict[str, object], path: str) -> object:
+    """Returns the gmail response of a request path, None if there is none.
+
+    A listing returns the first messages whatever the query.
+
+    Args:
+        documents: The gmail messages by id
+        path: The path of the request, with its query
+    """
+
+    url = parse.urlparse(path)
+    if url.path == _MESSAGES_PATH:
+        max_results = int(parse.parse_qs(url.query).get('maxResults', ['100'])[0])
+        return {
+            'messages': [{'id': message_id, 'threadId': message_id}
+                for message_id in list(documents)[:max_results]],
+            'resultSizeEstimate': len(documents),
+        }
+
+    match = _MESSAGE_PATH_PATTERN.match(url.path)
+    return documents.get(match.group(1)) if match else None
+
+
+def _lookup_solution(documents: Dict[str, object], path: str) -> object:
+    """Returns the solution API response of a request path, None if there is none.
+
+    Args:
+        documents: The solutions by token
+        path: The path of the request, with its query
+    """
+
+    query = parse.parse_qs(parse.urlparse(path).query)
+    return documents.get(query.get('token', [None])[0])
+
+
+class _FaultyHandler(server.BaseHTTPRequestHandler):
+    """Answers a request of a stand-in, or fails it with the drawn fault.
+
+    The stand-in sets the class attributes of its own subclass, the lookup
+    being called with the documents and the path of the request.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately
+    disable_nagle_algorithm = True
+    injector = None
+    latency = 0
+    documents = {}
+    lookup = None
+
+    def do_GET(self) -> None:
+        document = self.lookup(self.documents, self.path)
+        if document is None:
+            self._send(404, b'{"error": "not found"}')
+            return
+
+        body = json.dumps(document).encode('utf-8')
+        fault = self.injector.draw()
+
+        if fault == 'latency':
+            time.sleep(self.latency)
+        elif fault == 'reset':
+            # closing with a zero linger sends a RST instead of a FIN
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = True
+            return
+        elif fault == 'partial':
+            self._send(200, body, len(body) // 2)
+            self.close_connection = True
+            return
+        elif fault == 'throttle':
+            self._send(429, b'{"error": "rate limit exceeded"}', retry_after=1)
+            return
+        elif fault == 'malformed':
+            body = body[:len(body) // 2]
+
+        self._send(200, body)
+
+    def _send(self, status: int, body: bytes, length: int = None, retry_after: int = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if retry_after is not None:
+            self.send_header('Retry-After', str(retry_after))
+        self.end_headers()
+        self.wfile.write(body[:length])
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(format, *args)
+
+
+class _RedirectHttp():
+    """An httplib2 client that sends the gmail requests to a stand-in.
+
+    Every thread has its own client since an httplib2 client is not
+    thread safe.
+
+    Attributes:
+        _root: The root url of the stand-in
+        _local: The client of each thread
+    """
+
+    def __init__(self, root: str) -> None:
+        self._root = root
+        self._local = threading.local()
+
+
+    def request(self, uri: str, *args, **kwargs) -> Tuple[httplib2.Response, bytes]:
+        if not hasattr(self._local, 'http'):
+            self._local.http = httplib2.Http(timeout=gmail_service.GmailService._TIMEOUT)
+
+        return self._local.http.request(uri.replace(_GMAIL_ROOT, self._root, 1), *args, **kwargs)
+
+
+class _RedirectAdapter(adapters.HTTPAdapter):
+    """Transport adapter for requests that sends the API requests to a stand-in.
+
+    Attributes:
+        _root: The root url of the stand-in
+    """
+
+    def __init__(self, root: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._root = root
+
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        request.url = request.url.replace(_API_ROOT, self._root, 1)
+        return super().send(request, **kwargs)
+
+
+def generate_documents(count: int) -> Tuple[Dict[str, object], Dict[str, object]]:
+    """Returns the messages and solutions of synthetic problems.
+
+    Args:
+        count: The number of problems
+
+    Returns:
+        A tuple of the gmail messages by id and the solutions by token
+    """
+
+    messages = {}
+    solutions = {}
+    for problem_id in range(1, count + 1):
+        token = f'{problem_id:032x}'
+        text = (f'Good morning! Here\'s your coding interview problem for today.\n'
+            f'Solution: [https://www.dailycodingproblem.com/solution/{problem_id}?token={token}]\n')
+
+        messages[f'{problem_id:016x}'] = {
+            'payload': {
+                'mimeType': 'multipart/alternative',
+                'headers': [{
+                    'name': 'Subject',
+                    'value': f'Daily Coding Problem: Problem #{problem_id} [Easy]',
+                }],
+                'parts': [{
+                    'mimeType': 'text/plain',
+                    'body': {'data': base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')},
+                }],
+            },
+        }
+        solutions[token] = {
+            'problemId': problem_id,
+            'problem': f'Problem {problem_id}',
+            'solution': f'Solution {problem_id}',
+        }
+
+    return messages, solutions
+
+
+def start_gmail_stand_in(
+    messages: Dict[str, object],
+    injector: FaultInjector) -> server.ThreadingHTTPServer:
+    """Starts a stand-in of gmail on a free loopback port in the background.
+
+    Args:
+        messages: The gmail messages by id
+        injector: Draws the faults of the requests
+    """
+
+    return _start_stand_in(_lookup_message, messages, injector)
+
+
+def _start_stand_in(
+    lookup: Callable[[Dict[str, object], str], object],
+    documents: Dict[str, object],
+    injector: FaultInjector) -> server.ThreadingHTTPServer:
+    """Starts a stand-in on a free loopback port in the background.
+
+    Args:
+        lookup: Returns the response of a request path from the documents
+        documents: The documents served by the stand-in
+        injector: Draws the faults of the requests
+    """
+
+    handler = type('_StandInHandler', (_FaultyHandler,), {
+        'documents': documents,
+        'injector': injector,
+        'latency': _CHAOS_LATENCY.value,
+        'lookup': staticmethod(lookup),
+    })
+    stand_in = server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    stand_in.daemon_threads = True
+    threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+
+    return stand_in
+
+
+def measure_profile(name: str, rates: Dict[str, float], solutions_dir: str) -> Dict[str, float]:
+    """Runs the links and solutions stages against faulty stand-ins.
+
+    Args:
+        name: The name of the profile
+        rates: The rate of each fault
+        solutions_dir: The empty folder where the solutions are saved
+
+    Returns:
+        The measures of the profile
+    """
+
+    logging.info('Measuring profile %s with %s', name, rates or 'no fault')
+
+    count = _CHAOS_ITEMS.value
+    messages, solutions = generate_documents(count)
+    gmail_injector = FaultInjector(rates, _CHAOS_SEED.value)
+    api_injector = FaultInjector(rates, _CHAOS_SEED.value + 1)
+    gmail_stand_in = start_gmail_stand_in(messages, gmail_injector)
+    api_stand_in = _start_stand_in(_lookup_solution, solutions, api_injector)
+
+    flags.FLAGS.solutions_dir = solutions_dir
+    os.makedirs(solutions_dir)
+
+    gmail_root = f'http://127.0.0.1:{gmail_stand_in.server_address[1]}/'
+    if download_helper.get_gmail_backend() == 'rest':
+        # imported here so that the discovery backend doesn't load httpx
+        import gmail_rest
+        gmail_svc = gmail_rest.RestGmailService(
+            None,
+            retrier=download_helper.get_gmail_retrier(),
+            base_url=f'{gmail_root}gmail/v1/users/me/')
+    else:
+        gmail_svc = gmail_service.GmailService(
+            None,
+            http=_RedirectHttp(gmail_root),
+            retrier=download_helper.get_gmail_retrier())
+    gmail_svc.load_gmail_resource()
+
+    session = requests.Session()
+    session.mount(_API_ROOT, _RedirectAdapter(f'http://127.0.0.1:{api_stand_in.server_address[1]}/'))
+    html_svc = html_service.Html_Service(
+        session,
+        breaker=download_helper.create_breaker(html_service.Html_Service.API_HOST),
+        retrier=download_helper.get_api_retrier())
+
+    run_data = {'emails': dict.fromkeys(messages)}
+    counters = metrics.get_all()
+    start = time.perf_counter()
+    try:
+        download_links.update_links(
+            run_data, {download_helper.get_default_account(): gmail_svc}, count)
+        download_solutions.update_solutions(run_data, html_svc, count)
+    finally:
+        seconds = time.perf_counter() - start
+        for stand_in in (gmail_stand_in, api_stand_in):
+            stand_in.shutdown()
+            stand_in.server_close()
+
+    retries = {key: value - counters.get(key, 0)
+        for key, value in metrics.get_all().items() if key.endswith('.retries')}
+    emails = sum(1 for subject in run_data['emails'].values() if subject)
+    saved = sum(1 for file_path in run_data.get('links', {}).values() if file_path)
+
+    return {
+        'seconds': seconds,
+        'throughput': saved / seconds,
+        'emails_lost': count - emails,
+        'solutions_lost': count - saved,
+        'gmail_amplification': gmail_injector.requests / count,
+        'api_amplification': api_injector.requests / max(1, len(run_data.get('links', {}))),
+        'retries': sum(retries.values()),
+        'faults': sum(gmail_injector.faults.values()) + sum(api_injector.faults.values()),
+    }
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    profiles = {}
+    for name in _CHAOS_PROFILES.value:
+        if name not in PROFILES:
+            raise BadProfileError(f'Unknown profile {name}, use one of {", ".join(PROFILES)}')
+        profiles[name] = PROFILES[name]
+    if _CHAOS_FAULTS.value:
+        profiles['custom'] = parse_profile(_CHAOS_FAULTS.value)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, rates in profiles.items():
+            results[name] = measure_profile(name, rates, os.path.join(temp_dir, name))
+
+    print(f'{"profile":<10} {"seconds":>8} {"items/s":>8} {"gmail x":>8} {"api x":>8} '
+        f'{"faults":>7} {"retries":>8} {"emails lost":>12} {"solutions lost":>15}')
+    for name, result in results.items():
+        print(f'{name:<10} {result["seconds"]:>8.1f} {result["throughput"]:>8.2f} '
+            f'{result["gmail_amplification"]:>8.2f} {result["api_amplification"]:>8.2f} '
+            f'{result["faults"]:>7d} {result["retries"]:>8.0f} '
+            f'{result["emails_lost"]:>12d} {result["solutions_lost"]:>15d}')
+
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
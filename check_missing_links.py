@@ -3,7 +3,6 @@
 
 from typing import Sequence
 
-from absl import app
 from absl import logging
 
 import download_helper
@@ -45,4 +44,4 @@ def main(argv: Sequence[str]) -> None:
 
         
 if __name__ == "__main__":
-    app.run(main)
\ No newline at end of file
+    download_helper.run(main)
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""This module stops calling an API while it is unhealthy.
+
+The breaker is closed while the API is healthy and every call goes
+through. Once the share of failed calls among the most recent calls
+reaches the failure ratio, the breaker opens and calls fail right away
+without reaching the API.
+
+After the reset timeout the breaker is half open and lets a single
+probe call through. The breaker closes if the probe succeeds, and opens
+again for another reset timeout if it fails.
+"""
+
+from absl import logging
+
+import collections
+import threading
+import time
+
+
+class Error(Exception):
+    """The base exception class for this module.
+    """
+
+
+class CircuitOpenError(Error):
+    """The API is unhealthy and the call was not made.
+    """
+
+
+class CircuitBreaker():
+    """Tracks the failures of an API and short circuits the calls.
+
+    Attributes:
+        _name: The name of the API used in logs
+        _failure_ratio: The share of failed calls that opens the breaker
+        _min_calls: The number of calls observed before the breaker can open
+        _reset_timeout: The seconds after which a probe call is let through
+        _results: Whether each of the most recent calls succeeded
+        _state: Whether the breaker is closed, open or half open
+        _opened_at: The time the breaker last opened at
+        _probing: Whether a probe call is in flight
+        _lock: Guards the state of the breaker
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half open'
+
+    def __init__(
+        self,
+        name: str,
+        failure_ratio: float = 0.5,
+        min_calls: int = 10,
+        window: int = 20,
+        reset_timeout: float = 60) -> None:
+
+        self._name = name
+        self._failure_ratio = failure_ratio
+        self._min_calls = min_calls
+        self._reset_timeout = reset_timeout
+        self._results = collections.deque(maxlen=window)
+        self._state = CircuitBreaker.CLOSED
+        self._opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+
+    def get_state(self) -> str:
+        """Returns whether the breaker is closed, open or half open.
+        """
+
+        with self._lock:
+            return self._state
+
+
+    def before_call(self) -> None:
+        """Checks whether a call may be made now.
+
+        Raises:
+            CircuitOpenError: The API is unhealthy and the call must not be made
+        """
+
+        with self._lock:
+            if self._state == CircuitBreaker.CLOSED:
+                return
+
+            if self._state == CircuitBreaker.OPEN:
+                if time.monotonic() - self._opened_at < self._reset_timeout:
+                    raise CircuitOpenError(f'{self._name} is unhealthy')
+                logging.info('Probing %s', self._name)
+                self._state = CircuitBreaker.HALF_OPEN
+
+            # only a single probe is let through while half open
+            if self._probing:
+                raise CircuitOpenError(f'{self._name} is being probed')
+            self._probing = True
+
+
+    def record_success(self) -> None:
+        """Records that a call succeeded.
+        """
+
+        with self._lock:
+            if self._state == CircuitBreaker.HALF_OPEN:
+                logging.info('%s is healthy again', self._name)
+                self._state = CircuitBreaker.CLOSED
+                self._probing = False
+                self._results.clear()
+
+            self._results.append(True)
+
+
+    def record_failure(self) -> None:
+        """Records that a call failed and opens the breaker if needed.
+        """
+
+        with self._lock:
+            if self._state == CircuitBreaker.HALF_OPEN:
+                self._open()
+                return
+
+            self._results.append(False)
+            failures = self._results.count(False)
+            if (len(self._results) >= self._min_calls
+                and failures >= len(self._results) * self._failure_ratio):
+                self._open()
+
+
+    def _open(self) -> None:
+        """Opens the breaker, the lock must be held.
+        """
+
+        logging.warning('%s is unhealthy, pausing calls for %d seconds',
+            self._name, self._reset_timeout)
+        self._state = CircuitBreaker.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._results.clear()
@@ -0,0 +1,65 @@
+"""Tests the breaker and its use by the solution API calls.
+"""
+
+from absl.testing import absltest
+
+import circuit_breaker
+import html_service
+
+
+class CircuitBreakerTest(absltest.TestCase):
+
+    def _open_breaker(self) -> circuit_breaker.CircuitBreaker:
+        breaker = circuit_breaker.CircuitBreaker('api', min_calls=1, reset_timeout=0)
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.get_state(), circuit_breaker.CircuitBreaker.OPEN)
+        return breaker
+
+
+    def test_opens_after_failures(self):
+        breaker = circuit_breaker.CircuitBreaker('api', min_calls=2, reset_timeout=60)
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.get_state(), circuit_breaker.CircuitBreaker.CLOSED)
+        breaker.before_call()
+        breaker.record_failure()
+
+        with self.assertRaises(circuit_breaker.CircuitOpenError):
+            breaker.before_call()
+
+
+    def test_single_probe_while_half_open(self):
+        breaker = self._open_breaker()
+        breaker.before_call()
+        self.assertEqual(breaker.get_state(), circuit_breaker.CircuitBreaker.HALF_OPEN)
+
+        with self.assertRaises(circuit_breaker.CircuitOpenError):
+            breaker.before_call()
+
+        breaker.record_success()
+        self.assertEqual(breaker.get_state(), circuit_breaker.CircuitBreaker.CLOSED)
+
+
+    def test_unexpected_error_of_probe_releases_it(self):
+        breaker = self._open_breaker()
+        html_svc = html_service.Html_Service(breaker=breaker)
+
+        def fail(href, problem_id):
+            raise RuntimeError('executor shut down')
+
+        html_svc._get_json = fail
+        with self.assertRaises(RuntimeError):
+            html_svc._call_api('https://www.dailycodingproblem.com/api/solution?token=a')
+        self.assertEqual(breaker.get_state(), circuit_breaker.CircuitBreaker.OPEN)
+
+        # the next call is let through as a new probe instead of being rejected
+        html_svc._get_json = lambda href, problem_id: {'problemId': 1}
+        self.assertEqual(
+            html_svc._call_api('https://www.dailycodingproblem.com/api/solution?token=a'),
+            {'problemId': 1})
+        self.assertEqual(breaker.get_state(), circuit_breaker.CircuitBreaker.CLOSED)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,192 @@
+"""This module runs the downloader as a long running daemon.
+
+The gmail services, the html service and the run data are loaded once
+and kept in memory. New emails are polled for at a fixed interval, or
+as soon as a notification is posted to the local webhook, and every new
+email is pushed through the link and solution stages right away.
+
+The run data is checkpointed after every cycle that changed it and
+once more when the daemon is stopped with SIGINT or SIGTERM.
+
+While the solution API is unhealthy the solution stage stops right
+away and the daemon keeps polling for emails and links, the pending
+solutions are downloaded once the API recovers.
+"""
+
+from typing import Dict
+from typing import Sequence
+
+from absl import flags
+from absl import logging
+
+from googleapiclient import errors
+from http import server
+import requests
+import signal
+import threading
+
+import download_emails
+import download_helper
+import download_links
+import download_solutions
+import gmail_service
+import html_service
+import profiling
+import tracing
+
+
+_POLL_INTERVAL = flags.DEFINE_integer(
+    'poll_interval', 60,
+    'Seconds to wait between two polls for new emails')
+_WEBHOOK_PORT = flags.DEFINE_integer(
+    'webhook_port', 0,
+    'Local port of the webhook that triggers a poll, disabled if 0')
+
+
+class _WebhookHandler(server.BaseHTTPRequestHandler):
+    """Wakes up the daemon on every POST request.
+    """
+
+    wake_event = None
+
+    def do_POST(self) -> None:
+        logging.info('Received notification on webhook')
+        self.wake_event.set()
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(format, *args)
+
+
+class Daemon():
+    """Keeps the services warm and processes new emails as they arrive.
+
+    Attributes:
+        _run_data: The state of the runtime data
+        _gmail_services: The gmail service of each account
+        _html_svc: The html service used to fetch the solutions
+        _wake_event: Set to start the next poll right away
+        _stop_event: Set to stop the daemon after the current poll
+    """
+
+    def __init__(
+        self,
+        run_data: Dict[str, object],
+        gmail_services: Dict[str, gmail_service.GmailService],
+        html_svc: html_service.Html_Service) -> None:
+
+        self._run_data = run_data
+        self._gmail_services = gmail_services
+        self._html_svc = html_svc
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+
+    def stop(self, signum: int = None, frame: object = None) -> None:
+        """Stops the daemon once the current poll completes.
+
+        The arguments allow the method to be used as a signal handler.
+        """
+
+        logging.info('Stopping daemon')
+        self._stop_event.set()
+        self._wake_event.set()
+
+
+    def poll(self) -> bool:
+        """Processes all the new emails through every stage.
+
+        Returns:
+            Whether the run data was changed
+        """
+
+        batch_size = download_helper.get_batch_size()
+
+        with profiling.stage('emails'):
+            email_ids = download_emails.update_emails(self._run_data, self._gmail_services)
+        with profiling.stage('links'):
+            has_changes = download_links.update_links(
+                self._run_data, self._gmail_services, batch_size)
+
+        if self._run_data.get('links'):
+            with profiling.stage('solutions'):
+                has_changes |= download_solutions.update_solutions(
+                    self._run_data, self._html_svc, batch_size)
+
+        # the email fetch timestamp always changes when emails were listed
+        return has_changes or bool(email_ids)
+
+
+    def start_webhook(self, port: int) -> server.ThreadingHTTPServer:
+        """Starts the local webhook on a background thread.
+
+        Args:
+            port: The local port to listen on
+        """
+
+        logging.info('Listening for notifications on port %d', port)
+        handler = type('WebhookHandler', (_WebhookHandler,), {'wake_event': self._wake_event})
+        webhook = server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+        thread = threading.Thread(target=webhook.serve_forever, daemon=True)
+        thread.start()
+
+        return webhook
+
+
+    def run(self, poll_interval: int) -> None:
+        """Polls for new emails until the daemon is stopped.
+
+        Args:
+            poll_interval: Seconds to wait between two polls
+        """
+
+        while not self._stop_event.is_set():
+            self._wake_event.clear()
+
+            try:
+                with tracing.span('daemon.poll'):
+                    has_changes = self.poll()
+
+                if has_changes:
+                    download_helper.save_run_data(self._run_data)
+            except (gmail_service.Error,
+                    errors.HttpError,
+                    html_service.InvalidJsonApiError,
+                    requests.RequestException):
+                logging.exception('Error while polling, will retry on next poll')
+
+            self._wake_event.wait(poll_interval)
+
+        logging.info('Checkpointing run data before exit')
+        download_helper.save_run_data(self._run_data)
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    daemon = Daemon(
+        download_helper.get_run_data(),
+        download_helper.init_and_get_gmail_services(),
+        download_helper.init_and_get_html_service())
+
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+
+    webhook = None
+    if _WEBHOOK_PORT.value:
+        webhook = daemon.start_webhook(_WEBHOOK_PORT.value)
+
+    daemon.run(_POLL_INTERVAL.value)
+
+    if webhook:
+        webhook.shutdown()
+
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
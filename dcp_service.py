@@ -3,6 +3,8 @@
 This will fetch the Daily Coding Problem emails and get the relevant HTML content from it
 """
 
+from typing import Iterator
+from typing import Optional
 from typing import Sequence
 from typing import Tuple 
 from typing import Dict
@@ -10,14 +12,15 @@ from typing import Set
 
 from absl import logging
 
-from googleapiclient import discovery
-
 import base64
 import bs4
+import itertools
 import re
+import sys
 
 import gmail_service
-import ratelimiter
+import progress
+import tracing
 
 
 class Error(Exception):
@@ -28,16 +31,6 @@ class InvalidMessageError(Error):
     """Message ID is not found.
     """
 
-class TooManyHtmlParts(Error):
-    """The message has more than 1 html parts
-    """
-
-
-class TooManyTextParts(Error):
-    """The message has more than 1 text parts
-    """
-
-
 class DCP_Service():
     """Helper for fetching the right emails relevant for DCP.
 
@@ -51,6 +44,8 @@ class DCP_Service():
     _DCP_QUERY = 'subject:(Daily Coding Problem)'
     _MAX_RESULTS = 250
     _SOLUTION_LINK_PATTERN = 'dailycodingproblem.com/solution'
+    _TEXT_TYPE = 'text/plain'
+    _HTML_TYPE = 'text/html'
 
     def __init__(self, gmail_service: gmail_service.GmailService):
         self._gmail_service = gmail_service
@@ -84,81 +79,181 @@ class DCP_Service():
         
         return messages, next_page_token
 
-    @ratelimiter.RateLimiter(max_calls=1, period=1)
-    def get_html_message(self, message_id: str) -> Tuple[str, str]:
+    def get_latest_message_id(self) -> Optional[str]:
+        """Returns the id of the newest DCP message, None if there is none.
+        """
+
+        logging.info('Getting the latest message')
+
+        messages, _ = self._gmail_service.search_messages(DCP_Service._DCP_QUERY, None, 1)
+        return messages[0] if messages else None
+
+    @staticmethod
+    def get_problems_query(problem_ids: Sequence[int]) -> str:
+        """Returns the query of the emails of any of the problems.
+
+        Args:
+            problem_ids: The problem numbers
+        """
+
+        subjects = ' OR '.join(f'"Problem #{problem_id}"' for problem_id in problem_ids)
+        return f'{DCP_Service._DCP_QUERY} subject:({subjects})'
+
+    def get_problem_messages(self, problem_ids: Sequence[int]) -> Sequence[str]:
+        """Returns the ids of the DCP messages of any of the problems.
+
+        All the problems are searched with a single query, followed
+        through all its pages.
+
+        Args:
+            problem_ids: The problem numbers
+        """
+
+        logging.info('Getting messages of %d problems', len(problem_ids))
+
+        query = DCP_Service.get_problems_query(problem_ids)
+        message_ids = []
+        next_page_token = None
+        while True:
+            messages, next_page_token = self._gmail_service.search_messages(
+                query,
+                next_page_token,
+                DCP_Service._MAX_RESULTS)
+            message_ids.extend(messages)
+
+            if not next_page_token:
+                return message_ids
+
+    def get_html_message(self, message_id: str, message: object = None) -> Tuple[str, str]:
         """Parse the content of the message and return 
         only the HTML content that we are interested in.
 
         Args:
             message_id: Unique identifier of the message
+            message: The content of the message if it was already fetched
 
         Returns:
             A tuple of subject, html message if present
 
         Raises:
             InvalidMessageError: If the message id is not found
-            TooManyHtmlParts: If the message has more than one html content
         """
 
-        MIME_TYPE = 'text/html'
-        logging.info('Fetching email %s', message_id)
+        subject, body, _ = self.get_message_body(message_id, message, (DCP_Service._HTML_TYPE,))
+        return subject, body
 
-        message = self._gmail_service.get_message_content(message_id)
-        subject = self._gmail_service.get_message_subject(message)
+    def get_text_message(self, message_id: str, message: object = None) -> Tuple[str, str]:
+        """Parse the content of the message and return 
+        only the text content that we are interested in.
+
+        Args:
+            message_id: Unique identifier of the message
+            message: The content of the message if it was already fetched
 
-        parts = message.get('parts', [])
-        html_parts = filter(lambda p: p.get('mimeType', None) == MIME_TYPE, parts)
+        Returns:
+            A tuple of subject, text message if present
 
-        data_parts = []
-        for part in html_parts:
-            text_data = base64.urlsafe_b64decode(part.get('body').get('data'))
-            data_parts.append(text_data)
+        Raises:
+            InvalidMessageError: If the message id is not found
+        """
 
-        if len(data_parts) > 1:
-            raise TooManyHtmlParts
+        subject, body, _ = self.get_message_body(message_id, message, (DCP_Service._TEXT_TYPE,))
+        return subject, body
 
-        if data_parts:
-            return subject, data_parts[0]
-        else:
-            return subject, None
+    def get_message_body(
+        self,
+        message_id: str,
+        message: object = None,
+        mime_types: Sequence[str] = None) -> Tuple[str, Optional[str], Optional[str]]:
+        """Returns the subject and the body of the preferred mime type.
 
-    @ratelimiter.RateLimiter(max_calls=1, period=1)
-    def get_text_message(self, message_id: str) -> Tuple[str, str]:
-        """Parse the content of the message and return 
-        only the text content that we are interested in.
+        The part tree of the message is walked for the first part of
+        each mime type in order, so that a message without a text body
+        falls back to its html body. Only the part that is returned is
+        decoded.
 
         Args:
             message_id: Unique identifier of the message
+            message: The content of the message if it was already fetched
+            mime_types: The mime types in order of preference,
+                text and then html by default
 
         Returns:
-            A single html message if present
+            A tuple of subject, body and mime type of the body,
+            the body and mime type are None if no part matched
 
         Raises:
             InvalidMessageError: If the message id is not found
-            TooManyTextParts: If the message has more than one html content
         """
 
-        MIME_TYPE = 'text/plain'
-        logging.info('Fetching email %s', message_id)
+        if message is None:
+            logging.info('Fetching email %s', message_id)
+            message = self._gmail_service.get_message_content(message_id)
+
+        if not message:
+            raise InvalidMessageError(f'No content for message {message_id}')
+
+        if mime_types is None:
+            mime_types = (DCP_Service._TEXT_TYPE, DCP_Service._HTML_TYPE)
 
-        message = self._gmail_service.get_message_content(message_id)
         subject = self._gmail_service.get_message_subject(message)
-        
-        parts = message.get('parts', [])
-        text_parts = filter(lambda p: p.get('mimeType', None) == MIME_TYPE, parts)
 
-        data_parts = []
-        for part in text_parts:
-            text_data = base64.urlsafe_b64decode(part.get('body').get('data'))
-            data_parts.append(str(text_data))
+        for mime_type in mime_types:
+            part = next(
+                (p for p in DCP_Service.walk_parts(message) if p.get('mimeType') == mime_type),
+                None)
+            if part:
+                with tracing.span('dcp.decode_body', message_id=message_id, mime_type=mime_type):
+                    body = DCP_Service.decode_body(part)
+                return subject, body, mime_type
 
-        if len(data_parts) > 1:
-            raise TooManyTextParts
+        logging.warning('No %s body in message %s', ' or '.join(mime_types), message_id)
+        return subject, None, None
 
-        if data_parts:
-            return subject, data_parts[0]
-        else:
-            return subject, None
+    @staticmethod
+    def walk_parts(part: Dict[str, object]) -> Iterator[Dict[str, object]]:
+        """Yields the parts of a message that carry a body, depth first.
+
+        The parts are walked lazily, so that the walk stops as soon as
+        the caller found the part it is looking for. A single part
+        message is its own body.
+
+        Args:
+            part: The payload of the message or one of its parts
+        """
+
+        if part.get('body', {}).get('data'):
+            yield part
+
+        for sub_part in part.get('parts', []):
+            yield from DCP_Service.walk_parts(sub_part)
+
+    @staticmethod
+    def decode_body(part: Dict[str, object]) -> str:
+        """Returns the decoded body of a part.
+
+        Gmail encodes the bodies in url safe base64 and the DCP emails
+        are sent in UTF-8.
+
+        Args:
+            part: The part with a body
+        """
+
+        data = part['body']['data']
+        return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+
+    def get_solution_links(self, body: str, mime_type: str) -> Sequence[str]:
+        """Returns a list of solution links from a body of either mime type.
+
+        Args:
+            body: The body of the message
+            mime_type: The mime type of the body
+        """
+
+        if mime_type == DCP_Service._HTML_TYPE:
+            return self.get_solution_links_from_html(body)
+
+        return self.get_solution_links_from_text(body)
 
 
     def get_solution_links_from_html(self, message: str) -> Sequence[str]:
@@ -172,14 +267,15 @@ class DCP_Service():
         """
 
         logging.info('Parsing HTML to get links')
-        soup = bs4.BeautifulSoup(message, 'html.parser')
-        link_tags = soup.find_all('a')
-        
-        links = []
-        for tag in link_tags:
-            href = tag.get('href')
-            if re.search(self._SOLUTION_LINK_PATTERN, href):
-                links.append(href)
+        with tracing.span('dcp.parse_links', mime_type='text/html'):
+            soup = bs4.BeautifulSoup(message, 'html.parser')
+            link_tags = soup.find_all('a')
+            
+            links = []
+            for tag in link_tags:
+                href = tag.get('href')
+                if href and re.search(self._SOLUTION_LINK_PATTERN, href):
+                    links.append(href)
 
         logging.info('Found %d solution link(s)', len(links))
         return links
@@ -197,15 +293,17 @@ class DCP_Service():
 
         logging.info('Getting links from text')
         logging.debug(message)
-        all_links = re.findall(r'\[.+?\]', message)
-        solution_links = filter(lambda l: re.search('dailycodingproblem.com/solution', l) is not None, all_links)
-        links = [re.sub(r'[\[\]]', '',link) for link in set(solution_links)]
+        with tracing.span('dcp.parse_links', mime_type='text/plain'):
+            all_links = re.findall(r'\[.+?\]', message)
+            solution_links = filter(lambda l: re.search('dailycodingproblem.com/solution', l) is not None, all_links)
+            links = [re.sub(r'[\[\]]', '',link) for link in set(solution_links)]
         logging.debug(links)
         logging.info('Found %d solution links', len(links))
         return links
 
 
-    def collect_problem_difficulty(self, emails: Dict[str, str], problems: Dict[int, str]) \
+    @staticmethod
+    def collect_problem_difficulty(emails: Dict[str, str], problems: Dict[int, str]) \
         -> Dict[int, str]:
         """Returns the difficulty for each problem from the emails.
 
@@ -226,19 +324,11 @@ class DCP_Service():
             if not emails[email_id]:
                 continue
 
-            diff_match = re.search(r'\[.+\]', emails[email_id])
-            prob_match = re.search(r'#\d+', emails[email_id])
-
-            if not prob_match:
+            problem = DCP_Service.parse_subject(emails[email_id])
+            if not problem:
                 continue
-            else:
-                problem_id = int(re.sub('#', '', prob_match.group()))
-            
-            if diff_match:
-                difficulty = re.sub(r'[\[\]]', '', diff_match.group())
-            else:
-                difficulty = 'Easy'
 
+            problem_id, difficulty = problem
             if problem_id not in problems:
                 logging.info('Adding problem id %d with difficulty %s',
                     problem_id, difficulty)
@@ -247,13 +337,22 @@ class DCP_Service():
         return problems
 
 
-    def get_subject_and_links(self, emails: Dict[str, str], batch_size: int) \
-        -> Tuple[Dict[str, str], Set[str]]:
+    def get_subject_and_links(
+        self,
+        emails: Dict[str, str],
+        batch_size: int,
+        tracker: progress.ProgressTracker = None,
+        workers: int = 1) -> Tuple[Dict[str, str], Set[str]]:
         """Fetches content of all emails.
 
+        With more than one worker the emails are fetched concurrently
+        and processed in the order the fetches complete.
+
         Args:
             emails: dictionary of email ids and fetch status
             batch_size: number of emails to process
+            tracker: stops the batch once its time budget is used up
+            workers: number of emails fetched at the same time
 
         Returns:
             Tuple of emails with subjects and solution links from the email content
@@ -264,26 +363,35 @@ class DCP_Service():
         links = []
         new_emails = {}
 
-        for ix, email_id in enumerate(emails.keys()):
-            if ix >= batch_size:
+        email_ids = list(itertools.islice(emails.keys(), batch_size))
+        if workers > 1:
+            # the budget is checked before each fetch, and every fetched email is processed
+            messages = self._gmail_service.get_messages(email_ids, workers, tracker)
+        else:
+            # the emails are fetched one by one as they are processed
+            messages = ((email_id, None) for email_id in email_ids)
+
+        for email_id, content in messages:
+            if workers <= 1 and tracker and not tracker.should_continue():
                 break
 
             try:
-                subject, message = self.get_text_message(email_id)
-                ix = ix + 1
+                with tracing.span('dcp.process_email', message_id=email_id):
+                    subject, body, mime_type = self.get_message_body(email_id, content)
 
-                new_emails[email_id] = subject
-                
-                if message:
-                    new_links = self.get_solution_links_from_text(message)
-                    links.extend(new_links)
+                    new_emails[email_id] = subject
+                    
+                    if body:
+                        new_links = self.get_solution_links(body, mime_type)
+                        links.extend(new_links)
 
-            except InvalidMessageError:
+            except (InvalidMessageError, gmail_service.BadMessageIdError):
                 logging.error('Skipping message %s; identifier not found', email_id)
-            except TooManyTextParts:
-                logging.error('Skipping message %s; unsupported message format', email_id)
-            except gmail_service.ReadTimeoutError:
-                logging.warning('Timeout error, will process the message %s again', email_id)
+            except gmail_service.TransientError as e:
+                logging.warning('%s, will process the message %s again', e, email_id)
+
+            if tracker:
+                tracker.record()
 
         links = set(links)
         logging.info('Processed %d emails', len(new_emails))
@@ -291,3 +399,31 @@ class DCP_Service():
 
         return new_emails, links
 
+
+    @staticmethod
+    def parse_subject(subject: str) -> Optional[Tuple[int, str]]:
+        """Returns the problem id and difficulty from the subject of an email.
+
+        Args:
+            subject: The subject of the email
+
+        Returns:
+            A tuple of problem id and difficulty, None if the subject
+            doesn't contain a problem number
+        """
+
+        diff_match = re.search(r'\[.+\]', subject)
+        prob_match = re.search(r'#\d+', subject)
+
+        if not prob_match:
+            return None
+
+        problem_id = int(re.sub('#', '', prob_match.group()))
+
+        if diff_match:
+            difficulty = re.sub(r'[\[\]]', '', diff_match.group())
+        else:
+            difficulty = 'Easy'
+
+        # the few difficulties are shared by all the problems
+        return problem_id, sys.intern(difficulty)
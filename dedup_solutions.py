@@ -0,0 +1,137 @@
+"""This module reports the space saved by deduplicating the solutions.
+
+The report compares the size of all the solution files with the space
+they actually take on disk, counting every stored content only once.
+
+Solution files that were saved before the blob store was used can be
+moved into the store with --adopt. The files in the store are read only,
+the ones to edit are replaced by writable copies with --detach.
+"""
+
+from typing import Dict
+from typing import Sequence
+
+from absl import flags
+from absl import logging
+
+import hashlib
+import os
+
+import download_helper
+
+
+_ADOPT = flags.DEFINE_boolean(
+    'adopt', False,
+    'Move the solution files that are not hardlinked yet into the blob store')
+_DETACH = flags.DEFINE_list(
+    'detach', [],
+    'Solution files replaced by a writable copy of their own, e.g. to edit them')
+
+
+def scan_solution_files(solutions_dir: str) -> Sequence[str]:
+    """Returns the paths of all the solution files.
+
+    Args:
+        solutions_dir: The folder with one sub folder per difficulty
+    """
+
+    file_paths = []
+    for difficulty_entry in os.scandir(solutions_dir):
+        if not difficulty_entry.is_dir() or difficulty_entry.name.startswith('.'):
+            continue
+
+        for entry in os.scandir(difficulty_entry.path):
+            if entry.is_file() and entry.name.endswith('.md'):
+                file_paths.append(entry.path)
+
+    return file_paths
+
+
+def get_dedup_report(file_paths: Sequence[str]) -> Dict[str, int]:
+    """Returns the logical and the physical size of the solution files.
+
+    Args:
+        file_paths: The paths of the solution files
+
+    Returns:
+        A dictionary with the number of files, contents and inodes,
+        and the logical, physical and deduplicated sizes in bytes
+    """
+
+    logging.info('Computing the dedup report of %d files', len(file_paths))
+
+    logical_size = 0
+    inodes = {}
+    contents = {}
+    for file_path in file_paths:
+        file_stat = os.stat(file_path)
+        logical_size += file_stat.st_size
+        inode = (file_stat.st_dev, file_stat.st_ino)
+
+        if inode not in inodes:
+            inodes[inode] = file_stat.st_size
+            with open(file_path, 'rb') as file:
+                contents[hashlib.sha256(file.read()).hexdigest()] = file_stat.st_size
+
+    return {
+        'files': len(file_paths),
+        'inodes': len(inodes),
+        'contents': len(contents),
+        'logical_size': logical_size,
+        'physical_size': sum(inodes.values()),
+        'dedup_size': sum(contents.values()),
+    }
+
+
+def adopt_solution_files(file_paths: Sequence[str]) -> int:
+    """Moves the files that are not hardlinked yet into the blob store.
+
+    Args:
+        file_paths: The paths of the solution files
+
+    Returns:
+        The number of files that were moved into the store
+    """
+
+    store = download_helper.get_blob_store()
+
+    count = 0
+    for file_path in file_paths:
+        if os.stat(file_path).st_nlink > 1:
+            continue
+
+        logging.info('Adopting %s', file_path)
+        store.adopt(file_path)
+        count += 1
+
+    return count
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    for file_path in _DETACH.value:
+        logging.info('Detaching %s', file_path)
+        download_helper.get_blob_store().detach(file_path)
+
+    file_paths = scan_solution_files(download_helper.get_solutions_dir())
+
+    if _ADOPT.value:
+        count = adopt_solution_files(file_paths)
+        logging.info('Moved %d files into the blob store', count)
+
+    report = get_dedup_report(file_paths)
+    saved = report['logical_size'] - report['physical_size']
+
+    print(f'{report["files"]} files with {report["contents"]} distinct contents '
+        f'stored in {report["inodes"]} files on disk')
+    print(f'Logical size {report["logical_size"]} bytes, '
+        f'on disk {report["physical_size"]} bytes, saved {saved} bytes')
+
+    if report['physical_size'] > report['dedup_size']:
+        print(f'Another {report["physical_size"] - report["dedup_size"]} bytes '
+            'can be saved with --adopt')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
@@ -4,39 +4,58 @@ Based on the search term, the emails are searched for and the
 resulting emails ids are saved in a file.
 
 When run again, it should be able to retrieve only the newer files
+
+When multiple accounts are configured, the emails of all accounts are
+fetched concurrently and the account of each email is saved so that
+its content can be fetched later.
+
+The listing is checkpointed into the run data after every page, so a
+listing that fails part way is resumed from the last page on the next run.
 """
 
+from typing import Callable
 from typing import Sequence
 from typing import Dict
+from typing import Set
+from typing import Tuple
 
-from absl import app
 from absl import logging
 
 import dcp_service
 import download_helper
+import gmail_service
+import tracing
+
+from googleapiclient import errors
 
 import math
 import datetime
 
 
-def get_all_emails(last_run_at: int) -> Sequence[str]:
+def get_all_emails(
+    gmail_svc: gmail_service.GmailService,
+    last_run_at: int,
+    next_page_token: str = None,
+    email_ids: Sequence[str] = None,
+    on_page: Callable[[Sequence[str], str], None] = None) -> Sequence[str]:
     """Returns all the emails ids for the provided search terms.
 
     Args:
+        gmail_svc: The authenticated gmail service of the account
         last_run_at: Last email fetch timestamp
+        next_page_token: The page to resume the listing from
+        email_ids: The email ids listed before the page to resume from
+        on_page: Called with the email ids and the next page token after
+            every page that is followed by another page
     """
 
     logging.info('fetching the list of all email ids from %s', datetime.datetime.fromtimestamp(last_run_at))
 
-    gmail_svc = download_helper.init_and_get_gmail_service()
     dcp_svc = dcp_service.DCP_Service(gmail_svc)
-
-    email_ids, next_page_token = dcp_svc.get_dcp_messages(
-        next_page_token=None,
-        timestamp=last_run_at)
+    email_ids = list(email_ids) if email_ids else []
 
     # until there is no next page, keep fetching the messages
-    while next_page_token:
+    while True:
         new_email_ids, next_page_token = \
             dcp_svc.get_dcp_messages(
                 next_page_token=next_page_token,
@@ -45,9 +64,77 @@ def get_all_emails(last_run_at: int) -> Sequence[str]:
         if new_email_ids:
             email_ids.extend(new_email_ids)
 
+        if not next_page_token:
+            break
+
+        if on_page:
+            on_page(email_ids, next_page_token)
+
     return email_ids
 
 
+def get_account_emails(
+    run_data: Dict[str, object],
+    account: str,
+    gmail_svc: gmail_service.GmailService,
+    current_timestamp: int) -> Tuple[Sequence[str], int]:
+    """Returns the new email ids of an account, resuming a failed listing.
+
+    Args:
+        run_data: The state of the runtime data
+        account: The token file of the account
+        gmail_svc: The authenticated gmail service of the account
+        current_timestamp: The time at which this run started
+
+    Returns:
+        A tuple of the email ids and the time the listing was started at
+    """
+
+    last_run_at = get_last_fetch_at(run_data, account)
+    checkpoint = run_data.get('email_fetch_checkpoints', {}).get(account)
+
+    if checkpoint and checkpoint['last_run_at'] == last_run_at:
+        logging.info('Resuming listing of %s after %d emails',
+            account, len(checkpoint['email_ids']))
+    else:
+        checkpoint = {
+            'last_run_at': last_run_at,
+            'started_at': current_timestamp,
+            'next_page_token': None,
+            'email_ids': [],
+        }
+
+    def save_checkpoint(email_ids: Sequence[str], next_page_token: str) -> None:
+        checkpoint['email_ids'] = list(email_ids)
+        checkpoint['next_page_token'] = next_page_token
+        download_helper.checkpoint_run_data(
+            run_data,
+            lambda data: data.setdefault('email_fetch_checkpoints', {}).update(
+                {account: dict(checkpoint)}))
+
+    try:
+        email_ids = get_all_emails(
+            gmail_svc,
+            last_run_at,
+            checkpoint['next_page_token'],
+            checkpoint['email_ids'],
+            save_checkpoint)
+    except errors.HttpError:
+        if not checkpoint['next_page_token']:
+            raise
+
+        # the page token may have expired since the failed run
+        logging.warning('Unable to resume listing of %s, listing from the first page', account)
+        email_ids = get_all_emails(
+            gmail_svc,
+            last_run_at,
+            None,
+            checkpoint['email_ids'],
+            save_checkpoint)
+
+    return email_ids, checkpoint['started_at']
+
+
 def collect_all_emails(
     new_email_ids: Sequence[str], 
     old_emails: Dict[str, str]) -> Dict[str, str]:
@@ -64,38 +151,118 @@ def collect_all_emails(
         A dictionary of email ids with a str indicating subject
     """
     logging.info('Collecting new and old email ids into a single dictionary')
-    
-    old_ids = old_emails.keys()
-    new_email_ids = set(new_email_ids) - set(old_ids) # only process new email ids
-    new_emails = {email_id: None for email_id in new_email_ids} # the subject is blank if unprocessed
-    new_emails.update(old_emails)
-    
-    return new_emails
 
+    # the new ids are added in place, copying the saved emails costs
+    # more than the lookups at a large number of emails
+    for email_id in new_email_ids:
+        if email_id not in old_emails:
+            old_emails[email_id] = None # the subject is blank if unprocessed
 
-def main(argv: Sequence[str]) -> None:
-    del argv
+    return old_emails
 
-    logging.info('Running program...')
-    current_timestamp = datetime.datetime.now().timestamp()
 
-    run_data = download_helper.get_run_data()
-    last_run_at = run_data.get('last_email_fetch_at', 0)
-    email_ids = get_all_emails(last_run_at)
-    email_ids = set(email_ids)
+def get_last_fetch_at(run_data: Dict[str, object], account: str) -> int:
+    """Returns the last email fetch timestamp of an account.
+
+    Args:
+        run_data: The state of the runtime data
+        account: The token file of the account
+    """
+
+    fetch_times = run_data.get('account_fetch_at', {})
+    if account in fetch_times:
+        return fetch_times[account]
+
+    if account == download_helper.get_default_account():
+        return run_data.get('last_email_fetch_at', 0)
+
+    return 0
+
+
+def collect_email_accounts(
+    account_email_ids: Dict[str, Sequence[str]],
+    email_accounts: Dict[str, str]) -> Dict[str, str]:
+    """Collects the account of each email id.
+
+    Args:
+        account_email_ids: A dictionary of account and the fetched email ids
+        email_accounts: A dictionary of email ids and the account they belong to
+
+    Returns:
+        The dictionary of email ids and accounts updated with the new emails
+    """
+
+    logging.info('Collecting the account of each email')
+
+    for account, email_ids in account_email_ids.items():
+        for email_id in email_ids:
+            if email_id not in email_accounts:
+                email_accounts[email_id] = account
+
+    return email_accounts
+
+
+def update_emails(
+    run_data: Dict[str, object],
+    gmail_services: Dict[str, gmail_service.GmailService]) -> Set[str]:
+    """Fetches the new email ids of all accounts into the run data.
+
+    Args:
+        run_data: The state of the runtime data
+        gmail_services: The gmail service of each account
+
+    Returns:
+        The set of email ids that were fetched
+    """
+
+    current_timestamp = math.floor(datetime.datetime.now().timestamp())
+
+    results = download_helper.run_sharded(
+        lambda account, gmail_svc: get_account_emails(
+            run_data, account, gmail_svc, current_timestamp),
+        gmail_services)
+
+    account_email_ids = {account: ids for account, (ids, _) in results.items()}
+    email_ids = set()
+    for ids in account_email_ids.values():
+        email_ids.update(ids)
     logging.info('Fetched %d emails', len(email_ids))
 
-    run_data['last_email_fetch_at'] = math.floor(current_timestamp)
+    # the listing is complete, hence the checkpoints are no longer needed
+    fetch_times = run_data.get('account_fetch_at', {})
+    checkpoints = run_data.get('email_fetch_checkpoints', {})
+    for account, (_, started_at) in results.items():
+        checkpoints.pop(account, None)
+        fetch_times[account] = started_at
+        if account == download_helper.get_default_account():
+            run_data['last_email_fetch_at'] = started_at
+    run_data['account_fetch_at'] = fetch_times
+    run_data['email_fetch_checkpoints'] = checkpoints
 
     if email_ids:
         old_emails = run_data.get('emails', {})
         all_emails = collect_all_emails(new_email_ids=email_ids, old_emails=old_emails)
         all_emails.update(old_emails)
         run_data['emails'] = all_emails
+        run_data['email_accounts'] = collect_email_accounts(
+            account_email_ids, run_data.get('email_accounts', {}))
+
+    return email_ids
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    run_data = download_helper.get_run_data()
+    gmail_services = download_helper.init_and_get_gmail_services()
+    with tracing.span('emails.update'):
+        update_emails(run_data, gmail_services)
 
     download_helper.save_run_data(run_data)
     logging.info('Completed!')
 
 
 if __name__ == '__main__':
-    app.run(main)
+    download_helper.run(main)
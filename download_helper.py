@@ -1,19 +1,51 @@
 """This module is a helper module to initialize the token,
 and the gmail service resource.
+
+When more than one token file is provided, one gmail service is
+created for each account and the accounts can be fetched concurrently
+as shards.
 """
 
+from typing import Callable
+from typing import Dict
+from typing import Iterator
 from typing import Sequence
 
 from absl import app
 from absl import flags
 from absl import logging
 
+import blob_store
+import circuit_breaker
 import credential_service
 import gmail_service
+import hedging
+import html_service
+import http_fixtures
+import metrics
+import profiling
+import retrying
+import tracing
 
+from concurrent import futures
+from google_auth_httplib2 import AuthorizedHttp
+import contextlib
+import fcntl
 import os
+import requests
 import pickle
 import sys
+import threading
+
+
+class Error(Exception):
+    """The base exception class for this module.
+    """
+
+
+class BadDataFileError(Error):
+    """The data file cannot be unpickled.
+    """
 
 
 _SCOPES = flags.DEFINE_list(
@@ -24,6 +56,10 @@ _TOKEN_FILE = flags.DEFINE_string(
     'token_file',
     'config/token.pickle', 
     'The path where the token file is saved')
+_TOKEN_FILES = flags.DEFINE_list(
+    'token_files',
+    [],
+    'The token files of all the accounts to fetch from, defaults to --token_file')
 _CRED_FILE = flags.DEFINE_string(
     'credential_file',
     'config/credentials.json',
@@ -32,28 +68,327 @@ _DATA_FILE = flags.DEFINE_string(
     'data_file',
     'data/run_data.pickle', 
     'The path where the run data is saved')
+_GMAIL_BACKEND = flags.DEFINE_enum(
+    'gmail_backend',
+    'discovery',
+    ['discovery', 'rest'],
+    'Call gmail with googleapiclient or with plain REST requests over HTTP/2, '
+    'fixtures are always recorded and replayed with googleapiclient')
+_HTTP_FIXTURE_MODE = flags.DEFINE_enum(
+    'http_fixture_mode',
+    'off',
+    ['off', 'record', 'replay'],
+    'Record the HTTP responses into fixtures or replay them from fixtures')
+_HTTP_FIXTURE_DIR = flags.DEFINE_string(
+    'http_fixture_dir',
+    'data/fixtures',
+    'The folder where the HTTP fixtures are saved')
+_REPLAY_LATENCY_SCALE = flags.DEFINE_float(
+    'replay_latency_scale',
+    1.0,
+    'The factor applied to the recorded latency when replaying fixtures')
+_HEDGE_REQUESTS = flags.DEFINE_boolean(
+    'hedge_requests',
+    False,
+    'Send a duplicate request when a message or solution fetch is slower than usual')
+_HEDGE_PERCENTILE = flags.DEFINE_float(
+    'hedge_percentile',
+    95,
+    'The latency percentile after which a request is hedged')
+_API_FAILURE_RATIO = flags.DEFINE_float(
+    'api_failure_ratio',
+    0.5,
+    'The share of failed solution API calls after which the API is no longer called')
+_API_RESET_TIMEOUT = flags.DEFINE_integer(
+    'api_reset_timeout',
+    60,
+    'Seconds to wait before probing the solution API again once it failed')
+_API_RETRIES = flags.DEFINE_integer(
+    'api_retries',
+    2,
+    'Times a solution API call that failed with a transient error is sent again')
+_GMAIL_RETRIES = flags.DEFINE_integer(
+    'gmail_retries',
+    2,
+    'Times a gmail call that failed with a transient error is sent again')
+_RETRY_BACKOFF = flags.DEFINE_float(
+    'retry_backoff',
+    0.5,
+    'Seconds of the first backoff before a retry, doubled on every retry')
+_TRACE_FILE = flags.DEFINE_string(
+    'trace_file',
+    None,
+    'The path of a Chrome trace file where the spans of the run are exported')
+_PROFILE = flags.DEFINE_boolean(
+    'profile',
+    False,
+    'Write the cProfile stats of every stage and the collapsed stacks of the run')
+_PROFILE_DIR = flags.DEFINE_string(
+    'profile_dir',
+    'data/profile',
+    'The folder where the profiles are written')
+_PROFILE_MEMORY = flags.DEFINE_boolean(
+    'profile_memory',
+    False,
+    'Also trace the memory allocations of every stage when profiling')
+_BATCH_SIZE = flags.DEFINE_integer(
+    'batch_size', 0,
+    'Maximum items to process in a given run')
+_FETCH_WORKERS = flags.DEFINE_integer(
+    'fetch_workers', 1,
+    'Number of emails of an account fetched at the same time')
+_TIME_BUDGET = flags.DEFINE_integer(
+    'time_budget', 0,
+    'Seconds a stage may take, items are processed until the budget is used up')
+_SOLUTIONS_DIR = flags.DEFINE_string(
+    'solutions_dir',
+    'solutions',
+    'The folder where the solutions are saved')
+
+
+def get_default_account() -> str:
+    """Returns the token file of the default account.
+
+    Emails that were saved before multiple accounts were supported
+    belong to this account.
+    """
+
+    return _TOKEN_FILE.value
+
+
+def get_accounts() -> Sequence[str]:
+    """Returns the token files of all the accounts to fetch from.
+    """
+
+    return _TOKEN_FILES.value or [_TOKEN_FILE.value]
+
+
+def get_batch_size() -> int:
+    """Returns the maximum items to process in a run, 0 for all items.
+    """
+
+    return _BATCH_SIZE.value
+
+
+def get_gmail_backend() -> str:
+    """Returns the backend used to call gmail, discovery or rest.
+    """
+
+    return _GMAIL_BACKEND.value
+
+
+def get_fetch_workers() -> int:
+    """Returns the number of emails of an account fetched at the same time.
+
+    Recorded fixtures are written by a single client, hence the emails
+    are fetched one by one while recording.
+    """
+
+    if _HTTP_FIXTURE_MODE.value == 'record':
+        return 1
+
+    return _FETCH_WORKERS.value
+
+
+def get_time_budget() -> int:
+    """Returns the seconds a stage may take, 0 for no limit.
+    """
+
+    return _TIME_BUDGET.value
+
+
+def get_solutions_dir() -> str:
+    """Returns the folder where the solutions are saved.
+    """
+
+    return _SOLUTIONS_DIR.value
+
+
+def _get_fixture_store(name: str) -> http_fixtures.FixtureStore:
+    """Returns the fixture store of the named HTTP client.
+
+    Args:
+        name: The name of the fixture file without extension
+    """
+
+    os.makedirs(_HTTP_FIXTURE_DIR.value, exist_ok=True)
+    store = http_fixtures.FixtureStore(
+        os.path.join(_HTTP_FIXTURE_DIR.value, f'{name}.jsonl'))
+
+    if _HTTP_FIXTURE_MODE.value == 'replay':
+        store.load()
+
+    return store
+
+
+_hedgers = {}
+_breakers = {}
+_retriers = {}
+_html_services = {}
+_run_data_lock = threading.RLock()
+
+
+def _get_hedger(name: str) -> hedging.Hedger:
+    """Returns the hedger of an operation if requests are hedged.
+
+    A single hedger is shared by all the accounts so that the latency
+    percentile is observed over all the requests of the operation. Its
+    threads fit a request and a duplicate for every worker of every
+    account, so that hedging doesn't cap the concurrent requests.
+    Recorded fixtures are written by a single client, hence requests
+    are never hedged while recording.
+
+    Args:
+        name: The name of the hedged operation
+    """
+
+    if not _HEDGE_REQUESTS.value or _HTTP_FIXTURE_MODE.value == 'record':
+        return None
+
+    if name not in _hedgers:
+        _hedgers[name] = hedging.Hedger(
+            name,
+            percentile=_HEDGE_PERCENTILE.value,
+            max_workers=get_fetch_workers() * len(get_accounts()) * 2)
+
+    return _hedgers[name]
+
+
+def _get_breaker(host: str) -> circuit_breaker.CircuitBreaker:
+    """Returns the circuit breaker of a host.
+
+    A single breaker is shared by all the services calling the host
+    so that the failures of every call count towards its health.
+
+    Args:
+        host: The host of the API
+    """
+
+    if host not in _breakers:
+        _breakers[host] = create_breaker(host)
+
+    return _breakers[host]
+
+
+def create_breaker(host: str) -> circuit_breaker.CircuitBreaker:
+    """Returns a new closed circuit breaker of a host.
+
+    Args:
+        host: The host of the API
+    """
+
+    return circuit_breaker.CircuitBreaker(
+        host,
+        failure_ratio=_API_FAILURE_RATIO.value,
+        reset_timeout=_API_RESET_TIMEOUT.value)
+
+
+def _get_retrier(name: str, max_retries: int) -> retrying.Retrier:
+    """Returns the retrier of an operation if failed calls are retried.
+
+    Args:
+        name: The name of the retried operation
+        max_retries: The number of times a call is sent again
+    """
+
+    if max_retries <= 0:
+        return None
+
+    if name not in _retriers:
+        _retriers[name] = retrying.Retrier(name, max_retries, _RETRY_BACKOFF.value)
+
+    return _retriers[name]
+
+
+def get_gmail_retrier() -> retrying.Retrier:
+    """Returns the retrier shared by the gmail calls of all the accounts.
+    """
+
+    return _get_retrier('gmail', _GMAIL_RETRIES.value)
+
+
+def get_api_retrier() -> retrying.Retrier:
+    """Returns the retrier of the solution API calls.
+    """
+
+    return _get_retrier('solution_api', _API_RETRIES.value)
+
 
+def _get_gmail_fixture_name(token_file: str) -> str:
+    """Returns the fixture name of the gmail account.
 
-def init_and_get_gmail_service() -> gmail_service.GmailService:
+    Args:
+        token_file: The token file of the account
+    """
+
+    account = os.path.splitext(os.path.basename(token_file))[0]
+    return f'gmail_{account}'
+
+
+def get_blob_store() -> blob_store.BlobStore:
+    """Returns the blob store backing the solution files.
+    """
+
+    return blob_store.BlobStore(os.path.join(_SOLUTIONS_DIR.value, '.blobs'))
+
+
+def init_and_get_gmail_service(token_file: str = None) -> gmail_service.GmailService:
     """Returns an authenticated gmail service object.
+
+    When replaying fixtures no credential is loaded at all.
+
+    Args:
+        token_file: The token file of the account, defaults to --token_file
     """
 
+    if not token_file:
+        token_file = _TOKEN_FILE.value
+
+    if _HTTP_FIXTURE_MODE.value == 'replay':
+        logging.info('Replaying gmail fixtures for %s', token_file)
+        store = _get_fixture_store(_get_gmail_fixture_name(token_file))
+        gmail_svc = gmail_service.GmailService(
+            None,
+            http=http_fixtures.ReplayHttp(store, _REPLAY_LATENCY_SCALE.value),
+            hedger=_get_hedger('gmail'),
+            retrier=get_gmail_retrier())
+        gmail_svc.load_gmail_resource()
+        return gmail_svc
+
     # start by getting the credential
     # initialize an oauth flow in case the token is not present
     # or is invalid
     try:
         cred = credential_service.Credential(
             cred_file=_CRED_FILE.value,
-            token_file=_TOKEN_FILE.value,
+            token_file=token_file,
             scopes=_SCOPES.value)
         token = cred.get_token()
     except:
         logging.exception('Exiting! Unable to load Credentials')
         sys.exit('Exiting Program!')
 
+    http = None
+    if _HTTP_FIXTURE_MODE.value == 'record':
+        logging.info('Recording gmail fixtures for %s', token_file)
+        store = _get_fixture_store(_get_gmail_fixture_name(token_file))
+        http = http_fixtures.RecordingHttp(AuthorizedHttp(token), store)
+
     # get the gmail service instance
     try:
-        gmail_svc = gmail_service.GmailService(token)
+        if _GMAIL_BACKEND.value == 'rest' and not http:
+            # imported here so that the discovery backend doesn't load httpx
+            import gmail_rest
+            gmail_svc = gmail_rest.RestGmailService(
+                token,
+                hedger=_get_hedger('gmail'),
+                retrier=get_gmail_retrier())
+        else:
+            gmail_svc = gmail_service.GmailService(
+                token,
+                http=http,
+                hedger=_get_hedger('gmail'),
+                retrier=get_gmail_retrier())
         gmail_svc.load_gmail_resource()
     except:
         logging.exception('Exiting! Unable to load the GMail service')
@@ -62,8 +397,106 @@ def init_and_get_gmail_service() -> gmail_service.GmailService:
     return gmail_svc
 
 
-def get_run_data() -> object:
+def init_and_get_gmail_services(
+    accounts: Sequence[str] = None) -> Dict[str, gmail_service.GmailService]:
+    """Returns an authenticated gmail service object for each account.
+
+    Every account has its own gmail service and hence its own quota.
+
+    Args:
+        accounts: The token files of the accounts, defaults to all accounts
+    """
+
+    if accounts is None:
+        accounts = get_accounts()
+
+    logging.info('Initializing gmail services for %d account(s)', len(accounts))
+    return {account: init_and_get_gmail_service(account) for account in accounts}
+
+
+def init_and_get_html_service() -> html_service.Html_Service:
+    """Returns the html service shared by all the shards.
+
+    The service is created on first use and keeps a single HTTP session,
+    so that every shard, and every cycle of the daemon, reuses the same
+    connection pool to the solution API.
+    """
+
+    host = html_service.Html_Service.API_HOST
+    if host not in _html_services:
+        _html_services[host] = _create_html_service(host)
+
+    return _html_services[host]
+
+
+def _create_html_service(host: str) -> html_service.Html_Service:
+    """Returns a new html service with its own HTTP session.
+
+    Args:
+        host: The host of the solution API
+    """
+
+    session = requests.Session()
+
+    if _HTTP_FIXTURE_MODE.value == 'record':
+        logging.info('Recording solution API fixtures')
+        store = _get_fixture_store('solution_api')
+        session.mount('https://', http_fixtures.RecordingAdapter(store))
+    elif _HTTP_FIXTURE_MODE.value == 'replay':
+        logging.info('Replaying solution API fixtures')
+        store = _get_fixture_store('solution_api')
+        adapter = http_fixtures.ReplayAdapter(store, _REPLAY_LATENCY_SCALE.value)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+    return html_service.Html_Service(
+        session,
+        hedger=_get_hedger('solution_api'),
+        breaker=_get_breaker(host),
+        retrier=get_api_retrier())
+
+
+def run_sharded(
+    func: Callable[[str, gmail_service.GmailService], object],
+    gmail_services: Dict[str, gmail_service.GmailService]) -> Dict[str, object]:
+    """Runs the function for every account concurrently.
+
+    Each account is processed on its own thread since the underlying
+    gmail resource of an account must not be shared between threads.
+
+    Args:
+        func: The function called with the account and its gmail service
+        gmail_services: The gmail service of each account
+
+    Returns:
+        A dictionary of account and the result of the function
+    """
+
+    results = {}
+    if not gmail_services:
+        return results
+
+    with futures.ThreadPoolExecutor(max_workers=len(gmail_services)) as executor:
+        future_to_account = {
+            executor.submit(func, account, gmail_svc): account
+            for account, gmail_svc in gmail_services.items()}
+
+        for future in futures.as_completed(future_to_account):
+            account = future_to_account[future]
+            results[account] = future.result()
+            logging.info('Completed shard for account %s', account)
+
+    return results
+
+
+def get_run_data(exit_on_error: bool = True) -> object:
     """Loads the data file and returns the last run data.
+
+    Args:
+        exit_on_error: Whether to exit or raise if the data file is corrupted
+
+    Raises:
+        BadDataFileError: The data file is corrupted and exit_on_error is False
     """
 
     # Loading the data file
@@ -71,14 +504,24 @@ def get_run_data() -> object:
     run_data = {}
     if os.path.exists(_DATA_FILE.value):
         try:
-            with open(_DATA_FILE.value, 'rb') as file:
+            with tracing.span('state.load'), open(_DATA_FILE.value, 'rb') as file:
                 run_data = pickle.load(file)
         except OSError:
             logging.exception('Exiting! Unable to load data file.')
             sys.exit('Exiting Program!')
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError, ValueError):
+            if not exit_on_error:
+                raise BadDataFileError('The data file is corrupted')
+            logging.exception('Exiting! The data file is corrupted, use rebuild_state.py to recover.')
+            sys.exit('Exiting Program!')
     else:
         logging.warning('No run data file found!')
 
+    # share the few difficulty strings between all the problems
+    problems = run_data.get('problems', {})
+    for problem_id, difficulty in problems.items():
+        problems[problem_id] = sys.intern(difficulty)
+
     return run_data
 
 
@@ -89,10 +532,99 @@ def save_run_data(run_data: object) -> None:
         run_date: the state of the runtime data
     """    
 
+    # write to a temporary file first so that an interrupted
+    # write never leaves a corrupted data file behind
+    temp_file = _DATA_FILE.value + '.tmp'
     try:
         logging.info('Writing to data file: %s', _DATA_FILE.value)
-        with open(_DATA_FILE.value, 'wb') as file:
-            pickle.dump(run_data, file)
+        with _run_data_lock:
+            with tracing.span('state.save'), open(temp_file, 'wb') as file:
+                pickle.dump(run_data, file)
+            os.replace(temp_file, _DATA_FILE.value)
     except OSError:
         logging.exception('Error while writing to data file!')
-        sys.exit('Exiting Program!')    
\ No newline at end of file
+        sys.exit('Exiting Program!')
+
+
+def checkpoint_run_data(
+    run_data: Dict[str, object],
+    update: Callable[[Dict[str, object]], None]) -> None:
+    """Updates the run state data and saves it into a file.
+
+    The update and the save are serialized, so that shards running on
+    different threads can checkpoint the same run state data.
+
+    Args:
+        run_data: the state of the runtime data
+        update: Called with the run state data to apply the changes
+    """
+
+    with _run_data_lock:
+        update(run_data)
+        save_run_data(run_data)
+
+
+@contextlib.contextmanager
+def _lock_data_file() -> Iterator[None]:
+    """Locks the data file against the other processes while the block runs.
+    """
+
+    with open(_DATA_FILE.value + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def update_run_data(update: Callable[[Dict[str, object]], None]) -> Dict[str, object]:
+    """Applies an update to the latest run state data saved in the file.
+
+    The data file is locked, read again, updated and saved, so that
+    workers running as separate processes never overwrite the changes
+    of each other. Only the changes of the worker should be applied.
+
+    Args:
+        update: Called with the latest run state data to apply the changes
+
+    Returns:
+        The updated run state data
+    """
+
+    with _run_data_lock, _lock_data_file():
+        run_data = get_run_data()
+        update(run_data)
+        save_run_data(run_data)
+
+    return run_data
+
+
+def run(main: Callable[[Sequence[str]], None]) -> None:
+    """Runs the main function of an entry point.
+
+    This is a drop in replacement of app.run that applies the flags
+    common to all the entry points, such as exporting a trace or
+    profiling the run, and reports the counters of the run.
+    The main function is profiled as the stage named after the program.
+
+    Args:
+        main: The main function of the entry point
+    """
+
+    def run_main(argv: Sequence[str]) -> None:
+        if _TRACE_FILE.value:
+            tracing.enable()
+        if _PROFILE.value:
+            profiling.enable(_PROFILE_DIR.value, _PROFILE_MEMORY.value)
+
+        program = os.path.splitext(os.path.basename(argv[0]))[0]
+        try:
+            with tracing.span('main', program=program), profiling.stage(program):
+                main(argv)
+        finally:
+            if _TRACE_FILE.value:
+                tracing.export(_TRACE_FILE.value)
+            profiling.export()
+            metrics.report()
+
+    app.run(run_main)
@@ -1,21 +1,21 @@
 """This module will read in a list of emails IDs from a file
 and parse the contained solution links and save it in a file.
+
+The emails of each account are processed concurrently as shards and
+the links are merged. Every link of a problem is kept, so that the
+solutions stage can fall back on another link when one fails.
 """
 
 from typing import Sequence
 from typing import Dict
 
-from absl import app
-from absl import flags
 from absl import logging
 
 import dcp_service
 import download_helper
-
-_BATCH_SIZE = flags.DEFINE_integer(
-    'batch_size', 0,
-    'Maximum items to process in a given run'
-)
+import gmail_service
+import progress
+import tracing
 
 
 def main(argv: Sequence[str]) -> None:
@@ -25,26 +25,70 @@ def main(argv: Sequence[str]) -> None:
 
     run_data = download_helper.get_run_data()
     emails = run_data.get('emails', [])
-    problems = run_data.get('problems', {})
 
     assert emails, "Please download emails before proceeding!"
 
+    gmail_services = download_helper.init_and_get_gmail_services()
+    with tracing.span('links.update'):
+        has_changes = update_links(run_data, gmail_services, download_helper.get_batch_size())
+
+    # update data file only if emails were processed
+    if has_changes:
+        download_helper.save_run_data(run_data)
+
+    logging.info('Completed!')
+
+
+def update_links(
+    run_data: Dict[str, object],
+    gmail_services: Dict[str, gmail_service.GmailService],
+    batch_size: int) -> bool:
+    """Fetches the links and problems of the unprocessed emails into the run data.
+
+    Args:
+        run_data: The state of the runtime data
+        gmail_services: The gmail service of each account
+        batch_size: Maximum emails to process, all emails if 0
+
+    Returns:
+        Whether the run data was changed
+    """
+
+    emails = run_data.get('emails', {})
+    problems = run_data.get('problems', {})
+
     new_emails = {email_id:None for email_id,sub in emails.items() if not sub}
-    batch_size = email_count = len(new_emails)
+    email_count = len(new_emails)
     problem_count = len(problems)
 
-    if _BATCH_SIZE.value:
-        batch_size = _BATCH_SIZE.value
+    if not batch_size:
+        batch_size = email_count
 
     logging.info('Processing %d / %d emails',
         batch_size, email_count)    
 
-    gmail_svc = download_helper.init_and_get_gmail_service()
-    dcp_svc = dcp_service.DCP_Service(gmail_svc)
-    new_emails, links = dcp_svc.get_subject_and_links(new_emails, batch_size)
-    problems = dcp_svc.collect_problem_difficulty(new_emails, problems)
+    shards = split_emails_by_account(
+        new_emails,
+        run_data.get('email_accounts', {}),
+        batch_size)
+    # the shards share a tracker, hence the time budget is for the whole batch
+    tracker = progress.ProgressTracker(
+        'emails',
+        sum(len(shard) for shard in shards.values()),
+        download_helper.get_time_budget())
+    results = download_helper.run_sharded(
+        lambda account, gmail_svc: dcp_service.DCP_Service(gmail_svc).get_subject_and_links(
+            shards[account], len(shards[account]), tracker, download_helper.get_fetch_workers()),
+        {account: gmail_services[account] for account in shards})
+
+    new_emails = {}
+    links = set()
+    for shard_emails, shard_links in results.values():
+        new_emails.update(shard_emails)
+        links.update(shard_links)
+
+    problems = dcp_service.DCP_Service.collect_problem_difficulty(new_emails, problems)
 
-    # update data file only if emails were processed
     has_changes = False
     if links:
         has_changes = True
@@ -56,12 +100,55 @@ def main(argv: Sequence[str]) -> None:
         has_changes = True        
         run_data['problems'] = problems
 
-    if has_changes:
+    # an email without a new link or problem, e.g. a duplicate, is processed as well
+    if new_emails:
+        has_changes = True
         emails = collect_all_emails(new_emails, emails)
         run_data['emails'] = emails
-        download_helper.save_run_data(run_data)
 
-    logging.info('Completed!')
+    return has_changes
+
+
+def split_emails_by_account(
+    emails: Dict[str, str],
+    email_accounts: Dict[str, str],
+    batch_size: int) -> Dict[str, Dict[str, str]]:
+    """Splits a batch of emails into one shard for each account.
+
+    Emails from accounts that are not configured for this run are skipped.
+
+    Args:
+        emails: The emails to be processed
+        email_accounts: A dictionary of email ids and the account they belong to
+        batch_size: Number of emails to process
+
+    Returns:
+        A dictionary of account and the emails of that account
+    """
+
+    logging.info('Splitting emails by account')
+
+    accounts = download_helper.get_accounts()
+    default_account = download_helper.get_default_account()
+
+    shards = {}
+    email_count = 0
+    for email_id in emails:
+        if email_count >= batch_size:
+            break
+
+        account = email_accounts.get(email_id, default_account)
+        if account not in accounts:
+            logging.debug('Skipping email %s of account %s', email_id, account)
+            continue
+
+        shards.setdefault(account, {})[email_id] = None
+        email_count += 1
+
+    for account, shard in shards.items():
+        logging.info('Processing %d emails from account %s', len(shard), account)
+
+    return shards
 
 
 def collect_all_emails(
@@ -90,6 +177,12 @@ def collect_all_links(
     links: Dict[str,str]) -> Dict[str,str]:
     """Collects the list of new links into a dict and returns.
 
+    The links sent to different accounts carry different tokens. Every
+    link of a problem is kept, so that the solutions stage can try the
+    next one when the token of a link doesn't work. Once a link of the
+    problem is downloaded, the others are matched to its file without
+    being fetched.
+
     Args:
         new_links: A list of newly fetched links
         links: A dictionary of saved links and file mapping
@@ -111,4 +204,4 @@ def collect_all_links(
 
 
 if __name__ == '__main__':
-    app.run(main)
\ No newline at end of file
+    download_helper.run(main)
\ No newline at end of file
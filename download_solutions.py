@@ -5,100 +5,359 @@ and will then fetch the solutions for the files that are not processed
 and save them as individual files.
 
 This should process only the newer links.
+
+A solution is downloaded as soon as its link is known. The problem id
+is taken from the solution itself, and when the difficulty of the
+problem is not known yet the file is saved in the Unknown folder and
+moved to its difficulty folder on a later run.
+
+With --latest only the solutions linked from the newest email are
+downloaded, without loading the run data. A later full run finds the
+files on disk and records them instead of downloading them again.
 """
 
+from typing import Optional
 from typing import Sequence
 from typing import Dict
 
-from absl import app
 from absl import flags
 from absl import logging
 
+import circuit_breaker
+import dcp_service
 import download_helper
+import gmail_service
 import html_service
+import progress
+import tracing
 
 import os
+import re
+import requests
+
 
+# difficulty folder of the solutions whose subject was not parsed yet
+UNKNOWN_DIFFICULTY = 'Unknown'
 
-_BATCH_SIZE = flags.DEFINE_integer(
-    'batch_size', 0,
-    'Maximum items to process in a given run'
-)
+_LATEST = flags.DEFINE_boolean(
+    'latest', False,
+    'Only download the solutions linked from the newest email, without loading the run data')
 
 
 def main(argv: Sequence[str]) -> None:
     del argv
 
     logging.info('Running program...')
+
+    if _LATEST.value:
+        with tracing.span('solutions.latest'):
+            download_latest(
+                download_helper.init_and_get_gmail_service(),
+                download_helper.init_and_get_html_service())
+        logging.info('Completed!')
+        return
+
     run_data = download_helper.get_run_data()
     links = run_data.get('links', {})
-    problems = run_data.get('problems', {})
 
     assert links, "Please download links from emails before proceeding!"
 
+    html_svc = download_helper.init_and_get_html_service()
+    with tracing.span('solutions.update'):
+        has_changes = update_solutions(run_data, html_svc, download_helper.get_batch_size())
+
+    if has_changes:
+        download_helper.save_run_data(run_data)
+    
+    logging.info('Completed!')
+
+
+def update_solutions(
+    run_data: Dict[str, object],
+    html_svc: html_service.Html_Service,
+    batch_size: int) -> bool:
+    """Downloads the solutions of the unprocessed links into files.
+
+    Args:
+        run_data: The state of the runtime data
+        html_svc: The html service used to fetch the solutions
+        batch_size: Maximum links to process, all links if 0
+
+    Returns:
+        Whether the run data was changed
+    """
+
+    links = run_data.get('links', {})
+    problems = run_data.get('problems', {})
+
     new_links = {link:None for link,val in links.items() if not val}
-    batch_size = link_count = len(new_links)
+    link_count = len(new_links)
 
-    if _BATCH_SIZE.value:
-        batch_size = _BATCH_SIZE.value
+    if not batch_size:
+        batch_size = link_count
 
     logging.info('Processing %d / %d links',
         batch_size, link_count)    
 
-    new_links = download_content_from_links(problems, new_links, batch_size)
+    placed_links = place_unknown_solutions(problems, links)
+    if placed_links:
+        links = collect_all_links(placed_links, links)
+        run_data['links'] = links
+
+    downloaded = collect_downloaded_problems(links, run_data.get('solution_paths', {}))
+    tracker = progress.ProgressTracker(
+        'links',
+        min(batch_size, link_count),
+        download_helper.get_time_budget())
+    new_links = download_content_from_links(
+        problems, new_links, batch_size, downloaded, html_svc, tracker)
     if new_links:
         links = collect_all_links(new_links, links)
         run_data['links'] = links
-        download_helper.save_run_data(run_data)
-    
-    logging.info('Completed!')
+
+    return bool(new_links or placed_links)
+
+
+def download_latest(
+    gmail_svc: gmail_service.GmailService,
+    html_svc: html_service.Html_Service) -> Dict[int, str]:
+    """Downloads the solutions linked from the newest email.
+
+    The run data is neither loaded nor saved. The difficulty of a
+    solution is only known when it is the problem of the newest email,
+    otherwise it is saved in the Unknown folder until a full run.
+
+    Args:
+        gmail_svc: The gmail service of the account
+        html_svc: The html service used to fetch the solutions
+
+    Returns:
+        Dictionary of problem id and path where the file is stored
+    """
+
+    dcp_svc = dcp_service.DCP_Service(gmail_svc)
+    message_id = dcp_svc.get_latest_message_id()
+    if not message_id:
+        logging.warning('No email found')
+        return {}
+
+    subject, body, mime_type = dcp_svc.get_message_body(message_id)
+    problems = {}
+    problem = dcp_service.DCP_Service.parse_subject(subject) if subject else None
+    if problem:
+        problems[problem[0]] = problem[1]
+
+    links = dcp_svc.get_solution_links(body, mime_type) if body else []
+    logging.info('Found %d solution link(s) in the latest email', len(links))
+
+    new_links = download_content_from_links(
+        problems, {link: None for link in links}, len(links), html_svc=html_svc)
+
+    return {html_svc.get_problem_number(link): file_path
+        for link, file_path in new_links.items()}
+
+
+def collect_downloaded_problems(
+    links: Dict[str,str],
+    solution_paths: Dict[int,str] = None) -> Dict[int,str]:
+    """Returns the problems that already have a solution file.
+
+    Args:
+        links: Dictionary of link and path where file is stored
+        solution_paths: Dictionary of problem id and path of the solution
+            files recovered by rebuild_state.py
+
+    Returns:
+        Dictionary of problem id and path where the file is stored
+    """
+
+    logging.info('Collecting downloaded problems')
+    downloaded = {}
+    if solution_paths:
+        for problem_id, file_path in solution_paths.items():
+            if os.path.exists(file_path):
+                downloaded[problem_id] = file_path
+
+    for link, file_path in links.items():
+        if file_path:
+            downloaded[html_service.Html_Service.get_problem_number(link)] = file_path
+
+    return downloaded
 
 
 def download_content_from_links(
     problems: Dict[int, str], 
     links: Dict[str,str], 
-    batch_size: int) -> Dict[str,str]:
+    batch_size: int,
+    downloaded: Dict[int,str] = None,
+    html_svc: html_service.Html_Service = None,
+    tracker: progress.ProgressTracker = None) -> Dict[str,str]:
     """Fetch content from links and download it to a file.
+
+    A problem that was already downloaded through another link, e.g.
+    from another account, is not fetched again. A link whose solution
+    cannot be fetched is left for a later run, and the next link of the
+    same problem, if any, is tried instead. The batch stops once the
+    solution API is found unhealthy.
     
     Args:
         problems: Dictionary of problem id and difficulty
         links: Dictionary of link and path where file is stored
         batch_size: Number of links to process at a given time
+        downloaded: Dictionary of problem id and path of downloaded solutions
+        html_svc: The html service used to fetch the solutions
+        tracker: Stops the batch once its time budget is used up
     
     Returns:
         Dictionary of links that were fetched
     """
 
     logging.info('Downloading content from links')
-    html_svc = html_service.Html_Service()
+    if not html_svc:
+        html_svc = download_helper.init_and_get_html_service()
+
+    if downloaded is None:
+        downloaded = {}
 
     new_links = {}
     for ix, link in enumerate(links.keys()):
         if ix >= batch_size:
             break
-        
-        problem_id = html_svc.get_problem_number(link)
-        if not problem_id in problems:
-            logging.error('Error! Problem ID %d has not been collected!', problem_id)
+
+        if tracker and not tracker.should_continue():
             break
-        else:
-            logging.info('Fetching solution for %d', problem_id)
         
-        api_link = html_svc.get_api_link_from_href(link)
-        content = html_svc.get_api_content_as_md(api_link)
+        problem_id = html_svc.get_problem_number(link)
+        if problem_id not in downloaded:
+            # the file may have been saved by a run with --latest
+            file_path = find_solution_file(problem_id, problems.get(problem_id))
+            if file_path:
+                downloaded[problem_id] = file_path
+
+        if problem_id in downloaded:
+            logging.info('Problem %d is already downloaded', problem_id)
+            new_links[link] = downloaded[problem_id]
+            if tracker:
+                tracker.record()
+            continue
+
+        logging.info('Fetching solution for %d', problem_id)
         
-        file_path = save_content_to_file(problem_id, problems[problem_id], content)
+        with tracing.span('solutions.download', problem_id=problem_id):
+            api_link = html_svc.get_api_link_from_href(link)
+            try:
+                solution = html_svc.get_api_solution(api_link, problem_id)
+            except circuit_breaker.CircuitOpenError:
+                logging.warning('Solution API is unhealthy, leaving the remaining links for later')
+                break
+            except (html_service.InvalidJsonApiError, requests.RequestException):
+                logging.warning('Unable to fetch solution for %d, will retry later', problem_id)
+                continue
+
+            content = html_svc.format_solution_as_md(solution)
+
+            # the id of the solution is authoritative over the link
+            problem_id = int(solution['problemId'])
+            difficulty = problems.get(problem_id, UNKNOWN_DIFFICULTY)
+            if difficulty == UNKNOWN_DIFFICULTY:
+                logging.warning('Difficulty of problem %d is not known yet', problem_id)
+            
+            file_path = save_content_to_file(problem_id, difficulty, content)
         new_links[link] = file_path
+        downloaded[problem_id] = file_path
+
+        if tracker:
+            tracker.record()
     
     return new_links
 
 
+def get_solution_path(problem_id: int, difficulty: str) -> str:
+    """Returns the path of the solution file of a problem.
+
+    Args:
+        problem_id: The problem number
+        difficulty: The difficulty of the problem
+    """
+
+    return os.path.join(
+        download_helper.get_solutions_dir(),
+        difficulty,
+        f'problem_{problem_id:03d}.md')
+
+
+def find_solution_file(problem_id: int, difficulty: str = None) -> Optional[str]:
+    """Returns the path of an existing solution file of a problem.
+
+    Args:
+        problem_id: The problem number
+        difficulty: The difficulty of the problem if it is known
+
+    Returns:
+        The path of the file in the difficulty or the Unknown folder,
+        None if the solution wasn't saved
+    """
+
+    for folder in (difficulty, UNKNOWN_DIFFICULTY):
+        if not folder:
+            continue
+
+        file_path = get_solution_path(problem_id, folder)
+        if os.path.exists(file_path):
+            return file_path
+
+    return None
+
+
+def place_unknown_solutions(
+    problems: Dict[int, str],
+    links: Dict[str,str]) -> Dict[str,str]:
+    """Moves the solutions of unknown difficulty into their difficulty folder.
+
+    Args:
+        problems: Dictionary of problem id and difficulty
+        links: Dictionary of link and path where file is stored
+
+    Returns:
+        Dictionary of links that were moved with their new path
+    """
+
+    logging.info('Placing solutions of unknown difficulty')
+    unknown_dir = os.path.join(download_helper.get_solutions_dir(), UNKNOWN_DIFFICULTY)
+
+    moved_links = {}
+    for link, file_path in links.items():
+        if not file_path or os.path.dirname(file_path) != unknown_dir:
+            continue
+
+        file_name = os.path.basename(file_path)
+        problem_id = int(re.search(r'\d+', file_name).group())
+        difficulty = problems.get(problem_id)
+        if not difficulty:
+            continue
+
+        solution_dir = os.path.join(download_helper.get_solutions_dir(), difficulty)
+        new_file_path = os.path.join(solution_dir, file_name)
+        os.makedirs(solution_dir, exist_ok=True)
+
+        if os.path.exists(file_path):
+            logging.info('Moving problem %d to %s', problem_id, solution_dir)
+            os.replace(file_path, new_file_path)
+
+        moved_links[link] = new_file_path
+
+    return moved_links
+
+
 def save_content_to_file(
     problem_id: int, 
     difficulty: str, 
     content: str) -> str:
     """Saves the content into a local file.
 
+    The content is stored once in the blob store and the file
+    is a hardlink to the stored content.
+
     Args: 
         problem_id: The problem number
         difficulty: The difficulty of the problem
@@ -109,15 +368,17 @@ def save_content_to_file(
     """
 
     logging.info('Saving problem %d to file', problem_id)
-    solution_dir = os.path.join('solutions', difficulty)
-    file_path = os.path.join(solution_dir, f'problem_{problem_id:03d}.md')
+    file_path = get_solution_path(problem_id, difficulty)
+    solution_dir = os.path.dirname(file_path)
     
     if not os.path.exists(solution_dir):
         logging.info('Creating folder %s', solution_dir)
         os.mkdir(solution_dir)
     
-    with open(file_path, 'w') as file:
-        file.write(content)
+    with tracing.span('solutions.write_file', problem_id=problem_id):
+        store = download_helper.get_blob_store()
+        digest = store.put(content.encode('utf-8'))
+        store.link(digest, file_path)
     logging.info('File written! %s', file_path)
 
     return file_path
@@ -144,4 +405,4 @@ def collect_all_links(
 
 
 if __name__ == "__main__":
-    app.run(main)
\ No newline at end of file
+    download_helper.run(main)
\ No newline at end of file
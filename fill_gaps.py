@@ -0,0 +1,189 @@
+"""This module fetches the emails of the problems missing from the run data.
+
+The problem numbers from 1, or --from, to the last known problem, or
+--to, that are not in the run data are searched for in every account,
+a few dozen at a time with queries of the form
+`subject:(Daily Coding Problem) subject:("Problem #12" OR "Problem #13")`.
+Only the matching messages that were not processed yet are fetched, and
+they go through the same links and solutions stages as a regular run.
+
+The problems that are still missing afterwards are printed, e.g. when
+no email of the problem was ever received.
+"""
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+from absl import flags
+from absl import logging
+
+import backfill
+import dcp_service
+import download_emails
+import download_helper
+import download_links
+import download_solutions
+import gmail_service
+import tracing
+
+
+_IDS_PER_QUERY = flags.DEFINE_integer(
+    'ids_per_query', 30,
+    'Number of missing problems searched for with a single query')
+_FROM = flags.DEFINE_integer(
+    'from', 1,
+    'First problem number searched for')
+_TO = flags.DEFINE_integer(
+    'to', None,
+    'Last problem number searched for, defaults to the last known problem')
+
+
+def find_missing_ranges(
+    problems: Dict[int, str],
+    first: int = 1,
+    last: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Returns the ranges of problem numbers missing from the known problems.
+
+    Args:
+        problems: Dictionary of problem id and difficulty
+        first: The first problem number searched for
+        last: The last problem number searched for, defaults to the last known problem
+
+    Returns:
+        The first and last problem number of every gap, in order
+    """
+
+    if last is None:
+        last = max(problems, default=0)
+
+    ranges = []
+    # the bounds are sentinels, so that the gaps before the first and after
+    # the last known problem are found like the ones in between
+    problem_ids = [first - 1] + sorted(p for p in problems if first <= p <= last) + [last + 1]
+    for previous, current in zip(problem_ids, problem_ids[1:]):
+        if current - previous > 1:
+            ranges.append((previous + 1, current - 1))
+
+    return ranges
+
+
+def search_missing_problems(
+    gmail_svc: gmail_service.GmailService,
+    missing: Sequence[int],
+    ids_per_query: int) -> List[str]:
+    """Returns the ids of the messages of the missing problems in an account.
+
+    Args:
+        gmail_svc: The gmail service of the account
+        missing: The missing problem numbers
+        ids_per_query: Number of problems searched for with a single query
+    """
+
+    dcp_svc = dcp_service.DCP_Service(gmail_svc)
+
+    message_ids = []
+    for ix in range(0, len(missing), ids_per_query):
+        problem_ids = missing[ix:ix + ids_per_query]
+        with tracing.span('gaps.search', problems=len(problem_ids)):
+            message_ids.extend(dcp_svc.get_problem_messages(problem_ids))
+
+    return message_ids
+
+
+def fill_gaps(
+    run_data: Dict[str, object],
+    gmail_services: Dict[str, gmail_service.GmailService],
+    ids_per_query: int,
+    first: int = 1,
+    last: Optional[int] = None) -> Set[int]:
+    """Fetches the emails and solutions of the missing problems into the run data.
+
+    Args:
+        run_data: The state of the runtime data
+        gmail_services: The gmail service of each account
+        ids_per_query: Number of problems searched for with a single query
+        first: The first problem number searched for
+        last: The last problem number searched for, defaults to the last known problem
+
+    Returns:
+        The problem numbers that were found
+    """
+
+    problems = run_data.get('problems', {})
+    ranges = find_missing_ranges(problems, first, last)
+    missing = [problem_id for first, last in ranges for problem_id in range(first, last + 1)]
+    logging.info('Found %d missing problems in %d gaps', len(missing), len(ranges))
+    if not missing:
+        return set()
+
+    account_email_ids = download_helper.run_sharded(
+        lambda account, gmail_svc: search_missing_problems(gmail_svc, missing, ids_per_query),
+        gmail_services)
+
+    emails = run_data.get('emails', {})
+    email_accounts = download_emails.collect_email_accounts(
+        account_email_ids, run_data.get('email_accounts', {}))
+    new_emails = {email_id: None
+        for email_ids in account_email_ids.values()
+        for email_id in email_ids if not emails.get(email_id)}
+    logging.info('Fetching %d emails of the missing problems', len(new_emails))
+
+    run_data['emails'] = download_emails.collect_all_emails(new_emails, emails)
+    run_data['email_accounts'] = email_accounts
+    if not new_emails:
+        return set()
+
+    # only the emails of the gaps are processed, not the other pending emails
+    links_data = {'emails': new_emails, 'email_accounts': email_accounts}
+    with tracing.span('gaps.links'):
+        download_links.update_links(links_data, gmail_services, len(new_emails))
+    backfill.merge_links(run_data, links_data)
+
+    # a problem that was already downloaded through another link is not fetched again
+    links = run_data.get('links', {})
+    new_links = {link: None for link in links_data.get('links', {})
+        if link in links and not links[link]}
+    if new_links:
+        solutions_data = {
+            'links': new_links,
+            'problems': run_data['problems'],
+            'solution_paths': run_data.get('solution_paths', {}),
+        }
+        with tracing.span('gaps.solutions'):
+            download_solutions.update_solutions(
+                solutions_data, download_helper.init_and_get_html_service(), len(new_links))
+        backfill.merge_solutions(run_data, solutions_data)
+
+    return set(missing) & set(run_data['problems'])
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    run_data = download_helper.get_run_data()
+    assert run_data.get('problems'), "Please download links from emails before proceeding!"
+
+    found = fill_gaps(
+        run_data,
+        download_helper.init_and_get_gmail_services(),
+        _IDS_PER_QUERY.value,
+        _FROM.value,
+        _TO.value)
+    logging.info('Found %d missing problems', len(found))
+
+    download_helper.save_run_data(run_data)
+
+    for first, last in find_missing_ranges(run_data['problems'], _FROM.value, _TO.value):
+        print(f'problems {first} to {last} not found' if first != last else f'problem {first} not found')
+
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
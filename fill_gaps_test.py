@@ -0,0 +1,58 @@
+"""Tests the search of the missing problems.
+"""
+
+from absl.testing import absltest
+
+import dcp_service
+import fill_gaps
+
+
+class FindMissingRangesTest(absltest.TestCase):
+
+    def test_gaps_between_known_problems(self):
+        problems = {1: 'Easy', 2: 'Easy', 5: 'Hard', 7: 'Medium'}
+
+        self.assertEqual(fill_gaps.find_missing_ranges(problems), [(3, 4), (6, 6)])
+
+
+    def test_gap_before_first_known_problem(self):
+        problems = {4: 'Easy', 5: 'Hard'}
+
+        self.assertEqual(fill_gaps.find_missing_ranges(problems), [(1, 3)])
+
+
+    def test_explicit_range(self):
+        problems = {1: 'Easy', 4: 'Easy', 10: 'Hard'}
+
+        self.assertEqual(fill_gaps.find_missing_ranges(problems, 3, 12), [(3, 3), (5, 9), (11, 12)])
+
+
+    def test_range_inside_known_problems(self):
+        problems = {1: 'Easy', 2: 'Easy', 3: 'Hard'}
+
+        self.assertEqual(fill_gaps.find_missing_ranges(problems, 2, 3), [])
+
+
+    def test_no_known_problems(self):
+        self.assertEqual(fill_gaps.find_missing_ranges({}), [])
+        self.assertEqual(fill_gaps.find_missing_ranges({}, 1, 3), [(1, 3)])
+
+
+class GetProblemsQueryTest(absltest.TestCase):
+
+    def test_query_of_problems(self):
+        query = dcp_service.DCP_Service.get_problems_query([12, 13])
+
+        self.assertEqual(
+            query,
+            'subject:(Daily Coding Problem) subject:("Problem #12" OR "Problem #13")')
+
+
+    def test_query_of_single_problem(self):
+        query = dcp_service.DCP_Service.get_problems_query([7])
+
+        self.assertTrue(query.endswith('subject:("Problem #7")'))
+
+
+if __name__ == '__main__':
+    absltest.main()
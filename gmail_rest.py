@@ -0,0 +1,198 @@
+"""This module talks to the Gmail REST API without googleapiclient.
+
+The downloader only lists the messages matching a query and gets the
+payload of a message, whose subject is then read from its headers. These
+two calls are sent as plain REST requests with an async httpx client,
+over HTTP/2 when the server supports it, so that the concurrent fetches
+of an account are multiplexed on a single connection instead of a pool
+of httplib2 clients, and the discovery document is never loaded.
+
+The client runs on an event loop in a background thread shared by all
+the accounts, and every call blocks until its response, hence the
+service has the interface of GmailService and DCP_Service uses it as is.
+The quota, retries, hedging and coalescing of GmailService apply as well.
+"""
+
+from typing import Dict
+from typing import Optional
+
+from absl import logging
+
+from googleapiclient import errors
+
+import asyncio
+import google_auth_httplib2
+import httplib2
+import httpx
+import ratelimiter
+import socket
+import threading
+
+import gmail_service
+import hedging
+import metrics
+import retrying
+import tracing
+
+
+_BASE_URL = 'https://gmail.googleapis.com/gmail/v1/users/me/'
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the event loop of the clients, started on first use.
+    """
+
+    global _loop
+    with _loop_lock:
+        if not _loop:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='gmail-rest', daemon=True).start()
+
+    return _loop
+
+
+class RestGmailService(gmail_service.GmailService):
+    """Lists and fetches the messages with REST requests.
+
+    Attributes:
+        _base_url: The url of the messages of the user
+        _client: The async client shared by all the calls of the account
+        _token_lock: Serializes the refreshes of the token
+    """
+
+    def __init__(
+        self,
+        token,
+        hedger: hedging.Hedger = None,
+        retrier: retrying.Retrier = None,
+        limiter: ratelimiter.RateLimiter = None,
+        base_url: str = _BASE_URL) -> None:
+
+        super().__init__(token, hedger=hedger, retrier=retrier, limiter=limiter)
+        self._base_url = base_url
+        self._client = None
+        self._token_lock = threading.Lock()
+
+
+    def load_gmail_resource(self) -> None:
+        """Creates the client of the account.
+        """
+
+        if self._client:
+            return
+
+        logging.info('Creating a REST client for %s', self._base_url)
+        # google APIs only compress responses to clients that ask for it
+        self._client = httpx.AsyncClient(
+            base_url=self._base_url,
+            http2=True,
+            timeout=gmail_service.GmailService._TIMEOUT,
+            headers={'accept-encoding': 'gzip', 'user-agent': 'dcp-downloader (gzip)'})
+
+
+    def _get_auth_headers(self) -> Dict[str, str]:
+        """Returns the authorization headers, refreshing the token if it expired.
+        """
+
+        headers = {}
+        if not self._token:
+            return headers
+
+        with self._token_lock:
+            if not self._token.valid:
+                logging.info('Refreshing the token')
+                # the httplib2 transport is already imported by GmailService,
+                # unlike the requests one which takes longer to import than httpx
+                self._token.refresh(google_auth_httplib2.Request(httplib2.Http()))
+            self._token.apply(headers)
+
+        return headers
+
+
+    def _request(self, path: str, params: Dict[str, object]) -> httpx.Response:
+        """Sends a GET request on the event loop and waits for its response.
+
+        The errors are raised as those of googleapiclient and httplib2, so
+        that they are handled in the same way as with GmailService.
+
+        Args:
+            path: The path relative to the messages of the user
+            params: The query parameters, the ones that are None are not sent
+
+        Raises:
+            HttpError: The API returned an error status
+            socket.timeout: The API didn't respond in time
+            ConnectionError: The connection failed or dropped, or the body couldn't be decoded
+        """
+
+        params = {name: value for name, value in params.items() if value is not None}
+        future = asyncio.run_coroutine_threadsafe(
+            self._client.get(path, params=params, headers=self._get_auth_headers()),
+            _get_loop())
+
+        try:
+            response = future.result()
+        except httpx.TimeoutException as e:
+            raise socket.timeout(str(e)) from e
+        except httpx.RequestError as e:
+            # transport errors as well as undecodable bodies and redirect loops
+            raise ConnectionError(f'{type(e).__name__}: {e}') from e
+
+        if response.is_error:
+            info = dict(response.headers)
+            info['status'] = response.status_code
+            resp = httplib2.Response(info)
+            resp.reason = response.reason_phrase
+            raise errors.HttpError(resp, response.content, uri=str(response.url))
+
+        return response
+
+
+    def _list_messages(
+        self,
+        query: str,
+        next_page_token: str,
+        max_results: int) -> Dict[str, object]:
+        """Returns a page of the messages matching the query.
+
+        Args:
+            query: A search term string
+            next_page_token: The pagination token of the page
+            max_results: The number of messages in the page
+        """
+
+        response = self._request('messages', {
+            'q': query,
+            'pageToken': next_page_token,
+            'maxResults': max_results,
+        })
+
+        return response.json()
+
+
+    def _fetch_message(self, message_id: str) -> Optional[object]:
+        """Fetches a message, once the quota of the account allows it.
+
+        Only the fields that are parsed are requested. The bytes received
+        are counted as the gmail.messages counters.
+
+        Args:
+            message_id: The unique id of a given message
+        """
+
+        with tracing.span('gmail.rest_request', message_id=message_id):
+            response = self._request(
+                f'messages/{message_id}',
+                {'fields': gmail_service.GmailService._MESSAGE_FIELDS})
+
+        header_bytes = sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+        metrics.add('gmail.messages.wire_bytes', response.num_bytes_downloaded + header_bytes)
+        metrics.add('gmail.messages.decoded_bytes', len(response.content))
+        metrics.add('gmail.messages.responses')
+        if response.headers.get('content-encoding') != 'gzip':
+            metrics.add('gmail.messages.uncompressed_responses')
+
+        return response.json()
@@ -11,16 +11,42 @@ Methods:
 __init__ : Construct the authenticated gmail service object
 search_message: Search for a specified query term
 get_message_content: Returns the contents of the message
+get_messages: Fetches the contents of many messages concurrently
 
 """
+from typing import Callable
+from typing import Dict
+from typing import Iterator
 from typing import Sequence
 from typing import Tuple
+from typing import TypeVar
 
 from absl import logging
 
-from googleapiclient import discovery
-
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import errors
+
+from concurrent import futures
+from http import client
+from urllib import parse
+import collections
+import contextlib
+import httplib2
+import queue
+import ratelimiter
 import socket
+import time
+
+import hedging
+import metrics
+import progress
+import retrying
+import single_flight
+import tracing
+
+
+T = TypeVar('T')
+
 
 class Error(Exception):
     """Generic error class for this module.
@@ -31,10 +57,103 @@ class BadMessageIdError(Error):
     """
 
 
-class ReadTimeoutError(Error):
+class TransientError(Error):
+    """The call failed but may succeed later, e.g. the connection dropped
+    """
+
+
+class ReadTimeoutError(TransientError):
     """Timeout error when reading the file
     """
 
+
+def is_transient_error(error: Exception) -> bool:
+    """Returns whether a failed gmail call may succeed when sent again.
+
+    Dropped connections, timeouts, truncated or malformed bodies, 429s
+    and server errors are transient, any other HTTP status is not.
+
+    Args:
+        error: The error raised by the call
+    """
+
+    if isinstance(error, errors.HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+
+    return isinstance(error, (client.HTTPException, OSError, ValueError))
+
+
+class _MeteredResponse(client.HTTPResponse):
+    """A response that counts the bytes it receives on the wire.
+
+    The body is counted as it is read, before httplib2 decompresses it.
+
+    Attributes:
+        counter_name: The prefix of the counters, set by the client
+    """
+
+    counter_name = None
+
+    def begin(self) -> None:
+        super().begin()
+        header_bytes = sum(len(name) + len(value) + 4 for name, value in self.getheaders())
+        metrics.add(f'{self.counter_name}.wire_bytes', header_bytes)
+        metrics.add(f'{self.counter_name}.responses')
+        if self.getheader('content-encoding') != 'gzip':
+            metrics.add(f'{self.counter_name}.uncompressed_responses')
+
+
+    def read(self, amt: int = None) -> bytes:
+        content = super().read(amt)
+        metrics.add(f'{self.counter_name}.wire_bytes', len(content))
+        return content
+
+
+class _MeteredHttp(httplib2.Http):
+    """An http client that counts the bytes received on the wire.
+
+    The bytes are counted before the content is decompressed, along with
+    the headers of the response, and added to the counters of the client.
+    Compressed responses are requested from the server.
+
+    The connections are those of httplib2 with a metered response class,
+    and are passed to httplib2 as the connection type of the requests.
+    A scheme without a connection of http.client is not metered.
+    """
+
+    def __init__(self, name: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._name = name
+
+        response_class = type('_MeteredResponse', (_MeteredResponse,), {'counter_name': name})
+        self._connection_types = {
+            scheme: type(connection_type.__name__, (connection_type,), {'response_class': response_class})
+            for scheme, connection_type in getattr(httplib2, 'SCHEME_TO_CONNECTION', {}).items()
+            if issubclass(connection_type, client.HTTPConnection)}
+        if not self._connection_types:
+            logging.warning('Unable to meter the bytes received by %s', name)
+
+
+    def request(self, uri: str, method: str = 'GET', body: object = None,
+        headers: dict = None, redirections: int = httplib2.DEFAULT_MAX_REDIRECTS,
+        connection_type: type = None, **kwargs) -> Tuple[object, bytes]:
+
+        headers = dict(headers) if headers else {}
+        headers['accept-encoding'] = 'gzip'
+        # google APIs only compress responses to clients that ask for it
+        user_agent = headers.get('user-agent', '')
+        if 'gzip' not in user_agent:
+            headers['user-agent'] = f'{user_agent} (gzip)'.strip()
+
+        if not connection_type:
+            connection_type = self._connection_types.get(parse.urlsplit(uri).scheme.lower())
+
+        response, content = super().request(
+            uri, method, body, headers, redirections, connection_type, **kwargs)
+        metrics.add(f'{self._name}.decoded_bytes', len(content))
+        return response, content
+
+
 class GmailService():
     """Fetches the resource object after authenticating with
     the Gmail service. Also provides member functions to 
@@ -43,11 +162,85 @@ class GmailService():
     Attributes:
         _token: The authentication token
         _gmail_service: The authenticated gmail resource 
+        _http: The http client to use instead of one authorized by the token
+        _hedger: Hedges slow message fetches if set
+        _retrier: Retries the calls that failed with a transient error if set
+        _limiter: The rate limiter enforcing the quota of this account
+        _flights: Coalesces the concurrent fetches of the same message
+        _spare_https: The pool of authorized http clients not used by any request,
+            they all share the token so that it is refreshed only once
     """
+
+    _MAX_CALLS = 1
+    _PERIOD = 1
+    _TIMEOUT = 60
+    # the number of recent fetches whose latency projects the next one
+    _LATENCY_WINDOW = 20
+
+    # partial response of only the fields DCP_Service reads from a message
+    _MESSAGE_FIELDS = (
+        'payload(mimeType,headers(name,value),body/data,'
+        'parts(mimeType,body/data,parts(mimeType,body/data,parts(mimeType,body/data))))')
     
-    def __init__(self, token) -> None:
+    def __init__(
+        self,
+        token,
+        http: object = None,
+        hedger: hedging.Hedger = None,
+        retrier: retrying.Retrier = None,
+        limiter: ratelimiter.RateLimiter = None) -> None:
+
         self._token = token
+        self._http = http
+        self._hedger = hedger
+        self._retrier = retrier
+        self._limiter = limiter if limiter else ratelimiter.RateLimiter(
+            max_calls=GmailService._MAX_CALLS,
+            period=GmailService._PERIOD)
+        self._flights = single_flight.SingleFlight('gmail.messages')
         self._gmail_service = None
+        self._spare_https = queue.LifoQueue()
+
+
+    @contextlib.contextmanager
+    def _checkout_http(self) -> Iterator[object]:
+        """Lends an http client that no other request is using.
+
+        An httplib2 client is not thread safe, hence concurrent requests
+        each need their own client. A new client is created when all the
+        existing ones are busy. The clients count the bytes they receive
+        as the gmail.messages counters.
+        """
+
+        # an injected client, e.g. to replay fixtures, is used as is
+        if self._http:
+            yield self._http
+            return
+
+        try:
+            http = self._spare_https.get_nowait()
+        except queue.Empty:
+            logging.debug('Creating a new http client')
+            http = AuthorizedHttp(
+                self._token,
+                http=_MeteredHttp('gmail.messages', timeout=GmailService._TIMEOUT))
+
+        try:
+            yield http
+        finally:
+            self._spare_https.put(http)
+
+
+    def _wait_for_quota(self) -> None:
+        """Blocks until the account has quota left for another call.
+
+        The call is recorded as soon as the quota is granted so that
+        concurrent callers cannot slip in before the call is made.
+        """
+
+        with tracing.span('gmail.rate_limit_wait'):
+            with self._limiter:
+                pass
 
 
     def load_gmail_resource(self) -> None:
@@ -55,16 +248,25 @@ class GmailService():
         """
         
         logging.info('Getting an authenticated gmail resource')
+        # imported here since it is the slowest import of the program,
+        # and the rest backend doesn't need it
+        from googleapiclient import discovery
         res = None
 
         if self._gmail_service:
             res = self._gmail_service
         else:            
             try:
-                res = discovery.build(
-                    'gmail', 'v1',
-                    credentials=self._token,
-                    cache_discovery=False)
+                if self._http:
+                    res = discovery.build(
+                        'gmail', 'v1',
+                        http=self._http,
+                        cache_discovery=False)
+                else:
+                    res = discovery.build(
+                        'gmail', 'v1',
+                        credentials=self._token,
+                        cache_discovery=False)
 
                 self._gmail_service = res
             except:
@@ -96,19 +298,22 @@ class GmailService():
 
         Raises:
             ReadTimeoutError: Error when there is a API timeout
+            TransientError: The search failed, e.g. the connection dropped
         """
 
         logging.info('Searching emails for query: "%s"', query)
         logging.info('Using pagination: %s', next_page_token != None)
 
         try:
-            results = self._gmail_service.users().messages().list( # pylint: disable=no-member
-                userId='me', 
-                q=query, 
-                pageToken = next_page_token, 
-                maxResults = max_results).execute()
+            with tracing.span('gmail.search_messages', query=query, paginated=bool(next_page_token)):
+                results = self._call(
+                    lambda: self._list_messages(query, next_page_token, max_results))
         except socket.timeout:
             raise ReadTimeoutError('Socket timeout while searching emails')
+        except (errors.HttpError, client.HTTPException, OSError, ValueError) as e:
+            if not is_transient_error(e):
+                raise
+            raise TransientError(f'{type(e).__name__} while searching emails') from e
 
         messages = results.get('messages', [])
         next_page_token = results.get('nextPageToken', None)
@@ -139,14 +344,121 @@ class GmailService():
         Raises:
             BadMessageIdError: If a message cannot be retrieved using the provided id
             ReadTimeoutError: Error when there is a API timeout
+            TransientError: The fetch failed, e.g. the connection dropped
+        """
+
+        return self._get_payload(message_id)
+
+
+    def get_messages(
+        self,
+        message_ids: Sequence[str],
+        workers: int = 4,
+        tracker: progress.ProgressTracker = None) -> Iterator[Tuple[str, object]]:
+        """Fetches the content of the messages concurrently.
+
+        Each worker fetches with its own http client from the pool, within
+        the quota of the account. This is meant for when batch requests
+        are rejected or throttled. A message that cannot be fetched is
+        logged and skipped, so that it can be fetched again later.
+
+        With a tracker, a fetch is only started if it is projected to
+        complete within the time budget, from the recent fetches of this
+        account, so that no message is fetched to be thrown away.
+
+        Args:
+            message_ids: The unique ids of the messages
+            workers: The number of messages fetched at the same time
+            tracker: Stops the fetches once the time budget is used up
+
+        Yields:
+            A tuple of the message id and the payload of the message,
+            in the order the fetches complete
+        """
+
+        logging.info('Fetching %d emails with %d workers', len(message_ids), workers)
+
+        pending_ids = iter(message_ids)
+        latencies = collections.deque(maxlen=GmailService._LATENCY_WINDOW)
+        in_flight = {}
+
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+
+            def submit_next() -> bool:
+                item_seconds = sum(latencies) / len(latencies) if latencies else None
+                if tracker and not tracker.should_continue(item_seconds):
+                    return False
+
+                message_id = next(pending_ids, None)
+                if message_id is None:
+                    return False
+
+                future = executor.submit(self._get_payload, message_id)
+                in_flight[future] = (message_id, time.monotonic())
+                return True
+
+            # a fetch is started whenever one completes, until none is left
+            can_submit = True
+            for _ in range(workers):
+                can_submit = submit_next()
+                if not can_submit:
+                    break
+
+            try:
+                while in_flight:
+                    done, _ = futures.wait(in_flight, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        message_id, start = in_flight.pop(future)
+                        latencies.append(time.monotonic() - start)
+                        if can_submit:
+                            can_submit = submit_next()
+
+                        try:
+                            payload = future.result()
+                        except (Error, errors.HttpError) as e:
+                            # e.g. a message that was deleted or that the account may not read
+                            logging.warning('Skipping email %s after %s, will fetch it again later',
+                                message_id, type(e).__name__)
+                            continue
+
+                        yield message_id, payload
+            finally:
+                # the caller stopped early, the pending fetches are dropped
+                for future in in_flight:
+                    future.cancel()
+
+
+    def _get_payload(self, message_id: str) -> object:
+        """Returns the payload of a message.
+
+        A fetch made while the same message is being fetched waits for
+        that fetch and shares its payload.
+
+        Args:
+            message_id: The unique id of a given message
         """
 
         logging.info('Fetching content of email: %s', message_id)
 
+        def fetch() -> object:
+            if self._hedger:
+                return self._hedger.call(
+                    lambda: self._fetch_message(message_id), wait=self._wait_for_quota)
+            self._wait_for_quota()
+            return self._fetch_message(message_id)
+
         try:
-            message = self._gmail_service.users().messages().get(userId='me', id=message_id).execute() #pylint: disable=no-member
+            with tracing.span('gmail.get_message_content', message_id=message_id):
+                message = self._flights.call(message_id, lambda: self._call(fetch))
         except socket.timeout:
             raise ReadTimeoutError('Socket timeout while fetching message')
+        except (errors.HttpError, client.HTTPException, OSError, ValueError) as e:
+            if isinstance(e, errors.HttpError) and e.resp.status == 404:
+                raise BadMessageIdError(f'Cannot find the email {message_id}') from e
+            if not is_transient_error(e):
+                logging.error('Uncaught exception while fetching email')
+                raise
+            raise TransientError(f'{type(e).__name__} while fetching message {message_id}') from e
         except:
             logging.error('Uncaught exception while fetching email')
             raise
@@ -158,6 +470,59 @@ class GmailService():
         return payload
 
 
+    def _call(self, func: Callable[[], T]) -> T:
+        """Calls the gmail API, again if the call failed with a transient error.
+
+        Args:
+            func: The call to the API
+        """
+
+        if self._retrier:
+            return self._retrier.call(func, is_transient_error)
+
+        return func()
+
+
+    def _list_messages(
+        self,
+        query: str,
+        next_page_token: str,
+        max_results: int) -> Dict[str, object]:
+        """Returns a page of the messages matching the query.
+
+        Args:
+            query: A search term string
+            next_page_token: The pagination token of the page
+            max_results: The number of messages in the page
+        """
+
+        return self._gmail_service.users().messages().list( # pylint: disable=no-member
+            userId='me', 
+            q=query, 
+            pageToken = next_page_token, 
+            maxResults = max_results).execute()
+
+
+    def _fetch_message(self, message_id: str) -> object:
+        """Fetches a message, once the quota of the account allows it.
+
+        Only the fields that are parsed are requested, and the message
+        is fetched with a client of the pool, so that concurrent fetches
+        never share a client.
+
+        Args:
+            message_id: The unique id of a given message
+        """
+
+        request = self._gmail_service.users().messages().get( #pylint: disable=no-member
+            userId='me',
+            id=message_id,
+            fields=GmailService._MESSAGE_FIELDS)
+
+        with self._checkout_http() as http:
+            return request.execute(http=http)
+
+
     def get_message_subject(self, message: object) -> str:
         """Returns the Subject Header from the message.
 
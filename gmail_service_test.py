@@ -0,0 +1,152 @@
+"""Tests the gmail clients and the concurrent fetches of messages.
+"""
+
+from unittest import mock
+
+from absl.testing import absltest
+
+from googleapiclient import errors
+
+from http import server
+import gzip
+import httplib2
+import ratelimiter
+import threading
+import time
+
+import gmail_service
+import metrics
+import progress
+
+
+_BODY = b'{"payload": "' + b'a' * 10000 + b'"}'
+
+
+class _Handler(server.BaseHTTPRequestHandler):
+    """Serves the body, compressed if the path asks for it.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        body = _BODY
+        self.send_response(200)
+        if self.path == '/gzip':
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class MeteredHttpTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._server = server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._root = f'http://127.0.0.1:{self._server.server_address[1]}/'
+
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        super().tearDown()
+
+
+    def test_counts_compressed_bytes(self):
+        http = gmail_service._MeteredHttp('test_gzip')
+        response, content = http.request(self._root + 'gzip')
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(content, _BODY)
+        self.assertEqual(metrics.get('test_gzip.responses'), 1)
+        self.assertEqual(metrics.get('test_gzip.uncompressed_responses'), 0)
+        self.assertEqual(metrics.get('test_gzip.decoded_bytes'), len(_BODY))
+        wire_bytes = metrics.get('test_gzip.wire_bytes')
+        self.assertGreater(wire_bytes, len(gzip.compress(_BODY)))
+        self.assertLess(wire_bytes, len(_BODY) / 10)
+
+
+    def test_counts_uncompressed_responses(self):
+        http = gmail_service._MeteredHttp('test_plain')
+        for _ in range(2):
+            _, content = http.request(self._root + 'plain')
+            self.assertEqual(content, _BODY)
+
+        self.assertEqual(metrics.get('test_plain.responses'), 2)
+        self.assertEqual(metrics.get('test_plain.uncompressed_responses'), 2)
+        self.assertGreater(metrics.get('test_plain.wire_bytes'), 2 * len(_BODY))
+
+
+    def test_requests_without_connections_to_meter(self):
+        with mock.patch.object(httplib2, 'SCHEME_TO_CONNECTION', {}):
+            http = gmail_service._MeteredHttp('test_unmetered')
+        _, content = http.request(self._root + 'gzip')
+
+        self.assertEqual(content, _BODY)
+        self.assertEqual(metrics.get('test_unmetered.decoded_bytes'), len(_BODY))
+        self.assertEqual(metrics.get('test_unmetered.wire_bytes'), 0)
+
+
+class GetMessagesTest(absltest.TestCase):
+
+    def _create_service(self, missing_id: str) -> gmail_service.GmailService:
+        gmail_svc = gmail_service.GmailService(
+            None, limiter=ratelimiter.RateLimiter(max_calls=10 ** 9, period=1))
+
+        def fetch_message(message_id):
+            if message_id == missing_id:
+                resp = httplib2.Response({'status': 404})
+                raise errors.HttpError(resp, b'{"error": "not found"}')
+            return {'payload': {'id': message_id}}
+
+        gmail_svc._fetch_message = fetch_message
+        return gmail_svc
+
+
+    def test_skips_missing_message(self):
+        message_ids = [f'{ix:x}' for ix in range(1, 9)]
+        gmail_svc = self._create_service(message_ids[3])
+
+        payloads = dict(gmail_svc.get_messages(message_ids, 4))
+
+        self.assertCountEqual(payloads, message_ids[:3] + message_ids[4:])
+        self.assertEqual(payloads['1'], {'id': '1'})
+
+
+    def test_no_fetch_started_past_the_budget(self):
+        gmail_svc = gmail_service.GmailService(
+            None, limiter=ratelimiter.RateLimiter(max_calls=10 ** 9, period=1))
+        fetched = []
+
+        def fetch_message(message_id):
+            time.sleep(0.2)
+            fetched.append(message_id)
+            return {'payload': {'id': message_id}}
+
+        gmail_svc._fetch_message = fetch_message
+        message_ids = [f'{ix:x}' for ix in range(1, 21)]
+        tracker = progress.ProgressTracker('emails', len(message_ids), time_budget=0.5)
+
+        start = time.perf_counter()
+        payloads = dict(gmail_svc.get_messages(message_ids, 2, tracker))
+
+        # two rounds of two fetches fit, a third round would end after the budget
+        self.assertLen(payloads, 4)
+        self.assertCountEqual(payloads, fetched)
+        self.assertLess(time.perf_counter() - start, 0.6)
+
+
+    def test_missing_message_is_bad_id(self):
+        gmail_svc = self._create_service('a')
+
+        with self.assertRaises(gmail_service.BadMessageIdError):
+            gmail_svc.get_message_content('a')
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,157 @@
+"""This module sends hedged requests to cut the tail latency of API calls.
+
+A hedged call first sends the request as usual. If it has not completed
+once the observed latency percentile has elapsed, a duplicate request is
+sent and the first response to arrive is used. The slower request keeps
+running in the background and its result is discarded.
+
+The duplicate request goes through the same callable, and waits on the
+same rate limiter, as the original request. Only the time after the wait
+on the rate limiter is measured, so that a request queued on the limiter
+is neither hedged nor counted as a slow one. The share of calls that may
+be hedged is capped as well, so that a slow API is not flooded with
+duplicates.
+"""
+
+from typing import Callable
+from typing import Optional
+from typing import TypeVar
+
+from absl import logging
+
+from concurrent import futures
+import collections
+import threading
+import time
+
+import tracing
+
+
+T = TypeVar('T')
+
+
+class Hedger():
+    """Sends a duplicate request when a request is slower than usual.
+
+    Attributes:
+        _name: The name of the hedged operation used in logs and spans
+        _percentile: The latency percentile after which a request is hedged
+        _min_samples: The number of latencies observed before hedging starts
+        _max_hedge_ratio: The maximum share of calls that may be hedged
+        _latencies: The latencies of the most recent requests
+        _calls: The number of hedged calls made
+        _hedges: The number of duplicate requests sent
+        _lock: Guards the latencies and the counters
+        _executor: The threads on which the requests are sent
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = 95,
+        min_samples: int = 20,
+        max_samples: int = 500,
+        max_hedge_ratio: float = 0.1,
+        max_workers: int = 8) -> None:
+
+        self._name = name
+        self._percentile = percentile
+        self._min_samples = min_samples
+        self._max_hedge_ratio = max_hedge_ratio
+        self._latencies = collections.deque(maxlen=max_samples)
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f'hedge-{name}')
+
+
+    def get_delay(self) -> Optional[float]:
+        """Returns the seconds after which a request is hedged.
+
+        Returns None until enough latencies have been observed.
+        """
+
+        with self._lock:
+            if len(self._latencies) < self._min_samples:
+                return None
+            latencies = sorted(self._latencies)
+
+        ix = min(len(latencies) - 1, int(len(latencies) * self._percentile / 100))
+        return latencies[ix]
+
+
+    def _timed(self, func: Callable[[], T], wait: Callable[[], None] = None) -> T:
+        """Calls the function and records its latency if it succeeds.
+
+        The wait is made before the latency is measured.
+        """
+
+        if wait:
+            wait()
+
+        start = time.perf_counter()
+        result = func()
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            self._latencies.append(latency)
+
+        return result
+
+
+    def _can_hedge(self) -> bool:
+        """Returns whether another duplicate request is within the budget.
+        """
+
+        with self._lock:
+            if self._hedges + 1 > self._calls * self._max_hedge_ratio:
+                return False
+            self._hedges += 1
+            return True
+
+
+    def call(self, func: Callable[[], T], wait: Callable[[], None] = None) -> T:
+        """Calls the function and hedges it if it is slower than usual.
+
+        Args:
+            func: The request, which must be safe to call concurrently
+            wait: Blocks until the request may be sent, e.g. on a rate limiter
+
+        Returns:
+            The result of the first request to succeed
+
+        Raises:
+            The error of the last request if all the requests failed
+        """
+
+        with self._lock:
+            self._calls += 1
+
+        delay = self.get_delay()
+        # the hedging delay starts once the first request may be sent
+        if wait:
+            wait()
+        first = self._executor.submit(self._timed, func)
+        if delay is None:
+            return first.result()
+
+        done, _ = futures.wait([first], timeout=delay)
+        if done or not self._can_hedge():
+            return first.result()
+
+        logging.info('Hedging %s after %.2f seconds', self._name, delay)
+        with tracing.span('hedge.duplicate', operation=self._name, delay=delay):
+            second = self._executor.submit(self._timed, func, wait)
+
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+
+        raise error
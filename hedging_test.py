@@ -0,0 +1,88 @@
+"""Tests the hedged requests.
+"""
+
+from absl.testing import absltest
+
+import threading
+import time
+
+import hedging
+
+
+class HedgerTest(absltest.TestCase):
+
+    def _warm_up(self, hedger: hedging.Hedger, count: int) -> None:
+        for _ in range(count):
+            hedger.call(lambda: time.sleep(0.01))
+
+
+    def test_no_delay_until_enough_samples(self):
+        hedger = hedging.Hedger('test', min_samples=3)
+        self._warm_up(hedger, 2)
+        self.assertIsNone(hedger.get_delay())
+
+        self._warm_up(hedger, 1)
+        self.assertBetween(hedger.get_delay(), 0.01, 0.5)
+
+
+    def test_first_response_wins(self):
+        hedger = hedging.Hedger('test', min_samples=3, max_hedge_ratio=1)
+        self._warm_up(hedger, 3)
+
+        calls = []
+        released = threading.Event()
+
+        def request():
+            calls.append(None)
+            if len(calls) == 1:
+                # the first request is stuck until the test ends
+                released.wait(5)
+                return 'slow'
+            return 'fast'
+
+        start = time.perf_counter()
+        try:
+            self.assertEqual(hedger.call(request), 'fast')
+            self.assertLess(time.perf_counter() - start, 1)
+            self.assertLen(calls, 2)
+        finally:
+            released.set()
+
+
+    def test_hedges_are_capped(self):
+        hedger = hedging.Hedger('test', min_samples=3, max_hedge_ratio=0)
+        self._warm_up(hedger, 3)
+
+        calls = []
+
+        def request():
+            calls.append(None)
+            time.sleep(0.2)
+            return len(calls)
+
+        self.assertEqual(hedger.call(request), 1)
+        self.assertLen(calls, 1)
+
+
+    def test_wait_is_not_timed(self):
+        hedger = hedging.Hedger('test', min_samples=3)
+        for _ in range(3):
+            hedger.call(lambda: time.sleep(0.01), wait=lambda: time.sleep(0.2))
+
+        self.assertLess(hedger.get_delay(), 0.1)
+
+
+    def test_error_of_all_requests_is_raised(self):
+        hedger = hedging.Hedger('test', min_samples=3, max_hedge_ratio=1)
+        self._warm_up(hedger, 3)
+
+        def request():
+            time.sleep(0.1)
+            raise ValueError('bad response')
+
+        with self.assertRaises(ValueError):
+            hedger.call(request)
+
+
+if __name__ == '__main__':
+    absltest.main()
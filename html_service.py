@@ -5,15 +5,27 @@ we will have to use a headless browser to render the page
 and then parse it.
 """
 
+from typing import Dict
+
 from absl import logging
 
 import ratelimiter
 import re
 import requests
 
+import circuit_breaker
+import hedging
+import retrying
+import single_flight
+import tracing
+
 
 from urllib import parse
 
+# the solution API is shared by all the accounts, hence a single limiter
+_API_LIMITER = ratelimiter.RateLimiter(max_calls=1, period=1)
+
+
 class LinkWithoutTokenError(Exception):
     """Provided solution link doesn't contain a token.
     """
@@ -24,12 +36,63 @@ class InvalidJsonApiError(Exception):
     """
 
 
+def redact_link(href: str) -> str:
+    """Returns the link without its query, and hence without its token.
+
+    The tokens of the solution links give access to the solutions, so
+    they are kept out of the logs and traces.
+
+    Args:
+        href: A solution or API link
+    """
+
+    return parse.urlparse(href)._replace(query='', fragment='').geturl()
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Returns whether a failed API call may succeed when sent again.
+
+    Dropped connections, timeouts, truncated or malformed bodies, 429s
+    and server errors are transient, any other HTTP status is not.
+
+    Args:
+        error: The error raised by the call
+    """
+
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+
+    return isinstance(error, (InvalidJsonApiError, requests.RequestException))
+
+
 class Html_Service():
     """Helps fetch and parse dynamic HTML data
+
+    Attributes:
+        _session: The HTTP session whose connection pool is used for all calls
+        _hedger: Hedges slow API calls if set
+        _breaker: Short circuits the API calls while the API is unhealthy if set
+        _retrier: Retries the API calls that failed with a transient error if set
+        _flights: Coalesces the concurrent calls of the same problem
     """
 
     API_PATH = 'api/solution'
     API_HOST = 'www.dailycodingproblem.com'
+    TIMEOUT = 30
+
+    def __init__(
+        self,
+        session: requests.Session = None,
+        hedger: hedging.Hedger = None,
+        breaker: circuit_breaker.CircuitBreaker = None,
+        retrier: retrying.Retrier = None) -> None:
+
+        self._session = session if session else requests.Session()
+        self._hedger = hedger
+        self._breaker = breaker
+        self._retrier = retrier
+        self._flights = single_flight.SingleFlight('solution_api')
+
 
     def get_api_link_from_href(self, href: str) -> str:
         """Parses the link to the solution HTML page and return the API link.
@@ -41,7 +104,7 @@ class Html_Service():
             A link to the API that contains the solution markdown
         """
 
-        logging.info('Getting API link for %s', href)
+        logging.info('Getting API link for %s', redact_link(href))
 
         result = parse.urlparse(href)
         query = result.query
@@ -60,12 +123,12 @@ class Html_Service():
         return api_url.geturl()
         
 
-    @ratelimiter.RateLimiter(max_calls=1, period=1)
-    def get_api_content_as_md(self, href: str) -> str:
+    def get_api_content_as_md(self, href: str, problem_id: int = None) -> str:
         """Calls the API link and returns the response as Markdown.
 
         Args:
             href: The link to the API
+            problem_id: The problem number of the link if known, used in logs and traces
         
         Returns:
             The response as a markdown document
@@ -74,29 +137,146 @@ class Html_Service():
             InvalidJsonApiError: The API didn't return a valid JSON
         """
 
-        logging.info('Getting content from url %s', href)
-        r = requests.get(href)
+        return self.format_solution_as_md(self.get_api_solution(href, problem_id))
+
+
+    def get_api_solution(self, href: str, problem_id: int = None) -> Dict[str, object]:
+        """Calls the API link and returns the solution.
+
+        A call made while a call of the same problem is in flight waits for
+        it and shares its solution instead of calling the API again. The
+        calls are matched by link when the problem number isn't known, as
+        two links of the same problem carry different tokens.
+
+        Args:
+            href: The link to the API
+            problem_id: The problem number of the link if known, used in logs and traces
+
+        Returns:
+            The solution with the problemId, problem and solution fields
+
+        Raises:
+            InvalidJsonApiError: The API didn't return a valid JSON
+            CircuitOpenError: The API is unhealthy and wasn't called
+        """
+
+        logging.info('Getting content of problem %s from %s', problem_id, redact_link(href))
+
+        key = problem_id if problem_id is not None else href
+        return self._flights.call(key, lambda: self._call_api(href, problem_id))
+
+
+    def _call_api(self, href: str, problem_id: int = None) -> Dict[str, object]:
+        """Calls the API link through the breaker and the retrier.
+
+        Args:
+            href: The link to the API
+            problem_id: The problem number of the link if known
+        """
+
+        # checked before waiting on the limiter so that no slot is used up
+        if self._breaker:
+            self._breaker.before_call()
+
+        # the breaker counts a call once, however many times it was retried,
+        # and any error counts so that a half open probe is always released
+        try:
+            if self._retrier:
+                res = self._retrier.call(lambda: self._get_json(href, problem_id), is_transient_error)
+            else:
+                res = self._get_json(href, problem_id)
+        except BaseException:
+            if self._breaker:
+                self._breaker.record_failure()
+            raise
+
+        if self._breaker:
+            self._breaker.record_success()
+
+        return res
+
+
+    def _get_json(self, href: str, problem_id: int = None) -> Dict[str, object]:
+        """Calls the API link and returns the decoded JSON.
+
+        Args:
+            href: The link to the API
+            problem_id: The problem number of the link if known
+
+        Raises:
+            InvalidJsonApiError: The API didn't return a valid JSON
+            HTTPError: The API returned an error status, e.g. 429
+            RequestException: The call failed, its message without the link
+        """
+
+        # the messages of requests errors contain the link and hence its token
+        try:
+            with tracing.span('html.get_api_content', problem_id=problem_id):
+                if self._hedger:
+                    r = self._hedger.call(lambda: self._fetch(href), wait=self._wait_for_limit)
+                else:
+                    self._wait_for_limit()
+                    r = self._fetch(href)
+        except requests.RequestException as e:
+            raise type(e)(f'{type(e).__name__} calling the API for problem {problem_id}',
+                response=e.response) from None
+
+        if not r.ok:
+            logging.error('API returned status %d for problem %s', r.status_code, problem_id)
+            raise requests.HTTPError(
+                f'{r.status_code} {r.reason} from the API for problem {problem_id}', response=r)
 
         try:
             res = r.json()
         except ValueError:
-            logging.error('Unable to get solution json from link %s', href)
+            logging.error('Unable to get solution json of problem %s', problem_id)
             raise InvalidJsonApiError('API didn\'t return a JSON')
 
-        if res:
-            doc = f"## Problem #{res['problemId']}\n{res['problem']}\n## Solution\n{res['solution']}"
+        if not res:
+            logging.error('Empty solution json of problem %s', problem_id)
+            raise InvalidJsonApiError('API returned an empty JSON')
+
+        return res
+
+
+    def _wait_for_limit(self) -> None:
+        """Blocks until the rate limit of the API allows another call.
+        """
+
+        with tracing.span('html.rate_limit_wait'):
+            with _API_LIMITER:
+                pass
+
+
+    def _fetch(self, href: str) -> requests.Response:
+        """Calls the API link, once the rate limit of the API allows it.
+
+        Args:
+            href: The link to the API
+        """
+
+        return self._session.get(href, timeout=Html_Service.TIMEOUT)
+
+
+    def format_solution_as_md(self, solution: Dict[str, object]) -> str:
+        """Returns the solution as a markdown document.
+
+        Args:
+            solution: The solution as returned by the API
+        """
 
-        return doc
+        return f"## Problem #{solution['problemId']}\n{solution['problem']}\n## Solution\n{solution['solution']}"
 
 
-    def get_problem_number(self, href: str) -> int:
+    @staticmethod
+    def get_problem_number(href: str) -> int:
         """Returns the problem number provided in the contained link.
 
         Args:
             href: Link to the problem solution
         """
 
-        logging.info('Getting problem number from link %s', href)
+        logging.info('Getting problem number from link %s', redact_link(href))
         result = parse.urlparse(href)
         path = result.path
         problem_id = path.split('/')[-1]
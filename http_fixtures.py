@@ -0,0 +1,312 @@
+"""This module records and replays HTTP traffic as fixtures.
+
+In record mode every request that goes through the wrapped clients is
+forwarded to the network and the response is appended, along with the
+time it took, to a fixture file.
+
+In replay mode no request reaches the network. The recorded responses
+are served back from the fixture file after sleeping for the recorded
+time, optionally scaled, so that the fetch and parse stages can be
+profiled without access to gmail or the solution API.
+
+The gmail service uses httplib2 while the html service uses requests,
+hence both clients have a recording and a replaying wrapper.
+
+Note that fixture files contain the email contents and solution tokens
+and must be kept as private as the token files.
+"""
+
+from typing import Dict
+from typing import Tuple
+
+from absl import logging
+
+import base64
+import collections
+import hashlib
+import httplib2
+import json
+import os
+import requests
+import threading
+import time
+
+from requests import adapters
+from requests import structures
+from requests import utils
+
+
+class Error(Exception):
+    """The base exception class for this module.
+    """
+
+
+class FixtureNotFoundError(Error):
+    """No response was recorded for the request.
+    """
+
+
+# headers that describe the encoding on the wire and no longer
+# apply to the decoded body that is recorded
+_WIRE_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length'}
+
+
+def get_request_key(method: str, uri: str, body: object) -> str:
+    """Returns the key identifying a request in the fixture file.
+
+    Args:
+        method: The HTTP method
+        uri: The full request uri
+        body: The request body if any
+    """
+
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    body_hash = hashlib.sha1(body).hexdigest() if body else ''
+
+    return f'{method} {uri} {body_hash}'
+
+
+class FixtureStore():
+    """Reads and appends the recorded responses of a fixture file.
+
+    Every line of the file is a JSON object of one recorded exchange.
+    When the same request was recorded more than once, the responses
+    are replayed in the recorded order and the last one is repeated.
+
+    Attributes:
+        _file_path: The path of the fixture file
+        _responses: The recorded responses for each request key
+        _replayed: The number of times each request key was replayed
+        _lock: Serializes reads and writes from concurrent clients
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self._file_path = file_path
+        self._responses = collections.defaultdict(list)
+        self._replayed = collections.Counter()
+        self._lock = threading.Lock()
+
+
+    def load(self) -> None:
+        """Loads all the recorded responses from the fixture file.
+        """
+
+        logging.info('Loading fixtures from %s', self._file_path)
+
+        if not os.path.exists(self._file_path):
+            logging.warning('Fixture file %s does not exist', self._file_path)
+            return
+
+        with open(self._file_path, 'r') as file:
+            for line in file:
+                exchange = json.loads(line)
+                self._responses[exchange['key']].append(exchange)
+
+        logging.info('Loaded fixtures for %d requests', len(self._responses))
+
+
+    def record(
+        self,
+        key: str,
+        status: int,
+        headers: Dict[str, str],
+        content: bytes,
+        elapsed: float) -> None:
+        """Appends a response to the fixture file.
+
+        Args:
+            key: The key identifying the request
+            status: The HTTP status of the response
+            headers: The response headers
+            content: The decoded response body
+            elapsed: The seconds it took to get the response
+        """
+
+        try:
+            body, encoding = content.decode('utf-8'), 'utf-8'
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(content).decode('ascii'), 'base64'
+
+        exchange = {
+            'key': key,
+            'status': status,
+            'headers': {name.lower(): value for name, value in headers.items()
+                if name.lower() not in _WIRE_HEADERS},
+            'body': body,
+            'encoding': encoding,
+            'elapsed': elapsed,
+        }
+
+        with self._lock:
+            self._responses[key].append(exchange)
+            with open(self._file_path, 'a') as file:
+                file.write(json.dumps(exchange) + '\n')
+
+
+    def replay(self, key: str) -> Tuple[int, Dict[str, str], bytes, float]:
+        """Returns the next recorded response for a request.
+
+        Args:
+            key: The key identifying the request
+
+        Returns:
+            A tuple of status, headers, body and elapsed seconds
+
+        Raises:
+            FixtureNotFoundError: No response was recorded for the request
+        """
+
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                raise FixtureNotFoundError(f'No fixture recorded for {key}')
+
+            ix = min(self._replayed[key], len(responses) - 1)
+            self._replayed[key] += 1
+
+        exchange = responses[ix]
+        if exchange['encoding'] == 'base64':
+            content = base64.b64decode(exchange['body'])
+        else:
+            content = exchange['body'].encode('utf-8')
+
+        return exchange['status'], exchange['headers'], content, exchange['elapsed']
+
+
+class RecordingHttp():
+    """Wraps an httplib2 client and records every response.
+
+    Attributes:
+        _http: The wrapped client, usually an authorized http
+        _store: The fixture store the responses are recorded into
+    """
+
+    def __init__(self, http: object, store: FixtureStore) -> None:
+        self._http = http
+        self._store = store
+
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self._http, name)
+
+
+    def request(self, uri: str, method: str = 'GET', body: object = None,
+        headers: Dict[str, str] = None, **kwargs) -> Tuple[httplib2.Response, bytes]:
+        """Forwards the request to the wrapped client and records the response.
+        """
+
+        start = time.perf_counter()
+        response, content = self._http.request(
+            uri, method=method, body=body, headers=headers, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        self._store.record(
+            get_request_key(method, uri, body),
+            response.status,
+            dict(response),
+            content,
+            elapsed)
+
+        return response, content
+
+
+class ReplayHttp():
+    """Serves recorded responses in place of an httplib2 client.
+
+    Attributes:
+        _store: The fixture store the responses are replayed from
+        _latency_scale: The factor applied to the recorded latency
+    """
+
+    def __init__(self, store: FixtureStore, latency_scale: float = 1.0) -> None:
+        self._store = store
+        self._latency_scale = latency_scale
+
+
+    def request(self, uri: str, method: str = 'GET', body: object = None,
+        headers: Dict[str, str] = None, **kwargs) -> Tuple[httplib2.Response, bytes]:
+        """Returns the recorded response after the recorded latency.
+
+        Raises:
+            FixtureNotFoundError: No response was recorded for the request
+        """
+
+        status, recorded_headers, content, elapsed = self._store.replay(
+            get_request_key(method, uri, body))
+        time.sleep(elapsed * self._latency_scale)
+
+        info = dict(recorded_headers)
+        info['status'] = status
+        return httplib2.Response(info), content
+
+
+class RecordingAdapter(adapters.HTTPAdapter):
+    """Transport adapter for requests that records every response.
+
+    Attributes:
+        _store: The fixture store the responses are recorded into
+    """
+
+    def __init__(self, store: FixtureStore, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._store = store
+
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """Sends the request over the network and records the response.
+        """
+
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        content = response.content
+        elapsed = time.perf_counter() - start
+
+        self._store.record(
+            get_request_key(request.method, request.url, request.body),
+            response.status_code,
+            dict(response.headers),
+            content,
+            elapsed)
+
+        return response
+
+
+class ReplayAdapter(adapters.BaseAdapter):
+    """Transport adapter for requests that serves recorded responses.
+
+    Attributes:
+        _store: The fixture store the responses are replayed from
+        _latency_scale: The factor applied to the recorded latency
+    """
+
+    def __init__(self, store: FixtureStore, latency_scale: float = 1.0) -> None:
+        super().__init__()
+        self._store = store
+        self._latency_scale = latency_scale
+
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """Returns the recorded response after the recorded latency.
+
+        Raises:
+            FixtureNotFoundError: No response was recorded for the request
+        """
+
+        status, headers, content, elapsed = self._store.replay(
+            get_request_key(request.method, request.url, request.body))
+        time.sleep(elapsed * self._latency_scale)
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = structures.CaseInsensitiveDict(headers)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        response.encoding = utils.get_encoding_from_headers(response.headers)
+
+        return response
+
+
+    def close(self) -> None:
+        pass
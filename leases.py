@@ -0,0 +1,193 @@
+"""This module coordinates the workers of a backfill with leases.
+
+The pending items of a stage, e.g. the email ids or the solution links,
+are claimed by a worker for a limited time. Other workers skip the items
+that are leased, so every worker processes a disjoint slice. A worker
+extends its leases while it works, and marks its items as done or
+releases them once it is done with them.
+
+When a worker crashes its leases are not extended anymore, and its items
+are claimed by another worker once the leases expire.
+
+The leases are kept in a SQLite database, which every worker on the
+machine opens, and each operation is a single transaction.
+
+Methods:
+    __init__ : to open the lease database of a worker
+    claim : to lease a slice of the pending items
+    heartbeat : to extend the leases of the worker
+    keep_alive : to extend the leases on a background thread
+    complete : to mark the items as done
+    release : to let other workers claim the items again
+"""
+
+from typing import Iterator
+from typing import Sequence
+
+from absl import logging
+
+import contextlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class LeaseStore():
+    """Leases the pending items of a stage to the workers.
+
+    Attributes:
+        _db_file: The path of the SQLite database
+        _owner: The unique name of this worker
+        _duration: The seconds a lease lasts unless it is extended
+    """
+
+    _TIMEOUT = 30
+
+    def __init__(self, db_file: str, duration: float = 300) -> None:
+        self._db_file = db_file
+        self._owner = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._duration = duration
+
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS leases ('
+                'kind TEXT NOT NULL, '
+                'item TEXT NOT NULL, '
+                'owner TEXT NOT NULL, '
+                'expires_at REAL NOT NULL, '
+                'done INTEGER NOT NULL DEFAULT 0, '
+                'PRIMARY KEY (kind, item))')
+
+
+    def get_owner(self) -> str:
+        """Returns the unique name of this worker.
+        """
+
+        return self._owner
+
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Opens a connection and commits its transaction on success.
+
+        The transaction takes the write lock right away, so that two
+        workers cannot claim the same items.
+        """
+
+        conn = sqlite3.connect(self._db_file, timeout=LeaseStore._TIMEOUT, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+
+    def claim(self, kind: str, items: Sequence[str], count: int) -> Sequence[str]:
+        """Leases a slice of the items that no other worker is working on.
+
+        Items that are done, or leased by another worker whose lease did
+        not expire, are skipped.
+
+        Args:
+            kind: The kind of the items, e.g. emails or links
+            items: The pending items in the order they should be processed
+            count: The maximum number of items to claim
+
+        Returns:
+            The claimed items
+        """
+
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT item FROM leases WHERE kind = ? '
+                'AND (done = 1 OR (owner != ? AND expires_at > ?))',
+                (kind, self._owner, now))
+            unavailable = {item for item, in rows}
+
+            claimed = []
+            for item in items:
+                if len(claimed) >= count:
+                    break
+                if item not in unavailable:
+                    claimed.append(item)
+
+            conn.executemany(
+                'INSERT OR REPLACE INTO leases (kind, item, owner, expires_at, done) '
+                'VALUES (?, ?, ?, ?, 0)',
+                [(kind, item, self._owner, now + self._duration) for item in claimed])
+
+        logging.info('Claimed %d %s', len(claimed), kind)
+        return claimed
+
+
+    def heartbeat(self) -> None:
+        """Extends all the leases of this worker.
+        """
+
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE leases SET expires_at = ? WHERE owner = ? AND done = 0',
+                (time.time() + self._duration, self._owner))
+
+
+    @contextlib.contextmanager
+    def keep_alive(self) -> Iterator[None]:
+        """Extends the leases on a background thread while the block runs.
+
+        The leases are extended three times per lease duration, so that
+        a single missed heartbeat doesn't let them expire.
+        """
+
+        stop_event = threading.Event()
+
+        def beat() -> None:
+            while not stop_event.wait(self._duration / 3):
+                try:
+                    self.heartbeat()
+                except sqlite3.Error:
+                    logging.exception('Unable to extend the leases')
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop_event.set()
+            thread.join()
+
+
+    def complete(self, kind: str, items: Sequence[str]) -> None:
+        """Marks the items as done so that no worker claims them again.
+
+        Args:
+            kind: The kind of the items
+            items: The items that were processed
+        """
+
+        with self._connect() as conn:
+            conn.executemany(
+                'UPDATE leases SET done = 1 WHERE kind = ? AND item = ? AND owner = ?',
+                [(kind, item, self._owner) for item in items])
+
+
+    def release(self, kind: str, items: Sequence[str]) -> None:
+        """Releases the leases so that any worker can claim the items again.
+
+        Args:
+            kind: The kind of the items
+            items: The items that were not processed
+        """
+
+        with self._connect() as conn:
+            conn.executemany(
+                'DELETE FROM leases WHERE kind = ? AND item = ? AND owner = ? AND done = 0',
+                [(kind, item, self._owner) for item in items])
@@ -0,0 +1,78 @@
+"""This module keeps the counters of a run.
+
+A counter is a named total, e.g. the bytes received for the gmail
+messages, that any thread can add to. The counters are reported
+at the end of the run.
+
+Methods:
+    add : adds a value to a counter
+    get : returns the total of a counter
+    report : logs all the counters
+"""
+
+from typing import Dict
+
+from absl import logging
+
+import collections
+import threading
+
+
+_counters = collections.Counter()
+_lock = threading.Lock()
+
+
+def add(name: str, value: float = 1) -> None:
+    """Adds a value to a counter.
+
+    Args:
+        name: The name of the counter, prefixed with the name of its client
+        value: The value to add
+    """
+
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> float:
+    """Returns the total of a counter, 0 if nothing was added to it.
+
+    Args:
+        name: The name of the counter
+    """
+
+    with _lock:
+        return _counters[name]
+
+
+def get_all() -> Dict[str, float]:
+    """Returns a copy of all the counters.
+    """
+
+    with _lock:
+        return dict(_counters)
+
+
+def report() -> None:
+    """Logs all the counters.
+
+    A client with both a `responses` and a `wire_bytes` counter is
+    also reported with the average bytes on the wire per response.
+    """
+
+    counters = get_all()
+    if not counters:
+        return
+
+    logging.info('Counters of the run:')
+    for name in sorted(counters):
+        logging.info('  %s: %d', name, counters[name])
+
+    for name in sorted(counters):
+        if not name.endswith('.responses') or not counters[name]:
+            continue
+
+        client = name[:-len('.responses')]
+        wire_bytes = counters.get(f'{client}.wire_bytes', 0)
+        logging.info('  %s: %.0f bytes on the wire per response',
+            client, wire_bytes / counters[name])
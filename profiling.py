@@ -0,0 +1,190 @@
+"""This module profiles the stages of a run to find the hot spots.
+
+Every stage is profiled with cProfile, and its stats are written as a
+pstats file that can be loaded with `python -m pstats` or snakeviz.
+cProfile only sees the thread that runs the stage, hence the stacks of
+all the threads are also sampled at a fixed interval and written in the
+collapsed format of flamegraph.pl and speedscope, under the name of the
+stage that was running.
+
+Memory can be profiled as well with tracemalloc, in which case the peak
+memory of every stage and the lines that allocated the most are written
+next to its stats.
+
+Profiling is disabled by default, in which case a stage does nothing but
+check a flag.
+
+Methods:
+    enable : starts profiling into an output folder
+    stage : context manager profiling a stage
+    export : writes the collapsed stacks of the run
+"""
+
+from typing import Iterator
+
+from absl import logging
+
+import collections
+import contextlib
+import cProfile
+import os
+import sys
+import threading
+import tracemalloc
+
+
+_SAMPLE_INTERVAL = 0.005
+_MAX_STACK_DEPTH = 64
+_TRACEMALLOC_FRAMES = 16
+_TOP_ALLOCATIONS = 25
+
+_enabled = False
+_output_dir = None
+_profilers = {}
+_stages = []
+_peaks = []
+_stacks = collections.Counter()
+_stop_event = threading.Event()
+_sampler = None
+
+
+def enable(output_dir: str, memory: bool = False) -> None:
+    """Starts profiling and sampling the stacks of all the threads.
+
+    Args:
+        output_dir: The folder where the profiles are written
+        memory: Whether to also trace the memory allocations
+    """
+
+    global _enabled, _output_dir, _sampler
+    logging.info('Profiling into %s', output_dir)
+
+    os.makedirs(output_dir, exist_ok=True)
+    _output_dir = output_dir
+    _enabled = True
+
+    if memory:
+        tracemalloc.start(_TRACEMALLOC_FRAMES)
+
+    _sampler = threading.Thread(target=_sample_stacks, name='profiling-sampler', daemon=True)
+    _sampler.start()
+
+
+def is_enabled() -> bool:
+    """Returns whether the stages are being profiled.
+    """
+
+    return _enabled
+
+
+def _get_frame_name(frame: object) -> str:
+    """Returns the name of a frame in a collapsed stack.
+    """
+
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _sample_stacks() -> None:
+    """Counts the stacks of all the threads until profiling is stopped.
+    """
+
+    sampler_id = threading.get_ident()
+    while not _stop_event.wait(_SAMPLE_INTERVAL):
+        stage = _stages[-1] if _stages else 'idle'
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler_id:
+                continue
+
+            names = []
+            while frame and len(names) < _MAX_STACK_DEPTH:
+                names.append(_get_frame_name(frame))
+                frame = frame.f_back
+
+            names.append(stage)
+            _stacks[';'.join(reversed(names))] += 1
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Profiles the enclosed block as a stage.
+
+    A stage that runs several times, e.g. on every poll of the daemon,
+    is profiled into the same stats. The time of a nested stage is only
+    counted in the stats of the nested stage.
+
+    Args:
+        name: The name of the stage, used in the names of the files
+    """
+
+    if not _enabled:
+        yield
+        return
+
+    outer = _profilers[_stages[-1]] if _stages else None
+    if outer:
+        outer.disable()
+
+    profiler = _profilers.setdefault(name, cProfile.Profile())
+    _stages.append(name)
+    if tracemalloc.is_tracing():
+        # the peak of the outer stage so far is kept since it is reset here
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+        _peaks.append(0)
+        tracemalloc.reset_peak()
+
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _stages.pop()
+
+        profiler.dump_stats(os.path.join(_output_dir, f'{name}.pstats'))
+        if tracemalloc.is_tracing():
+            _write_memory_profile(name, max(_peaks.pop(), tracemalloc.get_traced_memory()[1]))
+
+        if outer:
+            outer.enable()
+
+
+def _write_memory_profile(name: str, peak: int) -> None:
+    """Writes the peak memory of a stage and its largest allocations.
+
+    Args:
+        name: The name of the stage
+        peak: The peak traced memory of the stage, nested stages included
+    """
+
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+    with open(os.path.join(_output_dir, f'{name}.memory.txt'), 'w') as file:
+        file.write(f'Peak traced memory: {peak} bytes\n\n')
+        for stat in snapshot.statistics('traceback')[:_TOP_ALLOCATIONS]:
+            file.write(f'{stat.size} bytes in {stat.count} blocks\n')
+            for line in stat.traceback.format():
+                file.write(f'{line}\n')
+            file.write('\n')
+
+    logging.info('Stage %s peaked at %d bytes of traced memory', name, peak)
+
+
+def export() -> None:
+    """Stops sampling and writes the collapsed stacks of the run.
+    """
+
+    if not _enabled:
+        return
+
+    _stop_event.set()
+    _sampler.join()
+
+    file_path = os.path.join(_output_dir, 'stacks.collapsed')
+    logging.info('Writing %d collapsed stacks to %s', len(_stacks), file_path)
+    with open(file_path, 'w') as file:
+        for stack, count in _stacks.most_common():
+            file.write(f'{stack} {count}\n')
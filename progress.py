@@ -0,0 +1,121 @@
+"""This module tracks the progress of a batch against a time budget.
+
+The throughput is measured over the most recent items, so that the
+projection follows the current throttling of the API rather than the
+average since the start. Work stops as soon as one more item would be
+projected to finish after the deadline.
+
+A progress line with the throughput and the remaining time is written
+while the batch runs. It is redrawn in place on a terminal and logged
+at a fixed interval otherwise.
+"""
+
+from absl import logging
+
+import collections
+import sys
+import threading
+import time
+
+
+class ProgressTracker():
+    """Measures the throughput of a batch and projects its finish.
+
+    The tracker may be shared by the threads processing a batch.
+
+    Attributes:
+        _name: The name of the items shown in the progress line
+        _total: The number of items in the batch
+        _time_budget: The seconds the batch may take, no limit if 0
+        _start: The time the batch started at
+        _done: The number of items processed
+        _finish_times: The times the most recent items finished at
+        _last_report: The time the progress line was last written at
+        _lock: Guards the counters
+    """
+
+    _WINDOW = 20
+    _REPORT_INTERVAL = 10
+
+    def __init__(self, name: str, total: int, time_budget: float = 0) -> None:
+        self._name = name
+        self._total = total
+        self._time_budget = time_budget
+        self._start = time.monotonic()
+        self._done = 0
+        self._finish_times = collections.deque([self._start], maxlen=ProgressTracker._WINDOW + 1)
+        self._last_report = self._start
+        self._lock = threading.Lock()
+
+
+    def get_seconds_per_item(self) -> float:
+        """Returns the recent seconds per item, or 0 before any item finished.
+        """
+
+        with self._lock:
+            if len(self._finish_times) < 2:
+                return 0
+            span = self._finish_times[-1] - self._finish_times[0]
+            return span / (len(self._finish_times) - 1)
+
+
+    def should_continue(self, item_seconds: float = None) -> bool:
+        """Returns whether one more item is projected to fit in the budget.
+
+        Args:
+            item_seconds: The seconds the item is expected to take, e.g.
+                measured by the thread processing it, the recent seconds
+                per item of the whole batch if None
+        """
+
+        with self._lock:
+            if self._done >= self._total:
+                return False
+
+        if not self._time_budget:
+            return True
+
+        if item_seconds is None:
+            item_seconds = self.get_seconds_per_item()
+
+        projected_finish = time.monotonic() + item_seconds
+        if projected_finish - self._start > self._time_budget:
+            if sys.stderr.isatty():
+                sys.stderr.write('\n')
+            logging.info('Stopping %s after %d / %d items, the time budget is used up',
+                self._name, self._done, self._total)
+            return False
+
+        return True
+
+
+    def record(self) -> None:
+        """Records that one more item was processed.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self._done += 1
+            self._finish_times.append(now)
+
+        self._report(now)
+
+
+    def _report(self, now: float) -> None:
+        """Writes the progress line with the throughput and the ETA.
+        """
+
+        seconds_per_item = self.get_seconds_per_item()
+        rate = 1 / seconds_per_item if seconds_per_item else 0
+        remaining = (self._total - self._done) * seconds_per_item
+        line = (f'{self._name}: {self._done} / {self._total} '
+            f'at {rate:.2f} items/sec, ETA {remaining:.0f}s')
+
+        if sys.stderr.isatty():
+            sys.stderr.write(f'\r{line}\033[K')
+            if self._done >= self._total:
+                sys.stderr.write('\n')
+            sys.stderr.flush()
+        elif now - self._last_report >= ProgressTracker._REPORT_INTERVAL or self._done >= self._total:
+            self._last_report = now
+            logging.info(line)
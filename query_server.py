@@ -0,0 +1,224 @@
+"""This module answers lookups of problems by number from the archive.
+
+An index of the solution file and the link of every problem is built
+from the run data once at startup. A lookup is served from an LRU cache
+of the recent solutions, then from the solution file on disk, and when
+the solution was never downloaded it is fetched with the token of its
+link, saved and recorded in the run data.
+
+The lookups are answered on a local HTTP port at `/problem/<id>`,
+or for a single problem on the command line with --problem.
+"""
+
+from typing import Dict
+from typing import Sequence
+
+from absl import flags
+from absl import logging
+
+from http import server
+import cachetools
+import os
+import re
+import requests
+import sys
+import threading
+
+import circuit_breaker
+import download_helper
+import download_solutions
+import html_service
+
+
+_QUERY_PORT = flags.DEFINE_integer(
+    'query_port', 8026,
+    'Local port on which the problems are served')
+_PROBLEM = flags.DEFINE_integer(
+    'problem', None,
+    'Print the solution of this problem instead of serving')
+_CACHE_SIZE = flags.DEFINE_integer(
+    'cache_size', 256,
+    'Number of solutions kept in memory')
+
+_PROBLEM_PATH_PATTERN = re.compile(r'^/problem/(\d+)/?$')
+
+
+class Error(Exception):
+    """The base exception class for this module.
+    """
+
+
+class ProblemNotFoundError(Error):
+    """The problem is neither in the archive nor linked from any email.
+    """
+
+
+class QueryService():
+    """Looks up the solutions of problems by number.
+
+    Attributes:
+        _html_svc: The html service used to fetch the missing solutions
+        _problems: Dictionary of problem id and difficulty
+        _file_paths: Dictionary of problem id and path of the solution file
+        _links: Dictionary of problem id and solution link
+        _cache: The most recently read solutions
+        _lock: Guards the cache and the index
+    """
+
+    def __init__(
+        self,
+        run_data: Dict[str, object],
+        html_svc: html_service.Html_Service,
+        cache_size: int) -> None:
+
+        self._html_svc = html_svc
+        self._problems = dict(run_data.get('problems', {}))
+        self._file_paths = download_solutions.collect_downloaded_problems(
+            run_data.get('links', {}), run_data.get('solution_paths', {}))
+        self._links = {html_svc.get_problem_number(link): link for link in run_data.get('links', {})}
+        self._cache = cachetools.LRUCache(maxsize=cache_size)
+        self._lock = threading.Lock()
+
+        logging.info('Indexed %d solutions and %d links', len(self._file_paths), len(self._links))
+
+
+    def get_solution(self, problem_id: int) -> str:
+        """Returns the solution of a problem as markdown.
+
+        Args:
+            problem_id: The problem number
+
+        Raises:
+            ProblemNotFoundError: The problem has neither a file nor a link
+            InvalidJsonApiError: The API didn't return a valid JSON
+            CircuitOpenError: The API is unhealthy and wasn't called
+        """
+
+        with self._lock:
+            content = self._cache.get(problem_id)
+            file_path = self._file_paths.get(problem_id)
+            link = self._links.get(problem_id)
+
+        if content is not None:
+            logging.info('Serving problem %d from memory', problem_id)
+            return content
+
+        # the file may have moved out of the Unknown folder since the index was built
+        if not file_path or not os.path.exists(file_path):
+            file_path = download_solutions.find_solution_file(problem_id, self._problems.get(problem_id))
+
+        if file_path:
+            logging.info('Serving problem %d from %s', problem_id, file_path)
+            with open(file_path, 'r') as file:
+                content = file.read()
+        elif link:
+            content = self._fetch_solution(problem_id, link)
+        else:
+            raise ProblemNotFoundError(f'Problem {problem_id} is not linked from any email')
+
+        with self._lock:
+            self._cache[problem_id] = content
+
+        return content
+
+
+    def _fetch_solution(self, problem_id: int, link: str) -> str:
+        """Fetches a solution, saves it and records its file in the run data.
+
+        Args:
+            problem_id: The problem number
+            link: The solution link with its token
+        """
+
+        logging.info('Fetching problem %d', problem_id)
+
+        solution = self._html_svc.get_api_solution(
+            self._html_svc.get_api_link_from_href(link), problem_id)
+        content = self._html_svc.format_solution_as_md(solution)
+        difficulty = self._problems.get(problem_id, download_solutions.UNKNOWN_DIFFICULTY)
+        file_path = download_solutions.save_content_to_file(problem_id, difficulty, content)
+
+        def record_file(run_data: Dict[str, object]) -> None:
+            run_data.setdefault('links', {})[link] = file_path
+
+        download_helper.update_run_data(record_file)
+
+        with self._lock:
+            self._file_paths[problem_id] = file_path
+
+        return content
+
+
+class _QueryHandler(server.BaseHTTPRequestHandler):
+    """Answers GET /problem/<id> with the markdown of the solution.
+    """
+
+    query_svc = None
+
+    def do_GET(self) -> None:
+        match = _PROBLEM_PATH_PATTERN.match(self.path)
+        if not match:
+            self._send(404, 'Use /problem/<id>')
+            return
+
+        try:
+            content = self.query_svc.get_solution(int(match.group(1)))
+        except ProblemNotFoundError as e:
+            self._send(404, str(e))
+        except circuit_breaker.CircuitOpenError as e:
+            self._send(503, str(e))
+        except (html_service.InvalidJsonApiError, requests.RequestException) as e:
+            self._send(502, str(e))
+        else:
+            self._send(200, content, 'text/markdown; charset=utf-8')
+
+    def _send(self, status: int, text: str, content_type: str = 'text/plain; charset=utf-8') -> None:
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(format, *args)
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    query_svc = QueryService(
+        download_helper.get_run_data(),
+        download_helper.init_and_get_html_service(),
+        _CACHE_SIZE.value)
+
+    if _PROBLEM.value is not None:
+        try:
+            print(query_svc.get_solution(_PROBLEM.value))
+        except ProblemNotFoundError as e:
+            logging.info(str(e))
+            sys.exit(f'problem {_PROBLEM.value} not found')
+        except (circuit_breaker.CircuitOpenError,
+                html_service.InvalidJsonApiError,
+                requests.RequestException) as e:
+            sys.exit(f'problem {_PROBLEM.value} could not be fetched: {e}')
+        return
+
+    handler = type('QueryHandler', (_QueryHandler,), {'query_svc': query_svc})
+    query_server = server.ThreadingHTTPServer(('127.0.0.1', _QUERY_PORT.value), handler)
+    logging.info('Serving problems on http://127.0.0.1:%d/problem/<id>', _QUERY_PORT.value)
+
+    try:
+        query_server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info('Stopping server')
+    finally:
+        query_server.server_close()
+
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
@@ -0,0 +1,265 @@
+"""This module rebuilds the run data from the downloaded solutions.
+
+When the data file is lost or corrupted, the problems and their
+difficulty are recovered from the solution files instead of being
+downloaded again through gmail. Every solution file starts with the
+`## Problem #N` header and is saved in the folder of its difficulty.
+
+The path of every solution is saved as well, so that a link that is
+found again later is matched to its file instead of being downloaded.
+
+Unless --noseed_from_gmail is passed, gmail is then searched so that
+the next regular run doesn't list and fetch every email again:
+
+* the listing of every account resumes from the date of the email of
+  the newest recovered problem, so only the newer emails are listed
+* the emails of the problems missing below it are found with targeted
+  queries, as fill_gaps.py does, and go through the links and
+  solutions stages
+"""
+
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from absl import flags
+from absl import logging
+
+from concurrent import futures
+from email import utils
+import os
+import re
+
+import dcp_service
+import download_helper
+import download_solutions
+import fill_gaps
+import gmail_service
+import html_service
+
+
+_WORKERS = flags.DEFINE_integer(
+    'workers', 16,
+    'Number of threads used to read the solution files')
+_SEED_FROM_GMAIL = flags.DEFINE_boolean(
+    'seed_from_gmail', True,
+    'Whether to search gmail for the listing start and the missing problems, '
+    'otherwise the next run lists and fetches every email again')
+
+_PROBLEM_FILE_PATTERN = re.compile(r'^problem_(\d+)\.md$')
+_PROBLEM_HEADER_PATTERN = re.compile(r'^## Problem #(\d+)')
+
+
+def scan_solution_files(solutions_dir: str) -> Sequence[Tuple[str, str]]:
+    """Returns the solution files in the difficulty folders.
+
+    Args:
+        solutions_dir: The folder with one sub folder per difficulty
+
+    Returns:
+        A list of the difficulty and the path of each file
+    """
+
+    logging.info('Scanning solutions in %s', solutions_dir)
+
+    solution_files = []
+    for difficulty_entry in os.scandir(solutions_dir):
+        if not difficulty_entry.is_dir() or difficulty_entry.name.startswith('.'):
+            continue
+
+        for entry in os.scandir(difficulty_entry.path):
+            if entry.is_file() and _PROBLEM_FILE_PATTERN.match(entry.name):
+                solution_files.append((difficulty_entry.name, entry.path))
+
+    logging.info('Found %d solution files', len(solution_files))
+    return solution_files
+
+
+def read_problem_id(file_path: str) -> Optional[int]:
+    """Returns the problem id from the header of a solution file.
+
+    Args:
+        file_path: The path of the solution file
+
+    Returns:
+        The problem id, or None if the file has no problem header
+    """
+
+    with open(file_path, 'r') as file:
+        header = file.readline()
+
+    match = _PROBLEM_HEADER_PATTERN.match(header)
+    if not match:
+        logging.warning('No problem header in %s', file_path)
+        return None
+
+    return int(match.group(1))
+
+
+def read_solutions(
+    solution_files: Sequence[Tuple[str, str]],
+    workers: int) -> Tuple[Dict[int, str], Dict[int, str]]:
+    """Reads the problem id of every solution file on a thread pool.
+
+    Args:
+        solution_files: A list of the difficulty and the path of each file
+        workers: The number of threads
+
+    Returns:
+        A tuple of the dictionary of problem id and difficulty,
+        and the dictionary of problem id and file path
+    """
+
+    logging.info('Reading %d solution files', len(solution_files))
+
+    problems = {}
+    solution_paths = {}
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        problem_ids = executor.map(
+            read_problem_id,
+            [file_path for _, file_path in solution_files])
+
+        for (difficulty, file_path), problem_id in zip(solution_files, problem_ids):
+            if problem_id is None:
+                continue
+
+            solution_paths[problem_id] = file_path
+            if difficulty != download_solutions.UNKNOWN_DIFFICULTY:
+                problems[problem_id] = difficulty
+
+    return problems, solution_paths
+
+
+def rebuild_run_data(
+    run_data: Dict[str, object],
+    problems: Dict[int, str],
+    solution_paths: Dict[int, str]) -> Dict[str, object]:
+    """Merges the problems and paths read from the files into the run data.
+
+    Anything still present in the run data is kept as is.
+
+    Args:
+        run_data: The state of the runtime data that could be loaded
+        problems: Dictionary of problem id and difficulty
+        solution_paths: Dictionary of problem id and file path
+
+    Returns:
+        The rebuilt state of the runtime data
+    """
+
+    logging.info('Rebuilding run data')
+
+    saved_problems = run_data.get('problems', {})
+    for problem_id, difficulty in problems.items():
+        saved_problems.setdefault(problem_id, difficulty)
+    run_data['problems'] = saved_problems
+
+    saved_paths = run_data.get('solution_paths', {})
+    saved_paths.update(solution_paths)
+    run_data['solution_paths'] = saved_paths
+
+    links = run_data.get('links', {})
+    for link, file_path in links.items():
+        problem_id = html_service.Html_Service.get_problem_number(link)
+        if not file_path and problem_id in solution_paths:
+            links[link] = solution_paths[problem_id]
+    run_data['links'] = links
+
+    return run_data
+
+
+def find_problem_email_date(
+    gmail_svc: gmail_service.GmailService,
+    problem_id: int) -> Optional[int]:
+    """Returns the timestamp of the email of a problem in an account.
+
+    Args:
+        gmail_svc: The gmail service of the account
+        problem_id: The problem number
+
+    Returns:
+        The timestamp from the Date header, None if the account has no
+        email of the problem
+    """
+
+    message_ids = dcp_service.DCP_Service(gmail_svc).get_problem_messages([problem_id])
+    if not message_ids:
+        logging.info('No email of problem %d', problem_id)
+        return None
+
+    message = gmail_svc.get_message_content(message_ids[0])
+    for header in message.get('headers', []):
+        if header.get('name') == 'Date':
+            try:
+                return int(utils.parsedate_to_datetime(header.get('value')).timestamp())
+            except (TypeError, ValueError):
+                break
+
+    logging.warning('No valid date in the email of problem %d', problem_id)
+    return None
+
+
+def seed_from_gmail(
+    run_data: Dict[str, object],
+    gmail_services: Dict[str, gmail_service.GmailService],
+    ids_per_query: int) -> None:
+    """Searches gmail so that the next run only fetches the emails it needs.
+
+    Args:
+        run_data: The rebuilt state of the runtime data
+        gmail_services: The gmail service of each account
+        ids_per_query: Number of missing problems searched for with a single query
+    """
+
+    problem_ids = set(run_data['problems']) | set(run_data['solution_paths'])
+    if not problem_ids:
+        logging.warning('No problem recovered, every email will be listed again')
+        return
+
+    newest = max(problem_ids)
+    dates = download_helper.run_sharded(
+        lambda account, gmail_svc: find_problem_email_date(gmail_svc, newest),
+        gmail_services)
+
+    # an account whose listing was saved keeps it
+    fetch_times = run_data.setdefault('account_fetch_at', {})
+    for account, date in dates.items():
+        if date and account not in fetch_times:
+            logging.info('Listing %s from the email of problem %d', account, newest)
+            fetch_times[account] = date
+
+    found = fill_gaps.fill_gaps(run_data, gmail_services, ids_per_query)
+    logging.info('Found %d problems without a solution file', len(found))
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    solution_files = scan_solution_files(download_helper.get_solutions_dir())
+    problems, solution_paths = read_solutions(solution_files, _WORKERS.value)
+    logging.info('Recovered %d problems and %d solutions', len(problems), len(solution_paths))
+
+    try:
+        run_data = download_helper.get_run_data(exit_on_error=False)
+    except download_helper.BadDataFileError:
+        logging.warning('Ignoring the corrupted data file')
+        run_data = {}
+
+    run_data = rebuild_run_data(run_data, problems, solution_paths)
+    download_helper.save_run_data(run_data)
+
+    if _SEED_FROM_GMAIL.value:
+        seed_from_gmail(
+            run_data,
+            download_helper.init_and_get_gmail_services(),
+            flags.FLAGS.ids_per_query)
+        download_helper.save_run_data(run_data)
+
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)
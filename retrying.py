@@ -0,0 +1,143 @@
+"""This module retries API calls that failed with a transient error.
+
+A call that fails with a transient error, e.g. a dropped connection, a
+truncated body or a 429, is sent again after an exponential backoff with
+full jitter, so that the retries of concurrent callers are spread out.
+When the response of a failed call has a Retry-After header, e.g. a 429,
+the retry waits at least as long as the server asked for. Any other
+error is raised right away.
+
+Every retry goes through the same callable, and hence through the same
+rate limiter, as the original call. The calls and retries are counted in
+the metrics of the run so that the retry amplification can be measured.
+"""
+
+from typing import Callable
+from typing import Optional
+from typing import TypeVar
+
+from absl import logging
+
+from email import utils
+import random
+import time
+
+import metrics
+import tracing
+
+
+T = TypeVar('T')
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Returns the seconds the Retry-After header of a failed call asks to wait.
+
+    The headers are read from the response of a requests error or from
+    the resp of a googleapiclient error, and the header is either a
+    number of seconds or a date.
+
+    Args:
+        error: The error raised by the call
+
+    Returns:
+        The seconds to wait, None if the error has no Retry-After header
+    """
+
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers is None:
+        headers = getattr(error, 'resp', None)
+    if not headers:
+        return None
+
+    # the headers of googleapiclient errors are lowercase, those of requests are case insensitive
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        date = utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, date.timestamp() - time.time())
+
+
+class Retrier():
+    """Sends a call again when it failed with a transient error.
+
+    Attributes:
+        _name: The name of the retried operation used in logs and metrics
+        _max_retries: The number of times a call is sent again
+        _backoff: The seconds of the first backoff, doubled on every retry
+        _max_backoff: The maximum seconds of a backoff
+        _rng: The source of the jitter
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+        max_backoff: float = 30) -> None:
+
+        self._name = name
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._rng = random.Random()
+
+
+    def get_delay(self, retry: int, retry_after: Optional[float] = None) -> float:
+        """Returns the seconds to wait before a retry.
+
+        Args:
+            retry: The number of the retry, starting at 0
+            retry_after: The seconds the server asked to wait if it did,
+                capped at the maximum backoff
+        """
+
+        delay = self._rng.uniform(0, min(self._max_backoff, self._backoff * 2 ** retry))
+        if retry_after is not None:
+            delay = max(delay, min(self._max_backoff, retry_after))
+
+        return delay
+
+
+    def call(self, func: Callable[[], T], is_transient: Callable[[Exception], bool]) -> T:
+        """Calls the function, again if it failed with a transient error.
+
+        Args:
+            func: The call to retry
+            is_transient: Whether an error raised by the call may be retried
+
+        Raises:
+            The error of the last call once the retries are used up
+        """
+
+        metrics.add(f'{self._name}.calls')
+        retry = 0
+        while True:
+            metrics.add(f'{self._name}.attempts')
+            try:
+                return func()
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+
+                if retry >= self._max_retries:
+                    metrics.add(f'{self._name}.retries_exhausted')
+                    raise
+
+                delay = self.get_delay(retry, get_retry_after(e))
+                logging.warning('Retrying %s in %.2fs after %s: %s',
+                    self._name, delay, type(e).__name__, e)
+                metrics.add(f'{self._name}.retries')
+
+                with tracing.span(f'{self._name}.retry_backoff', retry=retry):
+                    time.sleep(delay)
+                retry += 1
@@ -0,0 +1,113 @@
+"""Tests the retries of the calls that failed with a transient error.
+"""
+
+from absl.testing import absltest
+
+from unittest import mock
+
+import requests
+
+import metrics
+import retrying
+
+
+class TransientError(Exception):
+    pass
+
+
+def _is_transient(error: Exception) -> bool:
+    return isinstance(error, TransientError)
+
+
+def _get_throttled_error(retry_after: str) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after
+    return requests.HTTPError('429 Too Many Requests', response=response)
+
+
+class RetrierTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._sleep = self.enter_context(mock.patch.object(retrying.time, 'sleep'))
+
+
+    def _call(self, retrier: retrying.Retrier, errors, is_transient=_is_transient):
+        """Calls a function that raises the errors in order, then succeeds."""
+
+        func = mock.Mock(side_effect=list(errors) + ['result'])
+        return retrier.call(func, is_transient), func
+
+
+    def test_backoff_bounds(self):
+        retrier = retrying.Retrier('test_retry', backoff=0.5, max_backoff=3)
+
+        for retry, bound in [(0, 0.5), (1, 1), (2, 2), (3, 3), (10, 3)]:
+            for _ in range(50):
+                delay = retrier.get_delay(retry)
+                self.assertGreaterEqual(delay, 0)
+                self.assertLessEqual(delay, bound)
+
+
+    def test_retry_after_is_honoured(self):
+        retrier = retrying.Retrier('test_retry', backoff=0.5, max_backoff=30)
+
+        self.assertGreaterEqual(retrier.get_delay(0, 5), 5)
+        self.assertEqual(retrier.get_delay(0, 60), 30)
+
+
+    def test_retry_after_of_response_is_waited(self):
+        retrier = retrying.Retrier('test_retry', backoff=0.5, max_backoff=30)
+
+        result, func = self._call(
+            retrier,
+            [_get_throttled_error('4')],
+            lambda e: isinstance(e, requests.HTTPError))
+
+        self.assertEqual(result, 'result')
+        self.assertEqual(func.call_count, 2)
+        self.assertGreaterEqual(self._sleep.call_args[0][0], 4)
+
+
+    def test_get_retry_after(self):
+        self.assertEqual(retrying.get_retry_after(_get_throttled_error('7')), 7)
+        self.assertIsNone(retrying.get_retry_after(TransientError()))
+        self.assertAlmostEqual(
+            retrying.get_retry_after(_get_throttled_error('Thu, 01 Jan 1970 00:00:00 GMT')), 0)
+
+
+    def test_transient_error_is_retried(self):
+        retrier = retrying.Retrier('test_retry', max_retries=2)
+
+        result, func = self._call(retrier, [TransientError(), TransientError()])
+
+        self.assertEqual(result, 'result')
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(self._sleep.call_count, 2)
+
+
+    def test_gives_up_after_max_retries(self):
+        retrier = retrying.Retrier('test_retry_exhausted', max_retries=2)
+        exhausted = metrics.get('test_retry_exhausted.retries_exhausted')
+
+        with self.assertRaises(TransientError):
+            self._call(retrier, [TransientError()] * 3)
+
+        self.assertEqual(self._sleep.call_count, 2)
+        self.assertEqual(metrics.get('test_retry_exhausted.retries_exhausted'), exhausted + 1)
+
+
+    def test_non_transient_error_is_not_retried(self):
+        retrier = retrying.Retrier('test_retry', max_retries=2)
+        func = mock.Mock(side_effect=ValueError('bad request'))
+
+        with self.assertRaises(ValueError):
+            retrier.call(func, _is_transient)
+
+        self.assertEqual(func.call_count, 1)
+        self._sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,78 @@
+"""This module coalesces identical API calls that are in flight.
+
+When a call is made for a key while a call for the same key is still
+running, e.g. the same message fetched by two workers, the second caller
+waits for the running call and gets its result, or its error, instead of
+calling the API again. Once the call completes the next call for the key
+goes to the API again, hence nothing is cached.
+
+The coalesced calls are counted in the metrics of the run.
+"""
+
+from typing import Callable
+from typing import Hashable
+from typing import TypeVar
+
+from absl import logging
+
+from concurrent import futures
+import threading
+
+import metrics
+
+
+T = TypeVar('T')
+
+
+class SingleFlight():
+    """Shares a single call among the concurrent callers of the same key.
+
+    Attributes:
+        _name: The name of the coalesced operation used in logs and metrics
+        _calls: The future of the running call of each key
+        _lock: Guards the running calls
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+
+    def call(self, key: Hashable, func: Callable[[], T]) -> T:
+        """Calls the function unless a call for the same key is running.
+
+        Args:
+            key: Identifies the identical calls, e.g. the message id
+            func: The call to make
+
+        Returns:
+            The result of the call, shared with the coalesced callers
+
+        Raises:
+            The error of the call, raised to the coalesced callers as well
+        """
+
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = futures.Future()
+                self._calls[key] = future
+
+        if not is_leader:
+            logging.info('Waiting for the %s call of %s in flight', self._name, key)
+            metrics.add(f'{self._name}.coalesced')
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,80 @@
+"""Tests the coalescing of the concurrent calls of the same key.
+"""
+
+from absl.testing import absltest
+
+from concurrent import futures
+import threading
+
+import metrics
+import single_flight
+
+
+class SingleFlightTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._flights = single_flight.SingleFlight('test_flight')
+        self._started = threading.Event()
+        self._release = threading.Event()
+        self._calls = 0
+
+
+    def _slow_call(self, error: Exception = None) -> str:
+        self._calls += 1
+        self._started.set()
+        self._release.wait(5)
+        if error:
+            raise error
+        return 'result'
+
+
+    def _call_twice(self, key, func):
+        """Makes the second call while the first one is in flight."""
+
+        coalesced = metrics.get('test_flight.coalesced')
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(self._flights.call, key, func)
+            self._started.wait(5)
+            second = executor.submit(self._flights.call, key, func)
+            while metrics.get('test_flight.coalesced') == coalesced:
+                threading.Event().wait(0.01)
+            self._release.set()
+        return first, second
+
+
+    def test_same_key_is_called_once(self):
+        first, second = self._call_twice('key', self._slow_call)
+
+        self.assertEqual(first.result(), 'result')
+        self.assertEqual(second.result(), 'result')
+        self.assertEqual(self._calls, 1)
+
+
+    def test_error_reaches_every_waiter(self):
+        error = ValueError('failed')
+        first, second = self._call_twice('key', lambda: self._slow_call(error))
+
+        self.assertIs(first.exception(), error)
+        self.assertIs(second.exception(), error)
+        self.assertEqual(self._calls, 1)
+
+
+    def test_completed_call_is_not_cached(self):
+        self._release.set()
+        self._flights.call('key', self._slow_call)
+        self._flights.call('key', self._slow_call)
+
+        self.assertEqual(self._calls, 2)
+
+
+    def test_different_keys_are_not_coalesced(self):
+        self._release.set()
+        self._flights.call('first', self._slow_call)
+        self._flights.call('second', self._slow_call)
+
+        self.assertEqual(self._calls, 2)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,336 @@
+"""This module keeps the run data in a compact form.
+
+The run data keeps a full subject string for every email, a full link
+with its token for every solution and a difficulty string for every
+problem. At a hundred thousand items most of its memory goes to the
+headers of these small objects rather than to their content.
+
+The compact state keeps the same data in flat arrays instead:
+
+* the message ids are stored as 64 bit integers, along with the problem
+  id and difficulty parsed from their subject and a bitset of the emails
+  that were processed
+* the difficulties are small integers, interned in a table seeded with
+  the Difficulty enum
+* the links are decomposed into their problem ids and tokens, read as
+  slotted (problem id, token) records, and a bitset of the links that
+  were downloaded, and only the solution paths that are not in the
+  standard location are stored
+* the problems are a byte per problem id holding their difficulty
+
+A subject is reduced to the problem id and difficulty that
+DCP_Service.parse_subject reads from it. A subject that is not in the
+standard format rebuilt from them, e.g. a forwarded email or one without
+a difficulty, is kept as well, and so is any other item that cannot be
+decomposed. The state converts from and to the run data with
+from_run_data and to_run_data without losing anything.
+"""
+
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import array
+import enum
+import os
+import re
+import sys
+
+import dcp_service
+
+
+class Difficulty(enum.IntEnum):
+    """The difficulties of the problems, 0 if it is not known.
+    """
+
+    UNKNOWN = 0
+    EASY = 1
+    MEDIUM = 2
+    HARD = 3
+
+
+_LINK_PATTERN = re.compile(r'^https://www\.dailycodingproblem\.com/solution/(\d+)\?token=([^&#]+)$')
+_LINK_FORMAT = 'https://www.dailycodingproblem.com/solution/{}?token={}'
+_SUBJECT_FORMAT = 'Daily Coding Problem: Problem #{} [{}]'
+
+
+class Bitset():
+    """A fixed size set of flags backed by a bytearray.
+
+    Attributes:
+        _bits: The flags, eight per byte
+    """
+
+    __slots__ = ('_bits',)
+
+    def __init__(self, size: int = 0) -> None:
+        self._bits = bytearray((size + 7) // 8)
+
+
+    def __getitem__(self, index: int) -> bool:
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+
+    def __setitem__(self, index: int, value: bool) -> None:
+        if index >> 3 >= len(self._bits):
+            self._bits.extend(bytes((index >> 3) - len(self._bits) + 1))
+
+        if value:
+            self._bits[index >> 3] |= 1 << (index & 7)
+        else:
+            self._bits[index >> 3] &= ~(1 << (index & 7)) & 0xff
+
+
+    def count(self) -> int:
+        """Returns the number of flags that are set.
+        """
+
+        return sum(bin(byte).count('1') for byte in self._bits)
+
+
+class LinkRecord():
+    """A solution link decomposed into its problem id and token.
+    """
+
+    __slots__ = ('problem_id', 'token')
+
+    def __init__(self, problem_id: int, token: str) -> None:
+        self.problem_id = problem_id
+        self.token = token
+
+
+    def get_link(self) -> str:
+        """Returns the full solution link.
+        """
+
+        return _LINK_FORMAT.format(self.problem_id, self.token)
+
+
+class CompactState():
+    """The run data stored in flat arrays.
+
+    Attributes:
+        difficulties: The names of the difficulties, indexed by their code
+        email_ids: The message ids as integers
+        email_problems: The problem id in the subject of each email, 0 if none
+        email_difficulties: The difficulty code in the subject of each email
+        email_accounts: The account code of each email, 0 for the default account
+        processed: Whether each email was processed
+        accounts: The token files of the accounts, indexed by their code
+        link_problems: The problem id of each solution link
+        link_tokens: The token of each solution link
+        downloaded: Whether the solution of each link was downloaded
+        problems: The difficulty code of each problem id
+        solutions_dir: The folder of the standard solution paths
+        extra: Everything that could not be decomposed, e.g. the subjects
+            and paths that are not standard and the rest of the run data
+    """
+
+    __slots__ = (
+        'difficulties', 'email_ids', 'email_problems', 'email_difficulties',
+        'email_accounts', 'processed', 'accounts', 'link_problems', 'link_tokens', 'downloaded',
+        'problems', 'solutions_dir', 'extra')
+
+    def __init__(self, solutions_dir: str = 'solutions') -> None:
+        self.difficulties = [difficulty.name.capitalize() for difficulty in Difficulty]
+        self.email_ids = array.array('Q')
+        self.email_problems = array.array('i')
+        self.email_difficulties = array.array('B')
+        self.email_accounts = array.array('B')
+        self.processed = Bitset()
+        self.accounts = [None]
+        self.link_problems = array.array('i')
+        self.link_tokens = []
+        self.downloaded = Bitset()
+        self.problems = bytearray()
+        self.solutions_dir = solutions_dir
+        self.extra = {
+            'emails': {},
+            'email_accounts': {},
+            'subjects': {},
+            'links': {},
+            'paths': {},
+            'run_data': {},
+        }
+
+
+    def intern_difficulty(self, name: str) -> int:
+        """Returns the code of a difficulty, adding it if it is new.
+
+        Args:
+            name: The name of the difficulty
+        """
+
+        try:
+            return self.difficulties.index(name)
+        except ValueError:
+            self.difficulties.append(sys.intern(name))
+            return len(self.difficulties) - 1
+
+
+    def get_difficulty(self, problem_id: int) -> Optional[str]:
+        """Returns the difficulty of a problem, None if it is not known.
+
+        Args:
+            problem_id: The problem number
+        """
+
+        if problem_id >= len(self.problems) or not self.problems[problem_id]:
+            return None
+
+        return self.difficulties[self.problems[problem_id]]
+
+
+    def _get_standard_path(self, problem_id: int) -> Optional[str]:
+        """Returns the standard solution path of a problem if its difficulty is known.
+        """
+
+        difficulty = self.get_difficulty(problem_id)
+        if not difficulty:
+            return None
+
+        return os.path.join(self.solutions_dir, difficulty, f'problem_{problem_id:03d}.md')
+
+
+    def _get_standard_subject(self, index: int) -> str:
+        """Returns the subject of an email rebuilt from its problem id and difficulty.
+        """
+
+        return _SUBJECT_FORMAT.format(
+            self.email_problems[index],
+            self.difficulties[self.email_difficulties[index]])
+
+
+    def _add_email(self, email_id: str, subject: Optional[str], account: Optional[str]) -> None:
+        """Adds an email, kept as is if its id or subject cannot be decomposed.
+        """
+
+        problem = dcp_service.DCP_Service.parse_subject(subject) if subject else None
+        try:
+            numeric_id = int(email_id, 16)
+        except ValueError:
+            numeric_id = None
+
+        if (numeric_id is None or numeric_id >= 1 << 64 or f'{numeric_id:x}' != email_id
+            or (subject and not problem)):
+            self.extra['emails'][email_id] = subject
+            if account:
+                self.extra['email_accounts'][email_id] = account
+            return
+
+        if account not in self.accounts:
+            self.accounts.append(account)
+
+        index = len(self.email_ids)
+        self.email_ids.append(numeric_id)
+        self.email_problems.append(problem[0] if problem else 0)
+        self.email_difficulties.append(self.intern_difficulty(problem[1]) if problem else 0)
+        self.email_accounts.append(self.accounts.index(account))
+        self.processed[index] = bool(subject)
+
+        if subject and subject != self._get_standard_subject(index):
+            self.extra['subjects'][index] = subject
+
+
+    def _add_link(self, link: str, file_path: Optional[str]) -> None:
+        """Adds a link, kept as is if it cannot be decomposed.
+        """
+
+        match = _LINK_PATTERN.match(link)
+        if not match:
+            self.extra['links'][link] = file_path
+            return
+
+        problem_id = int(match.group(1))
+        index = len(self.link_problems)
+        self.link_problems.append(problem_id)
+        self.link_tokens.append(match.group(2))
+        self.downloaded[index] = bool(file_path)
+
+        if file_path and file_path != self._get_standard_path(problem_id):
+            self.extra['paths'][index] = file_path
+
+
+    @classmethod
+    def from_run_data(cls, run_data: Dict[str, object], solutions_dir: str = 'solutions') -> 'CompactState':
+        """Returns the compact state of the run data.
+
+        Args:
+            run_data: The state of the runtime data
+            solutions_dir: The folder where the solutions are saved
+        """
+
+        state = cls(solutions_dir)
+
+        problems = run_data.get('problems', {})
+        if problems:
+            state.problems = bytearray(max(problems) + 1)
+        for problem_id, difficulty in problems.items():
+            state.problems[problem_id] = state.intern_difficulty(difficulty)
+
+        email_accounts = run_data.get('email_accounts', {})
+        for email_id, subject in run_data.get('emails', {}).items():
+            state._add_email(email_id, subject, email_accounts.get(email_id))
+
+        for link, file_path in run_data.get('links', {}).items():
+            state._add_link(link, file_path)
+
+        state.extra['run_data'] = {key: value for key, value in run_data.items()
+            if key not in ('problems', 'emails', 'email_accounts', 'links')}
+
+        return state
+
+
+    def to_run_data(self) -> Dict[str, object]:
+        """Returns the run data of the compact state.
+        """
+
+        run_data = dict(self.extra['run_data'])
+
+        run_data['problems'] = {problem_id: self.difficulties[code]
+            for problem_id, code in enumerate(self.problems) if code}
+
+        emails = {}
+        email_accounts = {}
+        for index, numeric_id in enumerate(self.email_ids):
+            email_id = f'{numeric_id:x}'
+            subject = None
+            if self.processed[index]:
+                subject = self.extra['subjects'].get(index) or self._get_standard_subject(index)
+            emails[email_id] = subject
+
+            if self.email_accounts[index]:
+                email_accounts[email_id] = self.accounts[self.email_accounts[index]]
+        emails.update(self.extra['emails'])
+        email_accounts.update(self.extra['email_accounts'])
+        run_data['emails'] = emails
+        if email_accounts:
+            run_data['email_accounts'] = email_accounts
+
+        links = {}
+        for index, record in enumerate(self.get_link_records()):
+            file_path = None
+            if self.downloaded[index]:
+                file_path = self.extra['paths'].get(index) or self._get_standard_path(record.problem_id)
+            links[record.get_link()] = file_path
+        links.update(self.extra['links'])
+        run_data['links'] = links
+
+        return run_data
+
+
+    def get_link_records(self) -> Iterator[LinkRecord]:
+        """Yields the decomposed solution links in order.
+        """
+
+        for problem_id, token in zip(self.link_problems, self.link_tokens):
+            yield LinkRecord(problem_id, token)
+
+
+    def get_pending_links(self) -> List[str]:
+        """Returns the links whose solution was not downloaded yet.
+        """
+
+        return [record.get_link() for index, record in enumerate(self.get_link_records())
+            if not self.downloaded[index]]
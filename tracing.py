@@ -0,0 +1,93 @@
+"""This module records lightweight tracing spans of a run.
+
+A span measures the wall time of a block of code along with attributes
+such as the message id or the problem id being processed. The spans are
+kept in memory and exported as a Chrome trace file that can be loaded
+in chrome://tracing or https://ui.perfetto.dev.
+
+Tracing is disabled by default, in which case a span does nothing but
+check a flag.
+
+Methods:
+    enable : starts recording the spans
+    span : context manager measuring a block of code
+    export : writes the recorded spans to a trace file
+"""
+
+from typing import Iterator
+
+from absl import logging
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+_enabled = False
+_events = []
+_lock = threading.Lock()
+_origin_ns = time.perf_counter_ns()
+
+
+def enable() -> None:
+    """Starts recording the spans.
+    """
+
+    global _enabled
+    logging.info('Tracing is enabled')
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    """Returns whether spans are being recorded.
+    """
+
+    return _enabled
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: object) -> Iterator[None]:
+    """Records the duration of the enclosed block as a span.
+
+    Args:
+        name: The name of the operation
+        attributes: The attributes of the span, shown as args in the trace
+    """
+
+    if not _enabled:
+        yield
+        return
+
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end_ns = time.perf_counter_ns()
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': (start_ns - _origin_ns) / 1000,
+            'dur': (end_ns - start_ns) / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': attributes,
+        }
+        with _lock:
+            _events.append(event)
+
+
+def export(file_path: str) -> None:
+    """Writes the recorded spans to a Chrome trace file.
+
+    Args:
+        file_path: The path of the trace file
+    """
+
+    with _lock:
+        events = list(_events)
+
+    logging.info('Writing %d spans to trace file %s', len(events), file_path)
+    with open(file_path, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file, default=str)
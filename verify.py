@@ -0,0 +1,270 @@
+"""This module verifies that the code of the downloaded solutions runs.
+
+The fenced python code blocks of every solution are joined into a single
+program, in the order they appear, and executed in a subprocess. The
+programs run on a process pool, each with a timeout and with limits on
+its CPU time, memory, open files and written file size, from an empty
+temporary folder and without the environment of the downloader.
+
+The result of every program is cached by the hash of its code, so only
+the solutions whose code was added or changed are executed again.
+"""
+
+from typing import Dict
+from typing import Sequence
+from typing import Tuple
+
+from absl import flags
+from absl import logging
+
+from concurrent import futures
+import functools
+import hashlib
+import os
+import pickle
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+
+import download_helper
+
+
+_VERIFY_CACHE_FILE = flags.DEFINE_string(
+    'verify_cache_file', 'data/verify_cache.pickle',
+    'The path where the results of the verified solutions are saved')
+_SNIPPET_TIMEOUT = flags.DEFINE_integer(
+    'snippet_timeout', 10,
+    'Seconds the code of a solution may run for')
+_WORKERS = flags.DEFINE_integer(
+    'workers', None,
+    'Number of processes used to run the solutions, defaults to the CPU count')
+_REVERIFY = flags.DEFINE_boolean(
+    'reverify', False,
+    'Run all the solutions even if their result is cached')
+
+PASSED = 'passed'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+
+_PROBLEM_FILE_PATTERN = re.compile(r'^problem_(\d+)\.md$')
+_CODE_BLOCK_PATTERN = re.compile(r'^```[ \t]*(?:python3?|py)[ \t]*\n(.*?)^```', re.MULTILINE | re.DOTALL)
+
+_MEMORY_LIMIT = 512 * 1024 * 1024
+_FILE_SIZE_LIMIT = 16 * 1024 * 1024
+_OPEN_FILES_LIMIT = 64
+_OUTPUT_LIMIT = 2000
+
+
+def scan_solutions(solutions_dir: str) -> Dict[int, str]:
+    """Returns all the solution files in the solutions folder.
+
+    Args:
+        solutions_dir: The folder with one sub folder per difficulty
+
+    Returns:
+        A dictionary of problem id and file path
+    """
+
+    logging.info('Scanning solutions in %s', solutions_dir)
+
+    solutions = {}
+    for difficulty_entry in os.scandir(solutions_dir):
+        if not difficulty_entry.is_dir() or difficulty_entry.name.startswith('.'):
+            continue
+
+        for entry in os.scandir(difficulty_entry.path):
+            match = _PROBLEM_FILE_PATTERN.match(entry.name)
+            if match and entry.is_file():
+                solutions[int(match.group(1))] = entry.path
+
+    logging.info('Found %d solutions', len(solutions))
+    return solutions
+
+
+def extract_program(content: str) -> str:
+    """Returns the python code blocks of a solution joined into a program.
+
+    Args:
+        content: The markdown content of the solution
+
+    Returns:
+        The program, empty if the solution has no python code block
+    """
+
+    blocks = _CODE_BLOCK_PATTERN.findall(content)
+    return '\n\n'.join(block.rstrip() for block in blocks)
+
+
+def get_program_hash(program: str) -> str:
+    """Returns the hash of a program.
+
+    Args:
+        program: The code of the program
+    """
+
+    return hashlib.sha256(program.encode('utf-8')).hexdigest()
+
+
+def _limit_resources(timeout: int) -> None:
+    """Limits the resources of the subprocess before it starts running.
+
+    Args:
+        timeout: The seconds the program may run for
+    """
+
+    cpu_limit = timeout + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+    resource.setrlimit(resource.RLIMIT_AS, (_MEMORY_LIMIT, _MEMORY_LIMIT))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (_FILE_SIZE_LIMIT, _FILE_SIZE_LIMIT))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (_OPEN_FILES_LIMIT, _OPEN_FILES_LIMIT))
+
+
+def run_program(program: str, timeout: int) -> Tuple[str, str]:
+    """Runs a program in a sandboxed subprocess.
+
+    This runs in a worker process and hence only uses its arguments.
+
+    Args:
+        program: The code of the program
+        timeout: The seconds the program may run for
+
+    Returns:
+        A tuple of the status of the program and the end of its error output
+    """
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        program_path = os.path.join(work_dir, 'solution.py')
+        with open(program_path, 'w') as file:
+            file.write(program)
+
+        try:
+            result = subprocess.run(
+                [sys.executable, '-I', '-B', program_path],
+                cwd=work_dir,
+                env={'PATH': os.defpath},
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                timeout=timeout,
+                preexec_fn=functools.partial(_limit_resources, timeout))
+        except subprocess.TimeoutExpired:
+            return TIMEOUT, f'Timed out after {timeout} seconds'
+
+    if result.returncode:
+        return FAILED, result.stderr.decode('utf-8', 'replace')[-_OUTPUT_LIMIT:]
+
+    return PASSED, ''
+
+
+def get_cache() -> Dict[str, Tuple[str, str]]:
+    """Loads the results of the last verification.
+    """
+
+    cache = {}
+    if os.path.exists(_VERIFY_CACHE_FILE.value):
+        with open(_VERIFY_CACHE_FILE.value, 'rb') as file:
+            cache = pickle.load(file)
+    else:
+        logging.warning('No verify cache found, running all the solutions')
+
+    return cache
+
+
+def save_cache(cache: Dict[str, Tuple[str, str]]) -> None:
+    """Saves the results of the verification.
+
+    Args:
+        cache: Dictionary of program hash and result
+    """
+
+    logging.info('Writing verify cache: %s', _VERIFY_CACHE_FILE.value)
+    with open(_VERIFY_CACHE_FILE.value, 'wb') as file:
+        pickle.dump(cache, file)
+
+
+def verify_solutions(
+    solutions: Dict[int, str],
+    cache: Dict[str, Tuple[str, str]],
+    timeout: int,
+    workers: int,
+    reverify: bool) -> Tuple[Dict[int, Tuple[str, str]], Dict[str, Tuple[str, str]]]:
+    """Runs the code of every solution whose result isn't cached.
+
+    Args:
+        solutions: Dictionary of problem id and file path
+        cache: Dictionary of program hash and result of the last verification
+        timeout: The seconds a program may run for
+        workers: The number of worker processes
+        reverify: Whether to run all the solutions
+
+    Returns:
+        A tuple of the dictionary of problem id and result, and the new cache
+    """
+
+    programs = {}
+    for problem_id, file_path in solutions.items():
+        with open(file_path, 'r') as file:
+            program = extract_program(file.read())
+        if program:
+            programs[problem_id] = (get_program_hash(program), program)
+
+    logging.info('Found code in %d / %d solutions', len(programs), len(solutions))
+
+    # identical programs are only run once
+    pending = {}
+    for program_hash, program in programs.values():
+        if reverify or program_hash not in cache:
+            pending[program_hash] = program
+
+    logging.info('Running %d programs', len(pending))
+
+    new_cache = {}
+    if pending:
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            future_to_hash = {
+                executor.submit(run_program, program, timeout): program_hash
+                for program_hash, program in pending.items()}
+
+            for future in futures.as_completed(future_to_hash):
+                new_cache[future_to_hash[future]] = future.result()
+
+    results = {}
+    for problem_id, (program_hash, _) in programs.items():
+        results[problem_id] = new_cache.get(program_hash) or cache[program_hash]
+        new_cache[program_hash] = results[problem_id]
+
+    return results, new_cache
+
+
+def main(argv: Sequence[str]) -> None:
+    del argv
+
+    logging.info('Running program...')
+
+    solutions = scan_solutions(download_helper.get_solutions_dir())
+    cache = get_cache()
+    results, cache = verify_solutions(
+        solutions,
+        cache,
+        _SNIPPET_TIMEOUT.value,
+        _WORKERS.value,
+        _REVERIFY.value)
+    save_cache(cache)
+
+    counts = {PASSED: 0, FAILED: 0, TIMEOUT: 0}
+    for problem_id in sorted(results):
+        status, error = results[problem_id]
+        counts[status] += 1
+        if status != PASSED:
+            logging.warning('Problem %d %s:\n%s', problem_id, status, error)
+
+    print(f'{len(results)} solutions with code: {counts[PASSED]} passed, '
+        f'{counts[FAILED]} failed, {counts[TIMEOUT]} timed out')
+
+    logging.info('Completed!')
+
+
+if __name__ == '__main__':
+    download_helper.run(main)